@@ -1,6 +1,5 @@
 import __builtin__
 import cherrypy
-import copy
 import functools
 import imp
 import inspect
@@ -66,7 +65,23 @@ class _File(object):
 
 
 def file(path, content_type="application/octet-stream"):
-    return _File(os.path.abspath(path), content_type)
+    return _File(module_path(path), content_type)
+
+
+class _Chunked(object):
+    formats = {"json": "application/json",
+               "ndjson": "application/x-ndjson"}
+
+    def __init__(self, iterable, format):
+        if format not in _Chunked.formats:
+            raise ValueError("unknown chunked format '%s'" % (format))
+
+        self.iterable = iterable
+        self.format = format
+
+
+def chunked(iterable, format="json"):
+    return _Chunked(iterable, format)
 
 
 def log(section, message=None, color=None, lvl=logging.INFO):
@@ -106,6 +121,11 @@ def log_debug(section, message=None):
     log(section, message, color="\033[1;34m", lvl=logging.DEBUG)
 
 
+def module_path(path=None):
+    base = os.path.abspath(cherrypy.thread_data.modulepath)
+    return base if path is None else os.path.join(base, path)
+
+
 def request_path():
     return cherrypy.request.path_info
 
@@ -189,19 +209,31 @@ def paths(runtimepaths):
 
     # Use the import lock to have some thread safety
     imp.acquire_lock()
-    # Exclude paths we've already added to the system
-    newpaths = [path for path in newpaths if path not in sys.path]
-    # Finally, augment the path list.
-    sys.path = newpaths + sys.path
-    imp.release_lock()
+    try:
+        if cherrypy.config.get("thread-safe"):
+            # In thread-safe mode, leave the system path alone and instead
+            # remember the paths for this service; tangelo_import() will
+            # consult them when one of its imports fails.
+            modulepaths = cherrypy.config["module-paths"].get(cherrypy.thread_data.modulename, [])
+            newpaths = [path for path in newpaths if path not in modulepaths]
+            cherrypy.config["module-paths"][cherrypy.thread_data.modulename] = newpaths + modulepaths
+        else:
+            # Exclude paths we've already added to the system
+            newpaths = [path for path in newpaths if path not in sys.path]
+            # Finally, augment the path list.
+            sys.path = newpaths + sys.path
+    finally:
+        imp.release_lock()
 
 
-def config():
-    return copy.deepcopy(cherrypy.config["module-config"][cherrypy.thread_data.modulename])
+def config(mutable=False):
+    config = cherrypy.config["module-config"][cherrypy.thread_data.modulename]
+    return tangelo.util.thaw(config) if mutable else config
 
 
-def plugin_config():
-    return copy.deepcopy(cherrypy.config["plugin-config"][cherrypy.thread_data.pluginpath])
+def plugin_config(mutable=False):
+    config = cherrypy.config["plugin-config"][cherrypy.thread_data.pluginpath]
+    return tangelo.util.thaw(config) if mutable else config
 
 
 def store():
@@ -229,38 +261,55 @@ def types(**typefuncs):
     declared as functions taking typed arguments instead, eliminating
     the overhead of having to perform type conversions manually.
 
+    Besides a function, a conversion may be given as a NumPy dtype, or as a
+    single-element list holding a function or dtype, meaning that the argument
+    is a list (e.g., from a repeated query argument) whose elements are to be
+    converted; with a dtype, the result is a NumPy array.
+
     If type conversion fails for any argument, the wrapped function will return
     a dict describing the exception that was raised.
     """
+    converters = {name: tangelo.util.type_converter(spec) for name, spec in typefuncs.iteritems()}
+
     def wrap(f):
+        # Analyze the wrapped function's arguments once, up front, so that
+        # each call only has to look up where each typed argument lives.
+        argspec = inspect.getargspec(f)
+        defaults = argspec.defaults or ()
+
+        # Positional arguments beyond those named in the signature are dropped,
+        # unless the function accepts them.
+        nargs = None if argspec.varargs else len(argspec.args)
+        required = set(argspec.args[:len(argspec.args) - len(defaults)])
+
+        # For each typed argument: its conversion function, its position (or
+        # None if it can only be passed by keyword), and whether it may be
+        # omitted (in which case it simply takes its default value).
+        layout = []
+        for name, convert in converters.iteritems():
+            try:
+                index = argspec.args.index(name)
+            except ValueError:
+                index = None
+
+            optional = index is not None and name not in required
+            layout.append((name, convert, index, optional))
+
         @functools.wraps(f)
         def typed_func(*pargs, **kwargs):
-            # Analyze the incoming arguments so we know how to apply the
-            # type-conversion functions in `typefuncs`.
-            argspec = inspect.getargspec(f)
-
-            # The `args` property contains the list of named arguments passed to
-            # f.  Construct a dict mapping from these names to the values that
-            # were passed.
-            #
-            # It is possible that `args` contains names that are not represented
-            # in `pargs`, if some of the arguments are passed as keyword
-            # arguments.  In this case, the relative shortness of `pargs` will
-            # cause the call to zip() to truncate the `args` list, and the
-            # keyword-style passed arguments will simply be present in `kwargs`.
-            pargs_dict = {name: value for (name, value) in zip(argspec.args, pargs)}
-
             # Begin converting arguments according to the functions given in
             # `typefuncs`.  If a given name does not appear in `typefuncs`,
             # simply leave it unchanged.  If a name appears in `typefuncs` that
-            # does not appear in the argument list, this is considered an error.
+            # does not appear in the arguments (and has no default value), this
+            # is considered an error.
+            pargs = list(pargs[:nargs])
             try:
-                for name, func in typefuncs.iteritems():
-                    if name in pargs_dict:
-                        pargs_dict[name] = func(pargs_dict[name])
+                for name, convert, index, optional in layout:
+                    if index is not None and index < len(pargs):
+                        pargs[index] = convert(pargs[index])
                     elif name in kwargs:
-                        kwargs[name] = func(kwargs[name])
-                    else:
+                        kwargs[name] = convert(kwargs[name])
+                    elif not optional:
                         http_status(400, "Unknown Argument Name")
                         content_type("application/json")
                         return {"error": "'%s' was registered for type conversion but did not appear in the arguments list" % (name)}
@@ -269,15 +318,6 @@ def types(**typefuncs):
                 content_type("application/json")
                 return {"error": str(e)}
 
-            # Unroll `pargs` into a list of arguments that are in the correct
-            # order.
-            pargs = []
-            for name in argspec.args:
-                try:
-                    pargs.append(pargs_dict[name])
-                except KeyError:
-                    break
-
             # Call the wrapped function using the converted arguments.
             return f(*pargs, **kwargs)
 
@@ -330,18 +370,16 @@ def tangelo_import(*args, **kwargs):
     try:
         return builtin_import(*args, **kwargs)
     except ImportError:
-        if not hasattr(cherrypy.thread_data, "modulepath"):
-            raise
-        path = os.path.abspath(cherrypy.thread_data.modulepath)
-        root = os.path.abspath(cherrypy.config.get("webroot"))
+        paths = tangelo.util.service_import_paths()
         result = None
         imp.acquire_lock()
         oldpath = sys.path
         try:
-            # If the module's path isn't in the system path but is in our
-            # serving area, temporarily add it and try the import again.
-            if path not in sys.path and (path == root or path.startswith(root + os.path.sep)):
-                sys.path = [path] + sys.path
+            # If the module's path (or any path it registered in thread-safe
+            # mode) isn't in the system path but is in our serving area,
+            # temporarily add it and try the import again.
+            if paths:
+                sys.path = paths + sys.path
                 result = builtin_import(*args, **kwargs)
         finally:
             sys.path = oldpath
@@ -11,6 +11,7 @@ import types
 import ws4py.server
 
 import tangelo
+import tangelo.eventloop
 import tangelo.server
 import tangelo.util
 import tangelo.websocket
@@ -112,7 +113,11 @@ class Config(object):
                "cert": types.StringTypes,
                "root": types.StringTypes,
                "plugins": [list],
-               "server_settings": [dict]}
+               "server_settings": [dict],
+               "route_table": [bool],
+               "thread_safe": [bool],
+               "url_cache_size": [int],
+               "cache_revalidate": [int, float]}
 
     def __init__(self, filename):
         for option in Config.options:
@@ -221,6 +226,8 @@ def main():
     p.add_argument("--cert", type=str, default=None, metavar="FILE", help="the path to the SSL certificate.  You must also specify --key to serve content over https.")
     p.add_argument("--examples", action="store_true", default=None, help="Serve the Tangelo example applications")
     p.add_argument("--watch", action="store_true", default=None, help="Add the watch plugin (reload python files if they change).")
+    p.add_argument("--route-table", action="store_true", default=None, help="scan the served directories at startup to resolve URLs from memory")
+    p.add_argument("--thread-safe", action="store_true", default=None, help="run web services without changing the process-wide working directory or module path")
     args = p.parse_args()
 
     # If version flag is present, print the version number and exit.
@@ -351,6 +358,13 @@ def main():
     cherrypy.config["showpy"] = showpy
     tangelo.log_info("TANGELO", "Web service source code serving %s" % ("enabled" if showpy else "disabled"))
 
+    # Determine whether web services should run without touching process-wide
+    # state (the working directory and the module search path), so that they
+    # can safely run concurrently.
+    thread_safe = bool(args.thread_safe or config.thread_safe)
+    cherrypy.config["thread-safe"] = thread_safe
+    tangelo.log_info("TANGELO", "Thread-safe service execution %s" % ("enabled" if thread_safe else "disabled"))
+
     # Extract the rest of the arguments, giving priority first to command line
     # arguments, then to the configuration file (if any), and finally to a
     # hard-coded default value.
@@ -436,16 +450,35 @@ def main():
     # Set the web root directory.
     cherrypy.config.update({"webroot": root})
 
+    # Configure the cache of URL analysis results.  By default, cached results
+    # are revalidated against the filesystem on every use; a positive
+    # revalidation interval lets them be trusted for that many seconds without
+    # any filesystem access at all.
+    url_cache_size = config.url_cache_size if config.url_cache_size is not None else 1024
+    cache_revalidate = config.cache_revalidate or 0
+    tangelo.server.UrlAnalyzer.instance.configure_cache(url_cache_size, cache_revalidate)
+    if url_cache_size > 0:
+        tangelo.log_info("TANGELO", "URL analysis cache size: %d" % (url_cache_size))
+        tangelo.log_info("TANGELO", "\tRevalidation interval: %s seconds" % (cache_revalidate))
+    else:
+        tangelo.log_info("TANGELO", "URL analysis cache disabled")
+
     # Place an empty dict to hold per-module configuration into the global
     # configuration object, and one for persistent per-module storage (the
     # latter can be manipulated by the service).
     cherrypy.config.update({"module-config": {}})
     cherrypy.config.update({"module-store": {}})
+    cherrypy.config.update({"module-paths": {}})
 
     # Analogs of the module storage dicts, but for plugins.
     cherrypy.config.update({"plugin-config": {}})
     cherrypy.config.update({"plugin-store": {}})
 
+    # Create the cache of loaded service modules, and share it with plugins
+    # that run services themselves.
+    module_cache = tangelo.util.ModuleCache()
+    cherrypy.config.update({"module-cache": module_cache})
+
     # Create a plugin manager.
     plugins = tangelo.server.Plugins("tangelo.plugin", config=config.plugins, plugin_dir=get_bundled_plugin_directory())
 
@@ -459,14 +492,35 @@ def main():
     # shutdown).
     cherrypy.config.update({"plugins": plugins})
 
+    # If requested, build an in-memory table of the served directory trees
+    # (the web root plus every plugin's web directory), and keep it current
+    # with a periodic background refresh.
+    if args.route_table or config.route_table:
+        route_roots = [root] + [plugin.path + "/web" for plugin in plugins.plugins.values()]
+        tangelo.log_info("TANGELO", "Building route table")
+        routes = tangelo.server.RouteTable(route_roots)
+        tangelo.server.UrlAnalyzer.instance.configure_routes(routes)
+        cherrypy.process.plugins.Monitor(cherrypy.engine, routes.refresh, frequency=1, name="RouteTable").subscribe()
+
     # Create an instance of the main handler object.
-    module_cache = tangelo.util.ModuleCache()
     tangelo_server = tangelo.server.Tangelo(module_cache=module_cache, plugins=plugins)
     rootapp = cherrypy.Application(tangelo_server, "/")
 
+    # Shut down the worker process pools for web services when the server
+    # stops.
+    cherrypy.engine.subscribe("stop", tangelo_server.pools.terminate)
+    cherrypy.engine.subscribe("exit", tangelo_server.pools.close)
+
+    # Likewise, stop the event loop running coroutine web services.
+    cherrypy.engine.subscribe("stop", tangelo.eventloop.EventLoop.instance.stop)
+
     # Place an AuthUpdate handler in the Tangelo object if access authorization
     # is on.
     tangelo_server.auth_update = tangelo.server.AuthUpdate(app=rootapp)
+    tangelo_server.auth_update.revalidate = cache_revalidate
+
+    # Share it with plugins that run services themselves.
+    cherrypy.config.update({"auth-update": tangelo_server.auth_update})
 
     # Mount the root application object.
     cherrypy.tree.mount(rootapp, config={"/": {"tools.sessions.on": sessions},
@@ -535,8 +589,12 @@ def main():
             # Set the process home directory to be the dropped-down user's.
             os.environ["HOME"] = os.path.expanduser("~%s" % (user))
 
-            # Perform the actual UID/GID change.
+            # Perform the actual UID/GID change.  The worker process spawner
+            # makes the change itself in case it starts before the change takes
+            # place.
             cherrypy.process.plugins.DropPrivileges(cherrypy.engine, uid=uid, gid=gid).subscribe()
+            tangelo_server.pools.uid = uid
+            tangelo_server.pools.gid = gid
         else:
             tangelo.log_info("TANGELO", "Not performing privilege drop (because not running as superuser)")
 
@@ -546,11 +604,6 @@ def main():
     tangelo.websocket.WebSocketLowPriorityPlugin(cherrypy.engine).subscribe()
     cherrypy.tools.websocket = ws4py.server.cherrypyserver.WebSocketTool()
 
-    # Replace the stock auth_digest and auth_basic tools with ones that have
-    # slightly lower priority (so the AuthUpdate tool can run before them).
-    cherrypy.tools.auth_basic = cherrypy.Tool("before_handler", cherrypy.lib.auth_basic.basic_auth, priority=2)
-    cherrypy.tools.auth_digest = cherrypy.Tool("before_handler", cherrypy.lib.auth_digest.digest_auth, priority=2)
-
     # Install signal handlers to allow for proper cleanup/shutdown.
     for sig in [signal.SIGINT, signal.SIGTERM]:
         signal.signal(sig, shutdown)
@@ -0,0 +1,264 @@
+import cherrypy
+import cherrypy.wsgiserver.wsgiserver2
+import Queue
+import socket
+import sys
+import threading
+
+import tangelo
+
+# Coroutine services need an asyncio-compatible event loop library: asyncio
+# itself where available, or else its Python 2 port, Trollius.
+try:
+    import asyncio
+except ImportError:
+    try:
+        import trollius as asyncio
+    except ImportError:
+        asyncio = None
+
+
+def iscoroutinefunction(func):
+    return asyncio is not None and asyncio.iscoroutinefunction(func)
+
+
+class RequestContext(object):
+    """
+    The per-thread state that Tangelo's service functions rely on (the current
+    request and response, and the running service's module), captured in a
+    server thread so that it can be reinstated in the event loop thread.
+    """
+    def __init__(self):
+        self.request = cherrypy.serving.request
+        self.response = cherrypy.serving.response
+        self.thread_data = dict(cherrypy.thread_data.__dict__)
+
+    def enter(self):
+        cherrypy.serving.load(self.request, self.response)
+        cherrypy.thread_data.__dict__.update(self.thread_data)
+
+
+def server_gateway():
+    """
+    Find the gateway through which CherryPy's HTTP server is handling the
+    current request, by looking up the call stack (as ws4py does to take over
+    websocket connections).
+
+    :returns: the gateway, or None if the request is not being served by
+              CherryPy's own HTTP server.
+    """
+    frame = sys._getframe(1)
+    while frame is not None:
+        gateway = frame.f_locals.get("self")
+        if isinstance(gateway, cherrypy.wsgiserver.wsgiserver2.WSGIGateway):
+            return gateway
+        frame = frame.f_back
+    return None
+
+
+class DeferredCall(object):
+    """
+    A call to a coroutine service whose response is to be sent when the
+    coroutine completes, rather than by the server thread that received the
+    request.
+    """
+    def __init__(self, func, pargs, kwargs):
+        self.func = func
+        self.pargs = pargs
+        self.kwargs = kwargs
+        self.gateway = server_gateway()
+
+
+if asyncio is not None:
+    class ServiceTask(asyncio.Task):
+        """
+        A task running a service coroutine, which switches to its request's
+        context whenever it resumes, since many tasks share the event loop
+        thread.
+        """
+        def __init__(self, coro, context, loop=None):
+            self.context = context
+            asyncio.Task.__init__(self, coro, loop=loop)
+
+        def _step(self, *pargs, **kwargs):
+            if self.context is not None:
+                self.context.enter()
+            return asyncio.Task._step(self, *pargs, **kwargs)
+
+    def task_factory(loop, coro):
+        # Tasks started by a service coroutine (e.g. through
+        # asyncio.ensure_future() or asyncio.gather()) run in the same request
+        # context as the task that started them.
+        parent = asyncio.Task.current_task(loop=loop)
+        return ServiceTask(coro, getattr(parent, "context", None), loop=loop)
+
+
+class EventLoop(object):
+    """
+    A single event loop, running in its own thread, on which all coroutine
+    services run.  The loop is started when first needed.
+    """
+    instance = None
+
+    def __init__(self):
+        EventLoop.instance = self
+
+        self.loop = None
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        with self.lock:
+            if self.loop is None:
+                self.loop = asyncio.new_event_loop()
+                self.loop.set_task_factory(task_factory)
+                self.thread = threading.Thread(target=self.run, name="EventLoop")
+                self.thread.daemon = True
+                self.thread.start()
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def stop(self):
+        with self.lock:
+            if self.loop is not None:
+                self.loop.call_soon_threadsafe(self.loop.stop)
+                self.thread.join()
+                self.loop.close()
+
+                self.loop = None
+                self.thread = None
+
+    def launch(self, func, pargs, kwargs, context, callback):
+        """
+        Start running the coroutine function `func` on the event loop, in the
+        request context `context`.  When it completes, `callback(ok, value)` is
+        called from the event loop thread, with `ok` False and `value` the
+        exception if the coroutine failed (or was cancelled), or else `ok` True
+        and `value` its result.
+        """
+        self.start()
+
+        def done(task):
+            if task.cancelled():
+                callback(False, asyncio.CancelledError())
+            elif task.exception() is not None:
+                callback(False, task.exception())
+            else:
+                callback(True, task.result())
+
+        def begin():
+            context.enter()
+            try:
+                coro = func(*pargs, **kwargs)
+            except:
+                callback(False, sys.exc_info()[1])
+                return
+
+            # A decorator such as tangelo.types() may return a value (e.g. an
+            # error report) without invoking the coroutine function.
+            if not asyncio.iscoroutine(coro):
+                callback(True, coro)
+                return
+
+            task = ServiceTask(coro, context, loop=self.loop)
+            task.add_done_callback(done)
+
+        self.loop.call_soon_threadsafe(begin)
+
+    def call(self, func, *pargs, **kwargs):
+        """
+        Run the coroutine function `func` on the event loop, blocking the
+        calling thread until it completes.
+
+        :returns: the coroutine's result; an exception raised by the coroutine
+                  is raised here instead.
+        """
+        outcome = Queue.Queue(1)
+        self.launch(func, pargs, kwargs, RequestContext(), lambda ok, value: outcome.put((ok, value)))
+
+        ok, value = outcome.get()
+        if not ok:
+            raise value
+        return value
+
+    def defer(self, call, finish):
+        """
+        Respond to a request for a coroutine service without holding a server
+        thread while the coroutine runs.
+
+        The returned response body, once CherryPy's HTTP server starts sending
+        it, marks the response as sent and the connection as one to be left
+        open but not reused, so that the server thread is released.  The
+        coroutine is then started; when it completes, `finish(ok, value)` (with
+        the arguments described in ``launch()``) is called from a thread of the
+        event loop's executor, in the request context, to produce the actual
+        response body, which is written to the connection before closing it.
+
+        :param call: a ``DeferredCall``.
+        :returns: the placeholder response body.
+        """
+        context = RequestContext()
+        request = call.gateway.req
+
+        def complete(ok, value):
+            context.enter()
+            response = cherrypy.serving.response
+            try:
+                response.stream = False
+                response.body = finish(ok, value)
+                EventLoop.send(request, response, context.request.method == "HEAD")
+            except socket.error:
+                # The client has gone away.
+                pass
+            except:
+                tangelo.util.log_traceback("SERVICE", tangelo.util.generate_error_code(), "Could not send response for %s" % (context.request.path_info))
+            finally:
+                request.conn.linger = False
+                request.conn.close()
+                cherrypy.serving.clear()
+
+        def done(ok, value):
+            self.loop.run_in_executor(None, complete, ok, value)
+
+        def body():
+            request.sent_headers = True
+            request.close_connection = True
+            request.conn.linger = True
+
+            self.launch(call.func, call.pargs, call.kwargs, context, done)
+            yield ""
+
+        return body()
+
+    @staticmethod
+    def send(request, response, head=False):
+        """
+        Write a finished CherryPy response through the HTTP server's request
+        object.
+        """
+        response.finalize()
+        body = response.body
+        try:
+            request.status = response.output_status
+            request.outheaders = list(response.header_list)
+            request.chunked_write = False
+            request.send_headers()
+
+            if not head:
+                for chunk in body:
+                    if isinstance(chunk, unicode):
+                        chunk = chunk.encode("ISO-8859-1")
+                    if chunk:
+                        request.write(chunk)
+
+            if request.chunked_write:
+                request.conn.wfile.sendall("0\r\n\r\n")
+        finally:
+            close = getattr(body, "close", None)
+            if close is not None:
+                close()
+
+
+EventLoop()
@@ -0,0 +1,36 @@
+import cherrypy
+
+import tangelo
+import tangelo.plugin.mongo
+
+
+def setup(config, store):
+    config = config or {}
+
+    clients = store["clients"] = tangelo.plugin.mongo.ClientPool(max_size=config.get("max-size"),
+                                                                 idle_timeout=config.get("idle-timeout"),
+                                                                 health_check=config.get("health-check-interval"),
+                                                                 options=config.get("client-options"))
+
+    # Cache query results only if the configuration asks for it.
+    cache = config.get("cache")
+    if isinstance(cache, dict) and cache.get("max-entries"):
+        store["cache"] = tangelo.plugin.mongo.QueryCache(max_entries=cache["max-entries"], ttl=cache.get("ttl"))
+    else:
+        store["cache"] = None
+
+    if clients.idle_timeout is not None:
+        reaper = store["reaper"] = cherrypy.process.plugins.Monitor(cherrypy.engine, clients.reap, frequency=config.get("reap-interval", 60), name="MongoReaper")
+        reaper.subscribe()
+
+    return {}
+
+
+def teardown(config, store):
+    if "reaper" in store:
+        store["reaper"].unsubscribe()
+        store["reaper"].stop()
+
+    if "clients" in store:
+        tangelo.log_info("MONGO", "Closing %d client%s" % (len(store["clients"]), "" if len(store["clients"]) == 1 else "s"))
+        store["clients"].clear()
@@ -0,0 +1,227 @@
+import collections
+import threading
+import time
+import traceback
+
+import tangelo
+import tangelo.util
+
+try:
+    import pymongo
+except ImportError:
+    pymongo = None
+
+
+class PooledClient(object):
+    """
+    A MongoClient in the pool, along with the times needed to decide when to
+    check its health and when to close it.
+    """
+    def __init__(self, server, client):
+        self.server = server
+        self.client = client
+        self.used = self.checked = time.time()
+
+    def healthy(self):
+        try:
+            self.client.admin.command("ping")
+            return True
+        except pymongo.errors.PyMongoError as e:
+            tangelo.log_warning("MONGO", "Health check of %s failed: %s" % (self.server, e))
+            return False
+
+    def close(self):
+        try:
+            self.client.close()
+        except:
+            tangelo.log_warning("MONGO", "Error closing client for %s:\n%s" % (self.server, traceback.format_exc()))
+
+
+class ClientPool(object):
+    """
+    MongoClient objects shared by all requests, one per server URI (each
+    client keeps its own pool of connections to the server).  Clients unused
+    for longer than `idle_timeout` seconds are closed by `reap()`; a client
+    unused for `health_check` seconds is pinged before it is used again, and
+    replaced if the ping fails.  Connecting to a server beyond `max_size`
+    closes the least recently used client.  A setting of ``None`` disables it.
+
+    :param options: keyword arguments for ``pymongo.MongoClient``.
+    """
+    def __init__(self, max_size=None, idle_timeout=None, health_check=None, options=None):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.health_check = health_check
+        self.options = dict(options or {})
+
+        # Ordered from least to most recently used.
+        self.clients = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def __contains__(self, server):
+        return server in self.clients
+
+    def __len__(self):
+        return len(self.clients)
+
+    def get(self, server):
+        """
+        Get the client for `server`, connecting to it if necessary.
+        """
+        now = time.time()
+        with self.lock:
+            pooled = self.clients.pop(server, None)
+            if pooled is not None:
+                self.clients[server] = pooled
+                check = self.health_check is not None and now - pooled.checked >= self.health_check
+                pooled.used = now
+                if check:
+                    pooled.checked = now
+
+        # Ping the client (if it is due a check) outside of the lock, so that
+        # a slow server does not hold up requests to other servers.
+        if pooled is not None:
+            if not check or pooled.healthy():
+                return pooled.client
+
+            with self.lock:
+                if self.clients.get(server) is pooled:
+                    del self.clients[server]
+            self.close([pooled], "failed its health check")
+
+        client = PooledClient(server, pymongo.MongoClient(server, **self.options))
+
+        evicted = []
+        with self.lock:
+            # Another thread may have connected in the meantime.
+            if server in self.clients:
+                evicted.append(client)
+                client = self.clients[server]
+            else:
+                while self.max_size is not None and len(self.clients) >= self.max_size > 0:
+                    evicted.append(self.clients.popitem(last=False)[1])
+                self.clients[server] = client
+
+        self.close(evicted, "evicted")
+        return client.client
+
+    def reap(self):
+        """
+        Close the clients that have been unused for longer than the idle
+        timeout.
+        """
+        if self.idle_timeout is None:
+            return
+
+        cutoff = time.time() - self.idle_timeout
+        with self.lock:
+            expired = [pooled for pooled in self.clients.itervalues() if pooled.used < cutoff]
+            for pooled in expired:
+                del self.clients[pooled.server]
+
+        self.close(expired, "expired")
+
+    def clear(self):
+        with self.lock:
+            clients = self.clients.values()
+            self.clients.clear()
+
+        self.close(clients, "closed")
+
+    @staticmethod
+    def close(clients, reason):
+        # Closing a client still in use by a request is safe: pymongo reopens
+        # it if it is used again.
+        for pooled in clients:
+            tangelo.log_info("MONGO", "Client for %s %s" % (pooled.server, reason))
+            pooled.close()
+
+
+class QueryCache(object):
+    """
+    The serialized results of recent queries, keyed by collection (a tuple of
+    server, database, and collection name) and a canonical form of the query's
+    arguments.  Holds at most `max_entries` results in a
+    ``tangelo.util.LRUCache``; results older than `ttl` seconds are not used
+    (``None`` to keep them until evicted or invalidated).
+    """
+    def __init__(self, max_entries, ttl=None):
+        self.ttl = ttl
+        self.entries = tangelo.util.LRUCache(max_entries)
+
+        # The number of times each collection's entries have been invalidated,
+        # so that a query running across an invalidation does not cache its
+        # (possibly stale) result.
+        self.generations = collections.defaultdict(int)
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+        # Guards the generations and the counters; entries are only added or
+        # invalidated while holding it.
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def generation(self, collection):
+        with self.lock:
+            return self.generations[collection]
+
+    def get(self, collection, key):
+        entry = self.entries.get((collection, key))
+        if entry is not None and entry[0] is not None and entry[0] <= time.time():
+            self.entries.pop((collection, key))
+            entry = None
+
+        with self.lock:
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            return entry[1]
+
+    def set(self, collection, key, value, generation):
+        """
+        Cache a query's result, unless the collection's entries have been
+        invalidated since `generation` was taken (before running the query).
+        """
+        expires = None if self.ttl is None else time.time() + self.ttl
+        with self.lock:
+            if self.generations[collection] == generation:
+                self.entries.set((collection, key), (expires, value))
+
+    def invalidate(self, collection=()):
+        """
+        Forget the cached results for the collections whose (server, database,
+        collection) tuple begins with `collection` (all of them by default).
+
+        :returns: the number of results forgotten.
+        """
+        n = len(collection)
+        with self.lock:
+            keys = [key for key in self.entries.keys() if key[0][:n] == collection]
+            for key in keys:
+                self.entries.pop(key)
+
+            # Every collection that has been queried has a generation.
+            for c in self.generations:
+                if c[:n] == collection:
+                    self.generations[c] += 1
+
+            self.invalidations += 1
+            return len(keys)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {"entries": len(self.entries),
+                    "max-entries": self.entries.maxsize,
+                    "ttl": self.ttl,
+                    "hits": self.hits,
+                    "misses": self.misses,
+                    "hit-rate": float(self.hits) / lookups if lookups else None,
+                    "evictions": self.entries.evictions,
+                    "invalidations": self.invalidations}
@@ -0,0 +1,28 @@
+import tangelo
+
+# The cache of query results, set up by the plugin's control module (None if
+# it is disabled).
+cache = tangelo.plugin_store()["cache"]
+
+
+@tangelo.restful
+def get():
+    if cache is None:
+        return {"enabled": False}
+
+    return dict(cache.stats(), enabled=True)
+
+
+@tangelo.restful
+def delete(server=None, db=None, coll=None):
+    # The collection is given by query arguments rather than the path, since a
+    # server given as a URI contains slashes.
+    if cache is None:
+        tangelo.http_status(404, "Cache Disabled")
+        return {"error": "The mongo query cache is not enabled"}
+    elif (db is not None and server is None) or (coll is not None and db is None):
+        tangelo.http_status(400, "Bad Collection")
+        return {"error": "A database requires a server, and a collection requires a database"}
+
+    collection = tuple(arg for arg in [server, db, coll] if arg is not None)
+    return {"invalidated": cache.invalidate(collection)}
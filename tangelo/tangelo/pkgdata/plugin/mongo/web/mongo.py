@@ -1,6 +1,14 @@
 import bson.json_util
+import bson.son
 import pymongo
 
+import tangelo
+
+# Clients shared across requests, by server URI, and the cache of query
+# results (if enabled).
+clients = tangelo.plugin_store()["clients"]
+cache = tangelo.plugin_store()["cache"]
+
 
 def decode(s, argname, resp):
     try:
@@ -10,16 +18,107 @@ def decode(s, argname, resp):
         raise
 
 
+def plain(value):
+    # Convert BSON values (ObjectIds, dates, etc.) within a document to their
+    # MongoDB extended JSON form, so that streamed documents can be
+    # JSON-encoded like any other service result.
+    if isinstance(value, dict):
+        return {k: plain(v) for k, v in value.iteritems()}
+    elif isinstance(value, (list, tuple)):
+        return [plain(v) for v in value]
+    elif value is None or isinstance(value, (basestring, bool, int, long, float)):
+        return value
+    else:
+        return bson.json_util.default(value)
+
+
+def count_documents(c, query, estimated=False):
+    # Use the count methods of newer PyMongo versions when available (they
+    # replace the deprecated count()).  An estimated count comes from the
+    # collection's metadata, and so ignores the query.
+    if estimated:
+        if hasattr(c, 'estimated_document_count'):
+            return c.estimated_document_count()
+        return c.count()
+    elif hasattr(c, 'count_documents'):
+        return c.count_documents(query or {})
+    else:
+        return c.count(query)
+
+
+def stream_documents(cursor):
+    try:
+        for doc in cursor:
+            yield plain(doc)
+    finally:
+        cursor.close()
+
+
+def batches(docs, size):
+    if size <= 0:
+        yield docs
+    else:
+        for i in xrange(0, len(docs), size):
+            yield docs[i:i + size]
+
+
+def insert(c, docs, ordered, batch_size):
+    # Insert the documents with one insert_many() call per batch.  An ordered
+    # insert stops at the first failure; an unordered one inserts as many
+    # documents as it can, and reports the failures at the end.
+    inserted = []
+    errors = []
+    offset = 0
+    for batch in batches(docs, batch_size):
+        try:
+            inserted.extend(c.insert_many(batch, ordered=ordered).inserted_ids)
+        except pymongo.errors.BulkWriteError as e:
+            # insert_many() gives each document an _id before sending it, so
+            # the ones that were written can be listed.
+            write_errors = e.details.get('writeErrors', [])
+            failed = set(err['index'] for err in write_errors)
+            if ordered:
+                written = batch[:min(failed)] if failed else []
+            else:
+                written = [doc for i, doc in enumerate(batch) if i not in failed]
+            inserted.extend(doc['_id'] for doc in written)
+
+            errors.extend({'index': offset + err['index'],
+                           'code': err.get('code'),
+                           'message': err.get('errmsg')} for err in write_errors)
+            if ordered:
+                break
+
+        offset += len(batch)
+
+    result = {'inserted': len(inserted),
+              'ids': inserted}
+    if errors:
+        result['errors'] = errors
+    return result
+
+
 def run(server, db, coll, method='find', query=None, limit=1000,
-        skip=0, fields=None, sort=None, fill=None):
+        skip=0, fields=None, sort=None, fill=None, stream=None,
+        format='json', batch_size=None, count=None, pipeline=None,
+        documents=None, ordered=None, explain=None):
     # Create an empty response object.
     response = {}
 
     # Check the requested method.
-    if method not in ['find', 'insert']:
+    if method not in ['find', 'aggregate', 'insert']:
         response['error'] = "Unsupported MongoDB operation '%s'" % (method)
         return bson.json_util.dumps(response)
 
+    # Check the streaming options.
+    if format not in ['json', 'ndjson']:
+        response['error'] = "Unsupported stream format '%s'" % (format)
+        return bson.json_util.dumps(response)
+
+    if count not in [None, 'exact', 'estimated', 'none']:
+        response['error'] = "Unsupported count '%s'" % (count)
+        return bson.json_util.dumps(response)
+
     # Decode the query strings into Python objects.
     try:
         if query is not None:
@@ -32,6 +131,18 @@ def run(server, db, coll, method='find', query=None, limit=1000,
             fill = decode(fill, 'fill', response)
         else:
             fill = True
+        if stream is not None:
+            stream = decode(stream, 'stream', response)
+        if pipeline is not None:
+            pipeline = decode(pipeline, 'pipeline', response)
+        if documents is not None:
+            documents = decode(documents, 'documents', response)
+        if ordered is not None:
+            ordered = decode(ordered, 'ordered', response)
+        else:
+            ordered = True
+        if explain is not None:
+            explain = decode(explain, 'explain', response)
     except ValueError:
         return bson.json_util.dumps(response)
 
@@ -51,9 +162,46 @@ def run(server, db, coll, method='find', query=None, limit=1000,
                              "not be converted to int.") % (skip)
         return bson.json_util.dumps(response)
 
-    # Create database connection.
+    # Cast the batch size to an int, defaulting to the plugin's setting (or
+    # else letting the server choose).
+    if batch_size is None:
+        batch_size = tangelo.plugin_config().get('batch-size') or 0
+    try:
+        batch_size = int(batch_size)
+    except ValueError:
+        response['error'] = ("Argument 'batch_size' ('%s') could " +
+                             "not be converted to int.") % (batch_size)
+        return bson.json_util.dumps(response)
+
+    # Check the arguments of the other methods.
+    if method == 'aggregate' and not isinstance(pipeline, list):
+        response['error'] = "Argument 'pipeline' must be a list of stages"
+        return bson.json_util.dumps(response)
+
+    if method == 'insert':
+        if isinstance(documents, dict):
+            documents = [documents]
+        if not isinstance(documents, list) or not documents or not all(isinstance(doc, dict) for doc in documents):
+            tangelo.http_status(400, "Bad Documents")
+            response['error'] = "Argument 'documents' must be a document or a non-empty list of documents"
+            return bson.json_util.dumps(response)
+
+    # Serve a repeated query from the cache.  The key is made from the
+    # decoded arguments, so that differences in how they were written (e.g.
+    # spacing or key order) do not matter.
+    cacheable = cache is not None and method in ['find', 'aggregate'] and not stream and not explain
+    if cacheable:
+        collection = (server, db, coll)
+        key = bson.json_util.dumps([method, query, fields, sort, limit, skip, fill, count, pipeline], sort_keys=True)
+        generation = cache.generation(collection)
+
+        result = cache.get(collection, key)
+        if result is not None:
+            return result
+
+    # Get a (pooled) database connection.
     try:
-        c = pymongo.MongoClient(server)[db][coll]
+        c = clients.get(server)[db][coll]
     except (pymongo.errors.AutoReconnect, pymongo.errors.ConnectionFailure):
         response['error'] = ("Could not connect to " +
                              "MongoDB server '%s'") % (server)
@@ -63,7 +211,19 @@ def run(server, db, coll, method='find', query=None, limit=1000,
     if method == 'find':
         # Do a find operation with the passed arguments.
         it = c.find(filter=query, projection=fields, skip=skip,
-                    limit=limit, sort=sort)
+                    limit=limit, sort=sort, batch_size=batch_size)
+
+        if explain:
+            response['result'] = it.explain()
+            return bson.json_util.dumps(response)
+
+        if stream:
+            # Send the documents to the client as they arrive from the
+            # server, a batch at a time, rather than collecting them first.
+            # The count, if asked for, comes in a header.
+            if count not in [None, 'none']:
+                tangelo.header('X-Total-Count', str(count_documents(c, query, count == 'estimated')))
+            return tangelo.chunked(stream_documents(it), format)
 
         # Create a list of the results.
         if fill:
@@ -73,13 +233,56 @@ def run(server, db, coll, method='find', query=None, limit=1000,
 
         # Create an object to structure the results.
         retobj = {}
-        retobj['count'] = it.count()
+        if count != 'none':
+            retobj['count'] = count_documents(c, query, count == 'estimated')
         retobj['data'] = results
 
         # Pack the results into the response object, and return it.
         response['result'] = retobj
+    elif method == 'aggregate':
+        # Push the query and field selection down to the start of the
+        # pipeline, so that the server filters and trims the documents before
+        # the other stages see them.
+        stages = []
+        if query:
+            stages.append({'$match': query})
+        if fields:
+            stages.append({'$project': fields if isinstance(fields, dict) else {field: 1 for field in fields}})
+        stages.extend(pipeline)
+
+        # Apply the sort, skip, and limit to the pipeline's output, as find
+        # does to its results (a limit of 0 meaning no limit).
+        if sort:
+            stages.append({'$sort': bson.son.SON(sort) if isinstance(sort, list) else sort})
+        if skip > 0:
+            stages.append({'$skip': skip})
+        if limit > 0:
+            stages.append({'$limit': limit})
+
+        if explain:
+            response['result'] = c.database.command('aggregate', c.name, pipeline=stages, explain=True)
+            return bson.json_util.dumps(response)
+
+        options = {'allowDiskUse': True}
+        if batch_size > 0:
+            options['batchSize'] = batch_size
+        it = c.aggregate(stages, **options)
+
+        if stream:
+            return tangelo.chunked(stream_documents(it), format)
+
+        response['result'] = {'data': [x for x in it]}
+    elif method == 'insert':
+        response['result'] = insert(c, documents, ordered, batch_size)
+
+        # Cached results from the collection may no longer be correct.
+        if cache is not None:
+            cache.invalidate((server, db, coll))
     else:
         raise RuntimeError("illegal method '%s' in module 'mongo'")
 
     # Return the response object.
-    return bson.json_util.dumps(response)
+    result = bson.json_util.dumps(response)
+    if cacheable:
+        cache.set(collection, key, result, generation)
+    return result
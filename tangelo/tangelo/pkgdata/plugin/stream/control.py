@@ -0,0 +1,38 @@
+import cherrypy
+
+import tangelo
+import tangelo.plugin.stream
+import tangelo.websocket
+
+
+def setup(config, store):
+    config = config or {}
+
+    streams = store["streams"] = tangelo.plugin.stream.StreamTable(idle_timeout=config.get("idle-timeout"),
+                                                                   max_streams=config.get("max-streams"),
+                                                                   max_per_session=config.get("max-streams-per-session"))
+
+    if streams.idle_timeout is not None:
+        reaper = store["reaper"] = cherrypy.process.plugins.Monitor(cherrypy.engine, streams.reap, frequency=config.get("reap-interval", 30), name="StreamReaper")
+        reaper.subscribe()
+
+    # Serve a websocket that pushes stream items to the client.
+    tangelo.websocket.mount("stream", tangelo.plugin.stream.StreamSocket(streams))
+
+    # Serve streams as server-sent events at /plugin/stream/events.
+    events = tangelo.plugin.stream.EventSource(heartbeat=config.get("heartbeat-interval", 15),
+                                               modules=cherrypy.config.get("module-cache"))
+
+    return {"apps": [(events, "events")]}
+
+
+def teardown(config, store):
+    tangelo.websocket.unmount("stream")
+
+    if "reaper" in store:
+        store["reaper"].unsubscribe()
+        store["reaper"].stop()
+
+    if "streams" in store:
+        tangelo.log_info("STREAM", "Closing %d open stream%s" % (len(store["streams"]), "" if len(store["streams"]) == 1 else "s"))
+        store["streams"].clear()
@@ -0,0 +1,507 @@
+import cherrypy
+import collections
+import json
+import os
+import Queue
+import sys
+import threading
+import time
+import traceback
+import ws4py.websocket
+
+import tangelo
+import tangelo.eventloop
+import tangelo.server
+import tangelo.util
+
+
+class Stream(object):
+    """
+    A generator started by a streaming service, along with the bookkeeping
+    needed to evict it once it is abandoned.
+    """
+    def __init__(self, key, generator, service, session=None):
+        self.key = key
+        self.generator = generator
+        self.service = service
+        self.session = session
+
+        self.created = self.accessed = time.time()
+        self.items = 0
+
+        # The number of websockets pushing this stream's items; such a stream
+        # is not idle even while it waits for the client.
+        self.consumers = 0
+
+        # Generators cannot be run from two threads at once, so calls to
+        # next() (and close()) are serialized.
+        self.lock = threading.Lock()
+
+    def next(self):
+        return self.take(count=1)[0]
+
+    def take(self, count=None, max_ms=None):
+        """
+        Run the generator for up to `count` items, or until `max_ms`
+        milliseconds have passed, whichever comes first (but for at least one
+        item).
+
+        :returns: the list of items; raises StopIteration if the generator has
+                  already finished.
+        """
+        if count is None and max_ms is None:
+            raise ValueError("take() needs a count or a time limit")
+
+        deadline = None if max_ms is None else time.time() + max_ms / 1000.0
+
+        with self.lock:
+            self.accessed = time.time()
+
+            items = [self.generator.next()]
+            self.items += 1
+
+            while (count is None or len(items) < count) and (deadline is None or time.time() < deadline):
+                try:
+                    if isinstance(self.generator, Prefetcher) and deadline is not None:
+                        # Wait no longer than the time remaining.
+                        items.append(self.generator.next(timeout=max(0, deadline - time.time())))
+                    else:
+                        items.append(self.generator.next())
+                except (StopIteration, Queue.Empty):
+                    break
+                self.items += 1
+
+            return items
+
+    def close(self):
+        if not hasattr(self.generator, "close"):
+            return
+
+        with self.lock:
+            try:
+                self.generator.close()
+            except:
+                tangelo.log_warning("STREAM", "Error closing stream %s:\n%s" % (self.key, traceback.format_exc()))
+
+    def info(self):
+        now = time.time()
+        info = {"key": self.key,
+                "service": self.service,
+                "age": now - self.created,
+                "idle": now - self.accessed,
+                "items": self.items,
+                "last-access": self.accessed}
+
+        if isinstance(self.generator, Prefetcher):
+            info["prefetched"] = self.generator.buffered()
+
+        return info
+
+
+class Prefetcher(object):
+    """
+    An iterator that runs `source` in a background thread, keeping up to `size`
+    of its values ready ahead of the consumer.  Exceptions raised by `source`
+    are raised again by `next()`.
+    """
+    def __init__(self, source, size):
+        self.values = Queue.Queue(size)
+        self.stop = threading.Event()
+        self.outcome = None
+
+        # The thread runs with the same request context as the caller, so that
+        # the source can use Tangelo's per-service functions.
+        thread = threading.Thread(target=self.run, args=(source, tangelo.eventloop.RequestContext()), name="Prefetcher")
+        thread.daemon = True
+        thread.start()
+
+    def __iter__(self):
+        return self
+
+    def buffered(self):
+        return self.values.qsize()
+
+    def put(self, item):
+        while not self.stop.is_set():
+            try:
+                self.values.put(item, timeout=1)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    def run(self, source, context):
+        context.enter()
+        try:
+            for value in source:
+                if not self.put((True, value)):
+                    return
+
+            self.put((False, (StopIteration, StopIteration(), None)))
+        except:
+            self.put((False, sys.exc_info()))
+        finally:
+            # Generators can only be closed by the thread that runs them.
+            close = getattr(source, "close", None)
+            if close is not None:
+                close()
+
+    def next(self, timeout=None):
+        """
+        Return the next value, waiting up to `timeout` seconds for it (and
+        raising Queue.Empty after that).
+        """
+        if self.outcome is None:
+            ok, value = self.values.get(timeout=timeout)
+            if ok:
+                return value
+            self.outcome = value
+
+        raise self.outcome[0], self.outcome[1], self.outcome[2]
+
+    def close(self):
+        self.stop.set()
+
+
+class StreamTable(object):
+    """
+    The active streams, by key.  Streams idle for longer than `idle_timeout`
+    seconds are closed by `reap()`; starting a stream beyond `max_streams`
+    (overall) or `max_per_session` (for one session) closes the least recently
+    used stream to make room.  A limit of ``None`` disables it.
+    """
+    def __init__(self, idle_timeout=None, max_streams=None, max_per_session=None):
+        self.idle_timeout = idle_timeout
+        self.max_streams = max_streams
+        self.max_per_session = max_per_session
+
+        # Ordered from least to most recently used.
+        self.streams = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def __contains__(self, key):
+        return key in self.streams
+
+    def __len__(self):
+        return len(self.streams)
+
+    def keys(self):
+        return self.streams.keys()
+
+    def add(self, generator, service, session=None):
+        evicted = []
+        with self.lock:
+            if self.max_per_session is not None and session is not None:
+                owned = [stream for stream in self.streams.itervalues() if stream.session == session]
+                while len(owned) >= self.max_per_session > 0:
+                    evicted.append(self.streams.pop(owned.pop(0).key))
+
+            while self.max_streams is not None and len(self.streams) >= self.max_streams > 0:
+                evicted.append(self.streams.popitem(last=False)[1])
+
+            key = tangelo.util.generate_key(self.streams)
+            self.streams[key] = Stream(key, generator, service, session)
+
+        self.close(evicted, "evicted")
+        return key
+
+    def get(self, key):
+        """
+        Return the stream with `key` (marking it as the most recently used), or
+        ``None`` if there is no such stream.
+        """
+        with self.lock:
+            stream = self.streams.pop(key, None)
+            if stream is not None:
+                self.streams[key] = stream
+            return stream
+
+    def attach(self, key):
+        """
+        Return the stream with `key`, registered as having a websocket
+        consumer, or ``None`` if there is no such stream.
+        """
+        with self.lock:
+            stream = self.streams.get(key)
+            if stream is not None:
+                stream.consumers += 1
+            return stream
+
+    def detach(self, stream):
+        with self.lock:
+            stream.consumers -= 1
+
+    def remove(self, key, close=True):
+        with self.lock:
+            stream = self.streams.pop(key, None)
+
+        if stream is not None and close:
+            stream.close()
+        return stream
+
+    def reap(self):
+        """
+        Close the streams that have been idle for longer than the idle timeout.
+        """
+        if self.idle_timeout is None:
+            return
+
+        cutoff = time.time() - self.idle_timeout
+        with self.lock:
+            expired = [stream for stream in self.streams.itervalues() if stream.accessed < cutoff and stream.consumers == 0]
+            for stream in expired:
+                del self.streams[stream.key]
+
+        self.close(expired, "expired")
+
+    def clear(self):
+        with self.lock:
+            streams = self.streams.values()
+            self.streams.clear()
+
+        self.close(streams, "closed")
+
+    @staticmethod
+    def close(streams, reason):
+        # Close the generators outside of the table lock, since closing one
+        # runs its cleanup code (e.g., releasing a database cursor).
+        for stream in streams:
+            tangelo.log_info("STREAM", "Stream %s %s after %d item%s" % (stream.key, reason, stream.items, "" if stream.items == 1 else "s"))
+            stream.close()
+
+
+def StreamSocket(streams):
+    """
+    Create a websocket handler class that pushes the items of streams in
+    `streams` to the client as they are produced.
+
+    The client sends JSON messages: ``{"key": <stream key>}`` to choose the
+    stream, and ``{"request": n}`` to allow `n` more items to be sent (the two
+    may be combined in one message).  The server sends ``{"data": <item>}`` for
+    each item, and finally ``{"finished": true}`` when the stream runs out, or
+    an error report if it fails.  If the socket closes first, the stream is
+    closed.
+    """
+    dumps = tangelo.util.serializers["json"].dumps
+
+    class Class(ws4py.websocket.WebSocket):
+        def __init__(self, *pargs, **kwargs):
+            ws4py.websocket.WebSocket.__init__(self, *pargs, **kwargs)
+
+            # (Not "self.stream", which the base class uses.)
+            self.source = None
+            self.credit = 0
+            self.done = False
+            self.condition = threading.Condition()
+
+        def received_message(self, message):
+            try:
+                msg = json.loads(message.data)
+                if not isinstance(msg, dict):
+                    raise ValueError("message must be a JSON object")
+
+                key = msg.get("key")
+                request = msg.get("request", 0)
+                if not isinstance(request, int) or request < 0:
+                    raise ValueError("'request' must be a non-negative integer")
+            except ValueError as e:
+                self.send(dumps({"error": "Bad message: %s" % (e)}))
+                return
+
+            if key is not None and self.source is None:
+                self.source = streams.attach(key)
+                if self.source is None:
+                    self.send(dumps({"error": "Key '%s' does not correspond to an active stream" % (key)}))
+                    self.close(1008, "no such stream")
+                    return
+
+                pump = threading.Thread(target=self.pump, name="StreamSocket")
+                pump.daemon = True
+                pump.start()
+
+            with self.condition:
+                self.credit += request
+                self.condition.notify()
+
+        def closed(self, code, reason=None):
+            with self.condition:
+                self.done = True
+                self.condition.notify()
+
+        def pump(self):
+            stream = self.source
+            try:
+                while True:
+                    # Wait until the client is ready for another item.
+                    with self.condition:
+                        while self.credit == 0 and not self.done:
+                            self.condition.wait()
+
+                        if self.done:
+                            break
+
+                        self.credit -= 1
+
+                    try:
+                        item = stream.next()
+                    except StopIteration:
+                        streams.remove(stream.key, close=False)
+                        self.send(dumps({"finished": True}))
+                        self.close(1000, "stream finished")
+                        return
+                    except:
+                        streams.remove(stream.key, close=False)
+
+                        error_code = tangelo.util.generate_error_code()
+                        tangelo.util.log_traceback("STREAM", error_code, "Offending stream key: %s" % (stream.key), "Uncaught exception executing service %s" % (stream.service))
+
+                        self.send(dumps({"error": tangelo.util.error_report(error_code)["message"]}))
+                        self.close(1011, "stream failed")
+                        return
+
+                    if self.done:
+                        break
+
+                    self.send(dumps({"data": item}))
+
+                # The client went away before the stream was finished.
+                tangelo.log_info("STREAM", "Websocket for stream %s closed" % (stream.key))
+                streams.remove(stream.key)
+            except:
+                tangelo.log_warning("STREAM", "Error pushing stream %s:\n%s" % (stream.key, traceback.format_exc()))
+                streams.remove(stream.key)
+            finally:
+                streams.detach(stream)
+
+    return Class
+
+
+class EventSource(object):
+    """
+    A CherryPy application that runs the ``stream()`` function of the service
+    named by the request path, sending each value it yields to the client as a
+    server-sent event over a single long-lived response.
+
+    Each event's ID is the value's position in the stream.  When a client
+    reconnects with a ``Last-Event-ID`` header, and the generator has a
+    ``seek()`` method, the generator is advanced past that position; otherwise
+    the stream starts over.  If no value is ready within `heartbeat` seconds, a
+    comment is sent to keep the connection open.
+
+    Services are loaded through `modules`, which should be the server's own
+    module cache, so that each service is loaded (and reloaded) only once.
+    """
+    def __init__(self, heartbeat=15, modules=None):
+        self.heartbeat = heartbeat
+        self.modules = tangelo.util.ModuleCache() if modules is None else modules
+
+    @staticmethod
+    def error(status, message):
+        tangelo.http_status(status)
+        tangelo.content_type("application/json")
+        return json.dumps({"error": message})
+
+    @cherrypy.expose
+    def default(self, *path, **kwargs):
+        if cherrypy.request.method != "GET":
+            return EventSource.error(405, "Server-sent events must be requested with GET")
+
+        analysis = tangelo.server.analyze_url("/" + "/".join(path))
+        content = analysis.content
+        if content is None or content.type != tangelo.server.Content.Service:
+            return EventSource.error(404, "No streaming service at /%s" % ("/".join(path)))
+
+        # The service is subject to the same .htaccess restrictions as when it
+        # is invoked directly.
+        auth_update = cherrypy.config.get("auth-update")
+        if auth_update is not None:
+            auth_update.update(analysis.reqpathcomp, analysis.pathcomp)
+
+        first = 0
+        last_id = cherrypy.request.headers.get("Last-Event-ID")
+        if last_id is not None:
+            try:
+                first = int(last_id) + 1
+            except ValueError:
+                first = 0
+            if first <= 0:
+                return EventSource.error(400, "Malformed Last-Event-ID header '%s'" % (last_id))
+
+        # Run the service as the server would, with its own module and plugin
+        # paths, and (outside of thread-safe mode) in its own directory,
+        # undoing any changes it makes to the module path.
+        modpath = os.path.dirname(content.path)
+        cherrypy.thread_data.modulepath = modpath
+        cherrypy.thread_data.modulename = content.path
+        cherrypy.thread_data.pluginpath = analysis.plugin_path
+
+        thread_safe = cherrypy.config.get("thread-safe")
+        if not thread_safe:
+            origpath = list(sys.path)
+            save_cwd = os.getcwd()
+            os.chdir(modpath)
+
+        try:
+            try:
+                service = self.modules.get(content.path)
+            except:
+                error_code = tangelo.util.generate_error_code()
+                tangelo.util.log_traceback("STREAM", error_code, "Could not import module %s" % (content.path))
+                return EventSource.error(500, tangelo.util.error_report(error_code)["message"])
+
+            if "stream" not in dir(service):
+                return EventSource.error(400, "The requested streaming service does not implement a 'stream()' function")
+
+            try:
+                source = service.stream(*content.pargs, **kwargs)
+
+                if hasattr(source, "seek"):
+                    source.seek(first)
+                else:
+                    first = 0
+            except:
+                error_code = tangelo.util.generate_error_code()
+                tangelo.util.log_traceback("STREAM", error_code, "Could not execute service %s" % (content.path))
+                return EventSource.error(500, tangelo.util.error_report(error_code)["message"])
+        finally:
+            if not thread_safe:
+                sys.path = origpath
+                os.chdir(save_cwd)
+
+        tangelo.content_type("text/event-stream")
+        tangelo.header("Cache-Control", "no-cache")
+        cherrypy.response.stream = True
+
+        return self.events(source, first, content.path)
+
+    def events(self, source, first=0, service=None):
+        # The generator runs in its own thread, a step ahead of the client, so
+        # that heartbeats can be sent while it is working on the next value.
+        prefetcher = Prefetcher(source, 1)
+
+        dumps = tangelo.util.serializers["json"].dumps
+        position = first
+        try:
+            while True:
+                try:
+                    value = prefetcher.next(timeout=self.heartbeat)
+                except Queue.Empty:
+                    yield ": heartbeat\n\n"
+                    continue
+                except StopIteration:
+                    # Tell the client not to reconnect (as it otherwise would
+                    # once the response ends).
+                    yield "event: finished\ndata: true\n\n"
+                    return
+                except:
+                    error_code = tangelo.util.generate_error_code()
+                    tangelo.util.log_traceback("STREAM", error_code, "Uncaught exception executing service %s" % (service))
+
+                    yield "event: failed\ndata: %s\n\n" % (dumps(tangelo.util.error_report(error_code)["message"]))
+                    return
+
+                yield "id: %d\ndata: %s\n\n" % (position, dumps(value))
+                position += 1
+        finally:
+            # The response is finished, or the client has gone away.
+            prefetcher.close()
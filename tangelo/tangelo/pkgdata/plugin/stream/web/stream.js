@@ -39,11 +39,29 @@
         });
     };
 
+    // Convert a batch specification (an object with "count" and/or "maxMs"
+    // fields) to the arguments of the "next" action.
+    function batchArgs(batch) {
+        var args = {};
+
+        if (batch.count !== undefined) {
+            args.count = batch.count;
+        }
+
+        if (batch.maxMs !== undefined) {
+            /* jshint camelcase: false */
+            args.max_ms = batch.maxMs;
+        }
+
+        return args;
+    }
+
     /*jslint unparam: true */
-    streamPlugin.query = function (key, callback) {
+    streamPlugin.query = function (key, callback, batch) {
         $.ajax({
             url: tangelo.pluginUrl("stream", "stream", "next", key),
             type: "POST",
+            data: batch ? batchArgs(batch) : undefined,
             dataType: "json",
             error: function (jqxhr) {
                 var report = {
@@ -65,7 +83,7 @@
         /*jslint unparam: true */
     };
 
-    streamPlugin.run = function (key, callback, delay) {
+    streamPlugin.run = function (key, callback, delay, batch) {
         // NOTE: we can't "shortcut" this (e.g. "delay = delay || 100") because
         // this will prevent the user from passing "0" in as the delay argument.
         if (delay === undefined) {
@@ -76,8 +94,7 @@
         // recur (in a way that does not indefinitely deepen the stack) until
         // there is an error, or the stream runs out.
         streamPlugin.query(key, function (result, finished, error) {
-            var flag,
-                keepgoing = true;
+            var keepgoing = true;
 
             if (error) {
                 console.warn("[tangelo.stream.run()] error during stream query");
@@ -104,36 +121,86 @@
                 //
                 // - If it returns an object, assume the function is attempting
                 //   to set more than one of these parameters in one go.
-                flag = callback(result, false);
-                if (flag !== undefined) {
-                    if (_.isFunction(flag)) {
-                        callback = flag;
-                    } else if (_.isBoolean(flag)) {
-                        keepgoing = flag;
-                    } else if (_.isNumber(flag)) {
-                        delay = flag;
-                    } else if (_.isObject(flag) && !_.isArray(flag)) {
-                        if (flag.callback !== undefined) {
-                            callback = flag.callback;
-                        }
+                //
+                // A batched query returns a list of values, each of which is
+                // passed to the callback in turn.
+                _.every(batch ? result : [result], function (value) {
+                    var flag = callback(value, false);
+                    if (flag !== undefined) {
+                        if (_.isFunction(flag)) {
+                            callback = flag;
+                        } else if (_.isBoolean(flag)) {
+                            keepgoing = flag;
+                        } else if (_.isNumber(flag)) {
+                            delay = flag;
+                        } else if (_.isObject(flag) && !_.isArray(flag)) {
+                            if (flag.callback !== undefined) {
+                                callback = flag.callback;
+                            }
 
-                        if (flag.continue !== undefined) {
-                            keepgoing = flag.continue;
-                        }
+                            if (flag.continue !== undefined) {
+                                keepgoing = flag.continue;
+                            }
 
-                        if (flag.delay !== undefined) {
-                            delay = flag.delay;
+                            if (flag.delay !== undefined) {
+                                delay = flag.delay;
+                            }
                         }
                     }
-                }
+
+                    return keepgoing;
+                });
 
                 // Schedule a new call to this function, with possibly mutated
                 // parameters, after the specified delay.
                 if (keepgoing) {
-                    window.setTimeout(streamPlugin.run, delay, key, callback, delay);
+                    window.setTimeout(streamPlugin.run, delay, key, callback, delay, batch);
                 }
             }
-        });
+        }, batch);
+    };
+
+    streamPlugin.push = function (key, callback, credit) {
+        var scheme = window.location.protocol === "https:" ? "wss:" : "ws:",
+            socket = new window.WebSocket(scheme + "//" + window.location.host + "/ws/stream/ws"),
+            consumed = 0;
+
+        if (credit === undefined) {
+            credit = 16;
+        }
+
+        // Ask for the first values as soon as the socket opens; afterwards,
+        // ask for more as the callback consumes them, so that no more than
+        // "credit" values are ever waiting on the client.
+        socket.onopen = function () {
+            socket.send(JSON.stringify({
+                key: key,
+                request: credit
+            }));
+        };
+
+        socket.onmessage = function (event) {
+            var msg = JSON.parse(event.data);
+
+            if (msg.error !== undefined) {
+                callback(undefined, undefined, msg.error);
+            } else if (msg.finished) {
+                callback(undefined, true);
+            } else if (callback(msg.data, false) === false) {
+                // Closing the socket also closes the stream.
+                socket.close();
+            } else {
+                consumed += 1;
+                if (consumed >= Math.ceil(credit / 2)) {
+                    socket.send(JSON.stringify({
+                        request: consumed
+                    }));
+                    consumed = 0;
+                }
+            }
+        };
+
+        return socket;
     };
 
     streamPlugin.delete = function (key, callback) {
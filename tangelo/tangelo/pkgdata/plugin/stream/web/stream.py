@@ -1,10 +1,14 @@
+import cherrypy
+
 import tangelo
+import tangelo.plugin.stream
 from tangelo.server import Content
 import tangelo.util
 
-# Useful aliases for this service's necessary persistent data.
+# Useful aliases for this service's necessary persistent data.  The stream
+# table is set up by the plugin's control module.
 store = tangelo.store()
-streams = store["streams"] = {}
+streams = tangelo.plugin_store()["streams"]
 modules = store["modules"] = tangelo.util.ModuleCache()
 
 
@@ -33,7 +37,7 @@ def post(*pathcomp, **kwargs):
             tangelo.http_status(400, "Stream Key Required")
             return {"error": "No stream key was specified"}
 
-        return stream_next(args[0])
+        return stream_next(args[0], kwargs.get("count"), kwargs.get("max_ms"))
     else:
         tangelo.http_status(400, "Illegal POST action")
         return {"error": "Illegal POST action '%s'" % (action)}
@@ -48,7 +52,7 @@ def delete(key=None):
         tangelo.http_status(404, "No Such Stream Key")
         return {"error": "Key '%s' does not correspond to an active stream" % (key)}
     else:
-        del streams[key]
+        streams.remove(key)
         return {"key": key}
 
 
@@ -57,8 +61,27 @@ def get_streams():
 
 
 def get_stream_info(key):
-    tangelo.http_status(501)
-    return {"error": "stream info method currently unimplemented"}
+    stream = streams.get(key)
+    if stream is None:
+        tangelo.http_status(404, "No Such Stream Key")
+        return {"error": "Key '%s' does not correspond to an active stream" % (key)}
+    else:
+        return stream.info()
+
+
+def session_id():
+    session = getattr(cherrypy.serving, "session", None)
+    return session.id if session is not None else None
+
+
+def prefetch_size(config):
+    prefetch = config.get("prefetch")
+    if prefetch is True:
+        return 16
+    elif isinstance(prefetch, int) and not isinstance(prefetch, bool) and prefetch > 0:
+        return prefetch
+    else:
+        return None
 
 
 def stream_start(url, kwargs):
@@ -102,38 +125,61 @@ def stream_start(url, kwargs):
                     tangelo.util.log_traceback("STREAM", error_code, "Could not execute service %s" % (tangelo.request_path()))
                     return tangelo.util.error_report(error_code)
                 else:
-                    # Generate a key corresponding to this object.
-                    key = tangelo.util.generate_key(streams)
+                    # If the service asks for it, run the generator in the
+                    # background, keeping values ready for the client.
+                    prefetch = prefetch_size(cherrypy.config["module-config"].get(module_path, {}))
+                    if prefetch is not None:
+                        stream = tangelo.plugin.stream.Prefetcher(stream, prefetch)
+
+                    # Log the object in the streaming table (which may close
+                    # older streams to make room for it), and return its key.
+                    key = streams.add(stream, url, session_id())
+                    return {"key": key}
 
-                    # Log the object in the streaming table.
-                    streams[key] = stream
 
-                    # Create an object describing the logging of the generator object.
-                    return {"key": key}
+def stream_next(key, count=None, max_ms=None):
+    # A count or time limit asks for a batch of items rather than just one.
+    batch = count is not None or max_ms is not None
+    try:
+        count = int(count) if count is not None else None
+        max_ms = float(max_ms) if max_ms is not None else None
+    except ValueError:
+        tangelo.http_status(400, "Bad Batch Size")
+        return {"error": "'count' must be an integer and 'max_ms' a number"}
 
+    if (count is not None and count < 1) or (max_ms is not None and max_ms < 0):
+        tangelo.http_status(400, "Bad Batch Size")
+        return {"error": "'count' must be positive and 'max_ms' non-negative"}
 
-def stream_next(key):
-    if key not in streams:
+    # Grab the stream in preparation for running it.
+    stream = streams.get(key)
+
+    if stream is None:
         tangelo.http_status(404, "No Such Key")
         return {"error": "Stream key does not correspond to an active stream",
                 "stream": key}
     else:
-        # Grab the stream in preparation for running it.
-        stream = streams[key]
-
-        # Attempt to run the stream via its next() method - if this
-        # yields a result, then continue; if the next() method raises
-        # StopIteration, then there are no more results to retrieve; if
-        # any other exception is raised, this is treated as an error.
+        # Attempt to run the stream via its next() method (or, for a batch,
+        # for as many items as requested) - if this yields a result, then
+        # continue; if the next() method raises StopIteration, then there are
+        # no more results to retrieve; if any other exception is raised, this
+        # is treated as an error.
+        #
+        # A batch cut short by the end of the stream is returned as is; the
+        # following request then reports that the stream is finished.
         try:
-            return stream.next()
+            if batch:
+                tangelo.content_type("application/json")
+                return stream.take(count, max_ms)
+            else:
+                return stream.next()
         except StopIteration:
-            del streams[key]
+            streams.remove(key, close=False)
 
             tangelo.http_status(204, "Stream Finished")
             return "OK"
         except:
-            del streams[key]
+            streams.remove(key, close=False)
 
             tangelo.http_status(500, "Streaming Service Exception")
             tangelo.content_type("application/json")
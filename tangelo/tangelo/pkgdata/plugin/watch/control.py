@@ -0,0 +1,14 @@
+import tangelo.plugin.watch
+
+
+def setup(config, store):
+    config = config or {}
+
+    tangelo.plugin.watch.start_watching(poll_interval=config.get("poll-interval", 1),
+                                        inotify=config.get("inotify", True))
+
+    return {}
+
+
+def teardown(config, store):
+    tangelo.plugin.watch.stop_watching()
@@ -1,9 +1,10 @@
 import __builtin__
-import cherrypy
 import imp
 import os
 import sys
 import tangelo
+import threading
+import watcher
 
 builtin_import = __builtin__.__import__
 tangelo_module_cache_get = tangelo.util.module_cache_get
@@ -11,8 +12,116 @@ tangelo_module_cache_get = tangelo.util.module_cache_get
 
 WatchList = {}
 
+# Indexes into the WatchList: the keys of the modules imported by each module
+# (by the importing module's name), and the keys of the modules loaded from
+# each file.
+Children = {}
+Files = {}
 
-def latest_submodule_time(module, mtime=0, processed=None):
+# The latest time of the modules imported (directly or indirectly) by each
+# module, valid as long as no watched file has changed and no import has been
+# added to the WatchList.
+SubtreeTimes = {"state": None, "times": {}}
+GraphVersion = [0]
+
+# Reports changes to the files of watched modules, once the plugin has been set
+# up.  Until then, every check compares modification times.
+FileWatcher = None
+
+
+def start_watching(poll_interval=1, inotify=True):
+    """
+    Start watching the files of imported modules for changes, so that checking
+    for changed modules only needs to ask the watcher whether anything has
+    changed since the last check.
+
+    :param poll_interval: seconds between checks of modification times, if
+                          inotify is not available.
+    :param inotify: False to always poll.
+    """
+    global FileWatcher
+
+    file_watcher = watcher.create(poll_interval, inotify)
+    imp.acquire_lock()
+    try:
+        for entry in WatchList.values():
+            file_watcher.watch(entry["file"])
+    finally:
+        imp.release_lock()
+
+    FileWatcher = file_watcher
+
+
+def stop_watching():
+    global FileWatcher
+
+    if FileWatcher is not None:
+        FileWatcher.stop()
+        FileWatcher = None
+
+
+def watch_version():
+    """
+    Get the watcher's count of file changes.
+
+    :returns: the count, or None if files are not being watched.
+    """
+    file_watcher = FileWatcher
+    return file_watcher.current() if file_watcher is not None else None
+
+
+def module_name(module):
+    """
+    Get the name that a module's own imports are recorded under: service
+    modules are given as file paths, but are named without the .py extension.
+    """
+    return module[:-3] if module.endswith(".py") else module
+
+
+def dependencies(module):
+    """
+    Get the WatchList keys of the modules imported by a module.  These are
+    listed under the module's name, and (for a dotted name) under its last
+    component, which is the name it was imported as.
+
+    :param module: the module name or WatchList key.
+    :returns: a set of WatchList keys.
+    """
+    module = module_name(module)
+    keys = set(Children.get(module, ()))
+    if "." in module:
+        keys.update(Children.get(module.rsplit(".", 1)[-1], ()))
+    return keys
+
+
+def reachable(module):
+    """
+    Get the WatchList keys of all modules imported, directly or indirectly, by
+    a module.  This should be called from a thread that has acquired the import
+    lock to be thread safe.
+
+    :param module: the module name or WatchList key.
+    :returns: a list of WatchList keys in which each module comes after the
+              modules it imports (apart from import cycles).
+    """
+    order = []
+    visited = set([module_name(module)])
+    stack = [(module, iter(dependencies(module)))]
+    while stack:
+        node, children = stack[-1]
+        for child in children:
+            if child not in visited:
+                visited.add(child)
+                stack.append((child, iter(dependencies(child))))
+                break
+        else:
+            stack.pop()
+            if stack:
+                order.append(node)
+    return order
+
+
+def latest_submodule_time(module, mtime=0):
     """
     Determine the latest time stamp of all submodules of a module.  This should
     be called from a thread that has acquired the import lock to be thread
@@ -21,35 +130,27 @@ def latest_submodule_time(module, mtime=0, processed=None):
     :param module: the module name.  The WatchList is checked for modules that
                    list this as a parent.
     :param mtime: the latest module time known to this point.
-    :param processed: a list of modules that were processed (to avoid infinite
-                      recursion).
     :returns: the latest module mtime.
     """
-    if processed is None:
-        processed = []
-    if module.endswith(".py"):
-        module = module[:-3]
-    if module in processed:
-        return mtime
-    processed.append(module)
-    for key in WatchList:
-        if WatchList[key]["parent"] == module:
+    # While files are being watched, the result can be reused until a file or
+    # the import graph changes.
+    version = watch_version()
+    state = (version, GraphVersion[0]) if version is not None else None
+    if SubtreeTimes["state"] != state or state is None:
+        SubtreeTimes["state"] = state
+        SubtreeTimes["times"] = {}
+
+    name = module_name(module)
+    latest = SubtreeTimes["times"].get(name)
+    if latest is None:
+        latest = 0
+        for key in reachable(module):
             filemtime = module_getmtime(WatchList[key]["file"])
             if filemtime:
-                mtime = max(mtime, filemtime)
-            mtime = latest_submodule_time(key, mtime, processed)
-    if "." in module:
-        module = module.rsplit(".", 1)[-1]
-        if module in processed:
-            return mtime
-        processed.append(module)
-        for key in WatchList:
-            if WatchList[key]["parent"] == module:
-                filemtime = module_getmtime(WatchList[key]["file"])
-                if filemtime:
-                    mtime = max(mtime, filemtime)
-                mtime = latest_submodule_time(key, mtime, processed)
-    return mtime
+                latest = max(latest, filemtime)
+        SubtreeTimes["times"][name] = latest
+
+    return max(mtime, latest)
 
 
 def module_getmtime(filename):
@@ -82,13 +183,13 @@ def module_reload_changed(key):
         if not modkey:
             return False
         found = None
-        if modkey:
-            for second in WatchList:
-                secmodkey = module_sys_modules_key(second)
-                if secmodkey and sys.modules[modkey] == sys.modules[secmodkey]:
-                    found = second
-                    foundmodkey = secmodkey
-                    break
+        # Any watched import of the same module was loaded from the same file.
+        for second in Files.get(getattr(sys.modules[modkey], "__file__", None), ()):
+            secmodkey = module_sys_modules_key(second)
+            if secmodkey and sys.modules[modkey] == sys.modules[secmodkey]:
+                found = second
+                foundmodkey = secmodkey
+                break
         if not found:
             return
         filemtime = module_getmtime(WatchList[found]["file"])
@@ -96,9 +197,8 @@ def module_reload_changed(key):
         if filemtime > WatchList[found]["time"]:
             tangelo.log("Reloaded %s" % found)
             reload_including_local(sys.modules[foundmodkey])
-            for second in WatchList:
-                if WatchList[second]["file"] == WatchList[found]["file"]:
-                    WatchList[second]["time"] = filemtime
+            for second in Files[WatchList[found]["file"]]:
+                WatchList[second]["time"] = filemtime
     finally:
         imp.release_lock()
     return True
@@ -133,14 +233,11 @@ def reload_including_local(module):
     except ImportError:
         # This can happen if the module was loaded in the immediate script
         # directory.  Add the service path and try again.
-        if not hasattr(cherrypy.thread_data, "modulepath"):
-            raise
-        path = os.path.abspath(cherrypy.thread_data.modulepath)
-        root = os.path.abspath(cherrypy.config.get("webroot"))
-        if path not in sys.path and (path == root or path.startswith(root + os.path.sep)):
+        paths = tangelo.util.service_import_paths()
+        if paths:
             oldpath = sys.path
             try:
-                sys.path = [path] + sys.path
+                sys.path = paths + sys.path
                 reload(module)
             finally:
                 sys.path = oldpath
@@ -148,45 +245,34 @@ def reload_including_local(module):
             raise
 
 
-def reload_recent_submodules(module, mtime=0, processed=[]):
+def reload_recent_submodules(module):
     """
-    Recursively reload submodules which are more recent than a specified
-    timestamp.  To be called from a thread that has acquired the import lock to
-    be thread safe.
+    Reload the submodules of a module that have changed (or whose own
+    submodules have changed) since they were loaded.  Each module is reloaded
+    at most once, after the modules it imports.  To be called from a thread
+    that has acquired the import lock to be thread safe.
 
     :param module: the module name.  The WatchList is checked for modules that
                    list this as a parent.
-    :param mtime: the latest module time known to this point.
-    :param processed: a list of modules that were processed (to avoid infinite
-                      recursion).
     :returns: True if any submodule was reloaded.
     """
-    if module.endswith(".py"):
-        module = module[:-3]
-    if module in processed:
-        return False
-    any_reloaded = False
-    for key in WatchList:
-        if WatchList[key]["parent"] == module:
-            reloaded = reload_recent_submodules(key, mtime, processed)
-            filemtime = module_getmtime(WatchList[key]["file"])
-            filemtime = latest_submodule_time(key, filemtime)
-            any_reloaded = any_reloaded or reloaded
-            if reloaded or filemtime > WatchList[key]["time"]:
-                WatchList[key]["time"] = filemtime
-                for second in WatchList:
-                    if second != key and WatchList[second]["file"] == WatchList[key]["file"]:
-                        WatchList[second]["time"] = filemtime
-                modkey = module_sys_modules_key(key)
-                if modkey:
-                    try:
-                        reload_including_local(sys.modules[modkey])
-                        tangelo.log("Reloaded %s" % modkey)
-                    except ImportError:
-                        del sys.modules[modkey]
-                        tangelo.log("Asking %s to reimport" % modkey)
-                    any_reloaded = True
-    return any_reloaded
+    reloaded = set()
+    for key in reachable(module):
+        filemtime = module_getmtime(WatchList[key]["file"])
+        filemtime = latest_submodule_time(key, filemtime)
+        if filemtime > WatchList[key]["time"] or not reloaded.isdisjoint(dependencies(key)):
+            for second in Files[WatchList[key]["file"]]:
+                WatchList[second]["time"] = max(WatchList[second]["time"], filemtime)
+            modkey = module_sys_modules_key(key)
+            if modkey:
+                try:
+                    reload_including_local(sys.modules[modkey])
+                    tangelo.log("Reloaded %s" % modkey)
+                except ImportError:
+                    del sys.modules[modkey]
+                    tangelo.log("Asking %s to reimport" % modkey)
+            reloaded.add(key)
+    return len(reloaded) > 0
 
 
 def watch_import(name, globals=None, *args, **kwargs):
@@ -208,7 +294,14 @@ def watch_import(name, globals=None, *args, **kwargs):
     # will be the absolute file path.
     parent = globals["__name__"]
     key = parent + "." + name
-    module_reload_changed(key)
+    # Unless some watched file has changed since this import was last
+    # checked, there is nothing to reload.
+    version = watch_version()
+    entry = WatchList.get(key)
+    if version is None or entry is None or entry.get("version") != version:
+        module_reload_changed(key)
+        if version is not None and entry is not None:
+            entry["version"] = version
     try:
         module = builtin_import(name, globals, *args, **kwargs)
     except ImportError:
@@ -224,6 +317,13 @@ def watch_import(name, globals=None, *args, **kwargs):
                 WatchList[key] = {
                     "time": filemtime
                 }
+                Children.setdefault(parent, set()).add(key)
+                GraphVersion[0] += 1
+            oldfile = WatchList[key].get("file")
+            if oldfile != module.__file__:
+                if oldfile is not None:
+                    Files[oldfile].discard(key)
+                Files.setdefault(module.__file__, set()).add(key)
             WatchList[key].update({
                 "parent": parent,
                 "name": name,
@@ -231,6 +331,8 @@ def watch_import(name, globals=None, *args, **kwargs):
             })
         finally:
             imp.release_lock()
+        if FileWatcher is not None:
+            FileWatcher.watch(module.__file__)
     return module
 
 
@@ -239,46 +341,86 @@ def watch_module_cache_get(cache, module):
     When we ask to fetch a module with optional config file, check time stamps
     and dependencies to determine if it should be reloaded or not.
 
+    A changed module is loaded again alongside the old version, which keeps
+    serving other requests until the new version replaces it.  Only the checks
+    of the import graph and the reloading of submodules are done under the
+    import lock; the service module itself is loaded under its own lock.
+
     :param cache: the cache object that stores whether to check for config
                   files and which files have been loaded.
     :param module: the path of the module to load.
     :returns: the loaded module.
     """
-    imp.acquire_lock()
+    # If no watched file has changed since the module was last checked, it
+    # can be served as is.
+    version = watch_version()
+    if version is not None and module in cache.modules and getattr(cache, "versions", {}).get(module) == version:
+        return tangelo_module_cache_get(cache, module)
+
+    lock = cache.locks.setdefault(module, threading.RLock())
+    if not lock.acquire(False):
+        # Another thread is checking (or reloading) this module; rather than
+        # wait for it, use the version that is loaded now.
+        service = cache.modules.get(module)
+        if service is not None:
+            return service
+        lock.acquire()
+
     try:
         if not hasattr(cache, "timestamps"):
             cache.timestamps = {}
+            cache.versions = {}
+        if version is not None and module in cache.modules and cache.versions.get(module) == version:
+            return tangelo_module_cache_get(cache, module)
+
+        # Watch the module and its config file before looking at them, and
+        # only then take the version to record, so that a change made while
+        # the module is being checked or loaded always counts against it.
+        use_config = getattr(cache, "config", False)
+        config_file = module[:-2] + "yaml"
+        file_watcher = FileWatcher
+        if file_watcher is not None:
+            file_watcher.watch(module)
+            if use_config:
+                file_watcher.watch(config_file)
+        version = watch_version()
+
         mtime = os.path.getmtime(module)
-        mtime = latest_submodule_time(module, mtime)
-        if getattr(cache, "config", False):
-            config_file = module[:-2] + "yaml"
+        if use_config:
             if os.path.exists(config_file):
                 # Our timestamp is the latest time of the config file or the
                 # module.
                 mtime = max(mtime, os.path.getmtime(config_file))
-            # If we have a config file and the timestamp is more recent than
-            # the recorded timestamp, remove the config file from the list of
-            # loaded files so that it will get loaded again.
-            if config_file in cache.config_files and mtime > cache.timestamps.get(module, 0):
-                del cache.config_files[config_file]
-                tangelo.log("WATCH", "Asking to reload config file %s" % config_file)
-        # If the timestamp is more recent than the recorded value, remove the
-        # the module from our records so that it will be loaded again.
-        if module in cache.modules and mtime > cache.timestamps.get(module, 0):
-            del cache.modules[module]
-            tangelo.log("WATCH", "Asking to reload module %s" % module)
+
+        imp.acquire_lock()
+        try:
+            mtime = latest_submodule_time(module, mtime)
+            reload_recent_submodules(module)
+        finally:
+            imp.release_lock()
+
+        # If the timestamp is more recent than the recorded value, load the
+        # module (and its config file) again.
+        force_reload = module in cache.modules and mtime > cache.timestamps.get(module, 0)
+        if force_reload:
+            tangelo.log("WATCH", "Reloading module %s" % module)
         if module not in cache.timestamps:
             tangelo.log_info("WATCH", "Monitoring module %s" % module)
-        reload_recent_submodules(module, mtime)
-        cache.timestamps[module] = mtime
-        service = tangelo_module_cache_get(cache, module)
+        service = tangelo_module_cache_get(cache, module, force_reload=force_reload)
+
         # Update our time based on all the modules that we may have just
         # imported.  The times can change from before because python files are
         # compiled, for instance.
-        mtime = latest_submodule_time(module, mtime)
+        imp.acquire_lock()
+        try:
+            mtime = latest_submodule_time(module, mtime)
+        finally:
+            imp.release_lock()
         cache.timestamps[module] = mtime
+        if version is not None:
+            cache.versions[module] = version
     finally:
-        imp.release_lock()
+        lock.release()
     return service
 
 
@@ -0,0 +1,176 @@
+import ctypes
+import ctypes.util
+import errno
+import os
+import struct
+import threading
+
+import tangelo
+
+# Constants from <sys/inotify.h>.
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+
+# The fixed part of struct inotify_event: wd, mask, cookie, len.
+EVENT = struct.Struct("iIII")
+
+
+def source_file(filename):
+    """
+    Return the file to watch for a module file: the corresponding .py file for
+    a .pyc or .pyo file (if it exists), or else the file itself.
+    """
+    if os.path.splitext(filename)[1].lower() in (".pyc", ".pyo") and os.path.exists(filename[:-1]):
+        filename = filename[:-1]
+    return os.path.abspath(filename)
+
+
+class InotifyWatcher(object):
+    """
+    Watches files for changes through Linux's inotify interface.  Pending
+    events are read (without blocking) whenever the watcher is asked for its
+    version, so that a check costs a single system call no matter how many
+    files are watched.
+    """
+    mask = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+    def __init__(self):
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            code = ctypes.get_errno()
+            raise OSError(code, "inotify_init1(): %s" % (os.strerror(code)))
+
+        # Directories are watched rather than the files themselves, so that
+        # files replaced by renaming (as many editors save them) and files
+        # that do not exist yet are caught.
+        self.directories = {}
+        self.descriptors = {}
+        self.files = set()
+
+        self.version = 0
+        self.lock = threading.Lock()
+
+    def watch(self, filename):
+        filename = source_file(filename)
+        with self.lock:
+            if filename in self.files:
+                return
+
+            directory = os.path.dirname(filename)
+            if directory not in self.descriptors:
+                wd = self.libc.inotify_add_watch(self.fd, directory, self.mask)
+                if wd < 0:
+                    tangelo.log_warning("WATCH", "Could not watch directory %s: %s" % (directory, os.strerror(ctypes.get_errno())))
+                    return
+
+                self.descriptors[directory] = wd
+                self.directories[wd] = directory
+
+            self.files.add(filename)
+
+    def current(self):
+        """
+        Return a number that changes whenever a watched file changes.
+        """
+        with self.lock:
+            while self.fd >= 0:
+                try:
+                    data = os.read(self.fd, 65536)
+                except OSError as e:
+                    if e.errno == errno.EAGAIN:
+                        break
+                    raise
+
+                offset = 0
+                while offset < len(data):
+                    wd, mask, cookie, length = EVENT.unpack_from(data, offset)
+                    name = data[offset + EVENT.size:offset + EVENT.size + length].rstrip("\0")
+                    offset += EVENT.size + length
+
+                    directory = self.directories.get(wd)
+                    if mask & IN_Q_OVERFLOW or (directory is not None and os.path.join(directory, name) in self.files):
+                        self.version += 1
+
+            return self.version
+
+    def stop(self):
+        with self.lock:
+            if self.fd >= 0:
+                os.close(self.fd)
+                self.fd = -1
+
+
+class PollingWatcher(object):
+    """
+    Watches files for changes by checking their modification times from a
+    background thread, every `interval` seconds.
+    """
+    def __init__(self, interval=1):
+        self.interval = interval
+        self.files = {}
+        self.version = 0
+        self.lock = threading.Lock()
+
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="WatchPoller")
+        self.thread.daemon = True
+        self.thread.start()
+
+    @staticmethod
+    def getmtime(filename):
+        try:
+            return os.path.getmtime(filename)
+        except OSError:
+            return None
+
+    def watch(self, filename):
+        filename = source_file(filename)
+        with self.lock:
+            if filename not in self.files:
+                self.files[filename] = PollingWatcher.getmtime(filename)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            with self.lock:
+                files = self.files.items()
+
+            changed = {}
+            for filename, mtime in files:
+                current = PollingWatcher.getmtime(filename)
+                if current != mtime:
+                    changed[filename] = current
+
+            if changed:
+                with self.lock:
+                    self.files.update(changed)
+                    self.version += 1
+
+    def current(self):
+        return self.version
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+
+def create(poll_interval=1, inotify=True):
+    """
+    Create an inotify watcher if possible (i.e., on Linux), or else a polling
+    watcher.
+    """
+    if inotify:
+        try:
+            return InotifyWatcher()
+        except (AttributeError, OSError, TypeError) as e:
+            tangelo.log_info("WATCH", "inotify is unavailable (%s); polling for changes instead" % (e))
+
+    return PollingWatcher(poll_interval)
@@ -0,0 +1,521 @@
+import cherrypy
+import cherrypy._cprequest
+import cherrypy.lib.httputil
+import collections
+import logging
+import multiprocessing
+import multiprocessing.connection
+import os
+import Queue
+import select
+import signal
+import StringIO
+import sys
+import threading
+import time
+import traceback
+
+import tangelo
+import tangelo.eventloop
+import tangelo.util
+
+# The service module run by this worker process.
+worker_service = None
+
+
+class RemoteError(Exception):
+    """
+    An exception raised by a service running in a worker process; its message
+    is the traceback from the worker.
+    """
+    pass
+
+
+class Timeout(Exception):
+    """
+    Raised when a service running in a worker process does not produce its
+    result in time.
+    """
+    pass
+
+
+class UnavailableStore(dict):
+    """
+    Stands in for the table of persistent service stores in a worker process,
+    where a store would silently be private to that one process.
+    """
+    def __missing__(self, module):
+        raise RuntimeError("tangelo.store() is not available to services running in worker processes")
+
+
+class RequestInfo(object):
+    """
+    The parts of the current request (and response) that a service running in a
+    worker process can see.
+    """
+    def __init__(self):
+        request = cherrypy.request
+
+        self.method = request.method
+        self.path_info = request.path_info
+        self.headers = request.headers.items()
+        self.body = request.body.read() if request.process_request_body else None
+        self.content_type = cherrypy.response.headers.get("Content-Type")
+
+
+class Outcome(object):
+    """
+    The result of running a service in a worker process, along with any
+    changes it made to the response status and headers.
+    """
+    def __init__(self, result=None, status=None, headers=None, error=None):
+        self.result = result
+        self.status = status
+        self.headers = headers or {}
+        self.error = error
+
+
+def initialize(module, pluginpath):
+    global worker_service
+
+    # The worker inherits the server's signal handlers, which would shut down
+    # (this copy of) the server; leave signals to the server process instead.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    if hasattr(signal, "SIGHUP"):
+        signal.signal(signal.SIGHUP, signal.SIG_DFL)
+    if hasattr(signal, "SIGCHLD"):
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+
+    # Coroutine services need an event loop of their own.
+    tangelo.eventloop.EventLoop()
+
+    # Set up the same per-thread data that the server sets up for a service
+    # invocation.  The working directory is private to this process, so the
+    # service can always run in its own directory.
+    modpath = os.path.dirname(module)
+    cherrypy.thread_data.modulepath = modpath
+    cherrypy.thread_data.modulename = module
+    cherrypy.thread_data.pluginpath = pluginpath
+    os.chdir(modpath)
+
+    # The worker was forked before the server loaded the service, so it loads
+    # the service (and its configuration) itself.
+    worker_service = tangelo.util.ModuleCache().get(module)
+    cherrypy.config["module-store"] = UnavailableStore()
+
+
+def work(address, authkey, token, module, pluginpath):
+    # Connect to the server, and then run service calls sent along the
+    # connection until the server closes it.
+    conn = multiprocessing.connection.Client(address, authkey=authkey)
+    conn.send((os.getpid(), token))
+
+    try:
+        initialize(module, pluginpath)
+    except:
+        conn.send(traceback.format_exc())
+        return
+    conn.send(None)
+
+    while True:
+        try:
+            info, pargs, kwargs = conn.recv()
+        except EOFError:
+            return
+
+        conn.send(execute(info, pargs, kwargs))
+
+
+def acquire_logging_locks():
+    # Take the locks that the logging module and its handlers use (in the same
+    # order as the logging module does), so that no other thread holds one of
+    # them while this one forks.
+    logging._acquireLock()
+    handlers = filter(None, [ref() for ref in logging._handlerList])
+    for handler in handlers:
+        handler.acquire()
+    return handlers
+
+
+def release_logging_locks(handlers):
+    for handler in reversed(handlers):
+        handler.release()
+    logging._releaseLock()
+
+
+def spawn_workers(conn, server_conn, uid, gid, handlers):
+    # The spawner starts out holding the logging locks that the server held for
+    # the fork.
+    release_logging_locks(handlers)
+
+    # Only the server holds its end of the pipe, so that the spawner sees the
+    # pipe close when the server is done with it.
+    server_conn.close()
+
+    # Leave signals to the server, except that worker processes are reaped
+    # automatically.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    if hasattr(signal, "SIGHUP"):
+        signal.signal(signal.SIGHUP, signal.SIG_DFL)
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+
+    # Drop privileges as the server does, if the server has not already done
+    # so by the time the spawner starts.
+    if os.getuid() == 0:
+        if gid is not None:
+            os.setgroups([])
+            os.setgid(gid)
+        if uid is not None:
+            os.setuid(uid)
+
+    while True:
+        try:
+            request = conn.recv()
+        except EOFError:
+            return
+
+        try:
+            pid = os.fork()
+        except OSError as e:
+            conn.send(str(e))
+            continue
+
+        if pid == 0:
+            conn.close()
+
+            status = 1
+            try:
+                work(*request)
+                status = 0
+            finally:
+                os._exit(status)
+
+        conn.send(None)
+
+
+def execute(info, pargs, kwargs):
+    # Recreate enough of the request for the service (and the tangelo
+    # functions it calls) to work with.
+    request = cherrypy._cprequest.Request(cherrypy.lib.httputil.Host("127.0.0.1", 80),
+                                          cherrypy.lib.httputil.Host("127.0.0.1", 1111))
+    request.method = info.method
+    request.path_info = info.path_info
+    request.headers = cherrypy.lib.httputil.HeaderMap()
+    request.headers.update(dict(info.headers))
+    request.process_request_body = info.body is not None
+    request.body = StringIO.StringIO(info.body or "")
+
+    response = cherrypy._cprequest.Response()
+    response.headers["Content-Type"] = info.content_type
+
+    cherrypy.serving.load(request, response)
+    before = dict(response.headers)
+
+    # As in the server, undo any changes the service makes to the module path.
+    origpath = list(sys.path)
+    try:
+        result = tangelo.util.call_service(worker_service, pargs, kwargs)
+
+        # Generators cannot be sent back to the server, so collect their items
+        # here.
+        if isinstance(result, collections.Iterator):
+            result = list(result)
+        elif isinstance(result, tangelo._Chunked):
+            result.iterable = list(result.iterable)
+    except:
+        return Outcome(error=traceback.format_exc())
+    finally:
+        sys.path = origpath
+
+    headers = {key: value for key, value in response.headers.iteritems() if before.get(key) != value}
+    return Outcome(result, response.status, headers)
+
+
+class Spawner(object):
+    """
+    A process, started when the first pool of workers is needed, which forks
+    the worker processes for services on its behalf.  A process forked from
+    the busy, multithreaded server could inherit a lock held by one of the
+    server's other threads, which it could then never acquire; the spawner is
+    single-threaded, so its children start cleanly.  (The spawner itself is
+    forked while holding the logging locks, the only ones it or a worker would
+    otherwise share with the server's threads.)  The workers connect back to
+    the server to receive service calls.
+    """
+    def __init__(self, uid=None, gid=None):
+        self.conn, child = multiprocessing.Pipe()
+
+        handlers = acquire_logging_locks()
+        try:
+            self.process = multiprocessing.Process(target=spawn_workers, args=(child, self.conn, uid, gid, handlers), name="TangeloSpawner")
+            self.process.daemon = True
+            self.process.start()
+        finally:
+            release_logging_locks(handlers)
+        child.close()
+
+        # The listener is created when first needed: after any privilege drop,
+        # so that the workers can connect to it, and after the spawner has
+        # started, so that the spawner and the workers never hold its socket.
+        self.listener = None
+        self.authkey = os.urandom(32)
+        self.spawned = 0
+        self.lock = threading.Lock()
+
+    def accept(self, timeout):
+        # Listener.accept() cannot time out by itself, and would otherwise wait
+        # forever for a worker that exited before connecting.
+        ready = select.select([self.listener._listener._socket], [], [], timeout)[0]
+        if not ready:
+            raise RuntimeError("Worker process did not connect within %s seconds" % (timeout))
+        return self.listener.accept()
+
+    def spawn(self, module, pluginpath, timeout):
+        with self.lock:
+            if self.listener is None:
+                self.listener = multiprocessing.connection.Listener(authkey=self.authkey)
+
+            self.spawned += 1
+            self.conn.send((self.listener.address, self.authkey, self.spawned, module, pluginpath))
+            error = self.conn.recv()
+            if error is not None:
+                raise RuntimeError("Could not start worker process: %s" % (error))
+
+            # Skip any worker that connects too late for an earlier request.
+            while True:
+                conn = self.accept(timeout)
+                if not conn.poll(timeout):
+                    conn.close()
+                    raise RuntimeError("Worker process did not identify itself within %s seconds" % (timeout))
+
+                pid, token = conn.recv()
+                worker = Worker(pid, conn)
+                if token == self.spawned:
+                    break
+                worker.kill()
+
+        if not conn.poll(timeout):
+            worker.kill()
+            raise RuntimeError("Worker process for %s did not start within %s seconds" % (module, timeout))
+
+        error = conn.recv()
+        if error is not None:
+            worker.kill()
+            raise RemoteError(error)
+
+        return worker
+
+    def close(self):
+        self.conn.close()
+        if self.listener is not None:
+            self.listener.close()
+        self.process.join()
+
+
+class Worker(object):
+    def __init__(self, pid, conn):
+        self.pid = pid
+        self.conn = conn
+
+    def stop(self):
+        # The worker exits when its connection closes.
+        self.conn.close()
+
+    def kill(self):
+        try:
+            os.kill(self.pid, signal.SIGKILL)
+        except OSError:
+            pass
+        self.conn.close()
+
+
+class ServicePool(object):
+    def __init__(self, spawner, module, service, size, timeout):
+        self.spawner = spawner
+        self.module = module
+        self.service = service
+        self.size = size
+        self.timeout = timeout
+        self.pluginpath = getattr(cherrypy.thread_data, "pluginpath", None)
+
+        self.idle = Queue.Queue()
+        self.workers = set()
+        self.closed = False
+        self.lock = threading.Lock()
+
+        for i in xrange(size):
+            self.add()
+
+    def add(self):
+        worker = self.spawner.spawn(self.module, self.pluginpath, self.timeout)
+        with self.lock:
+            self.workers.add(worker)
+        self.idle.put(worker)
+
+    def remove(self, worker, kill=False):
+        with self.lock:
+            self.workers.discard(worker)
+
+        if kill:
+            worker.kill()
+        else:
+            worker.stop()
+
+    def replace(self, worker):
+        # A worker that is stuck, has died, or is otherwise in an unknown state
+        # is killed, and a new one started in its place.
+        self.remove(worker, kill=True)
+        if not self.closed:
+            try:
+                self.add()
+            except:
+                tangelo.util.log_traceback("SERVICE", tangelo.util.generate_error_code(), "Could not replace worker process for %s" % (self.module))
+
+    def run(self, worker, info, pargs, kwargs, deadline):
+        try:
+            worker.conn.send((info, pargs, kwargs))
+            if not worker.conn.poll(max(0, deadline - time.time())):
+                raise Timeout("Service %s did not finish within %s seconds" % (self.module, self.timeout))
+
+            return worker.conn.recv()
+        except (EOFError, IOError):
+            raise RemoteError("Worker process %d for %s exited" % (worker.pid, self.module))
+
+    def call(self, pargs, kwargs):
+        info = RequestInfo()
+
+        # The timeout covers both waiting for a free worker and the call itself.
+        deadline = time.time() + self.timeout
+        try:
+            worker = self.idle.get(timeout=self.timeout)
+        except Queue.Empty:
+            raise Timeout("No worker process for %s became free within %s seconds" % (self.module, self.timeout))
+
+        try:
+            outcome = self.run(worker, info, pargs, kwargs, deadline)
+        except:
+            exc = sys.exc_info()
+            self.replace(worker)
+            raise exc[0], exc[1], exc[2]
+
+        if self.closed:
+            self.remove(worker)
+        else:
+            self.idle.put(worker)
+
+        if outcome.error is not None:
+            raise RemoteError(outcome.error)
+
+        if outcome.status is not None:
+            cherrypy.response.status = outcome.status
+        cherrypy.response.headers.update(outcome.headers)
+
+        return outcome.result
+
+    def close(self):
+        # Stop the idle workers now, and the busy ones once they finish.
+        self.closed = True
+        while True:
+            try:
+                worker = self.idle.get_nowait()
+            except Queue.Empty:
+                break
+            self.remove(worker)
+
+    def terminate(self):
+        self.closed = True
+        with self.lock:
+            workers = list(self.workers)
+        for worker in workers:
+            self.remove(worker, kill=True)
+
+
+class ServicePools(object):
+    """
+    The worker process pools for services whose configuration file contains a
+    ``processes`` key, giving the number of worker processes (or ``true`` for
+    one per CPU).  A ``process-timeout`` key gives the number of seconds a call
+    may take, including any wait for a free worker (60 by default).
+
+    The worker processes are forked by a ``Spawner`` process, which is started
+    along with the first pool.
+    """
+    def __init__(self):
+        self.pools = {}
+        self.spawner = None
+        self.uid = None
+        self.gid = None
+
+        # The global lock guards the tables; each module's own lock is held
+        # while its pool is (re)built, which can take a while.
+        self.lock = threading.Lock()
+        self.module_locks = {}
+
+    @staticmethod
+    def size(config):
+        processes = config.get("processes")
+        if processes is True:
+            return multiprocessing.cpu_count()
+        elif isinstance(processes, int) and not isinstance(processes, bool) and processes > 0:
+            return processes
+        else:
+            return None
+
+    @staticmethod
+    def timeout(config):
+        timeout = config.get("process-timeout", 60)
+        if isinstance(timeout, (int, float)) and not isinstance(timeout, bool) and timeout > 0:
+            return timeout
+        else:
+            return 60
+
+    def start(self):
+        with self.lock:
+            if self.spawner is None:
+                self.spawner = Spawner(self.uid, self.gid)
+            return self.spawner
+
+    def get(self, module, service, config):
+        size = ServicePools.size(config)
+        if size is None and module not in self.pools:
+            return None
+
+        timeout = ServicePools.timeout(config)
+        with self.lock:
+            module_lock = self.module_locks.setdefault(module, threading.Lock())
+
+        with module_lock:
+            pool = self.pools.get(module)
+
+            # Replace the pool if the module has been reloaded or the pool
+            # reconfigured, letting the old pool finish any calls in progress.
+            if pool is not None and (size is None or pool.service is not service or pool.size != size or pool.timeout != timeout):
+                pool.close()
+                with self.lock:
+                    self.pools.pop(module, None)
+                pool = None
+
+            if pool is None and size is not None:
+                spawner = self.start()
+
+                tangelo.log_info("SERVICE", "Starting %d worker processes for %s" % (size, module))
+                pool = ServicePool(spawner, module, service, size, timeout)
+                with self.lock:
+                    self.pools[module] = pool
+
+        return pool
+
+    def terminate(self):
+        with self.lock:
+            for pool in self.pools.values():
+                pool.terminate()
+            self.pools.clear()
+
+    def close(self):
+        self.terminate()
+        with self.lock:
+            if self.spawner is not None:
+                self.spawner.close()
+                self.spawner = None
@@ -1,14 +1,25 @@
+import collections
 import datetime
+import functools
+import hashlib
 import imp
 import sys
 import os
+import stat
 import cherrypy
+import cherrypy.lib.auth_digest
+import cherrypy.lib.cptools
+import cherrypy.lib.httputil
 import cherrypy.lib.static
 import json
+import threading
+import time
 import traceback
 import types
 
 import tangelo
+import tangelo.eventloop
+import tangelo.pool
 import tangelo.util
 
 
@@ -53,35 +64,276 @@ class UrlAnalysis(object):
         return pprint.pformat(d)
 
 
+class RouteTable(object):
+    """
+    An in-memory image of the directory trees Tangelo serves content from (the
+    web root and the "web" directories of the plugins), arranged as a prefix
+    tree of path components.  Once built, questions like "is this a directory"
+    or "which prefix of this path is a service module" can be answered without
+    touching the filesystem.
+
+    The table is kept current by refresh(), which stats each known directory
+    and lists again only those whose mtime has changed (scanning only the
+    subdirectories that are new).  Every refresh that finds a change bumps the
+    generation counter, which lets dependent caches know when to discard their
+    contents.
+    """
+    class Node(object):
+        def __init__(self, path, mtime):
+            self.path = path
+            self.mtime = mtime
+
+            # Maps entry names to Node objects (for subdirectories) or None
+            # (for anything else).
+            self.children = {}
+
+    def __init__(self, roots):
+        self.generation = 0
+        self.roots = {}
+        for root in roots:
+            root = os.path.abspath(root)
+            self.roots[root] = RouteTable.scan(root, set())
+
+    @staticmethod
+    def scan(path, seen):
+        try:
+            mtime = os.stat(path).st_mtime
+            names = os.listdir(path)
+        except OSError:
+            return None
+
+        # Guard against symlink cycles.
+        real = os.path.realpath(path)
+        if real in seen:
+            return None
+
+        node = RouteTable.Node(path, mtime)
+        node.children = RouteTable.scan_children(path, names, seen | set([real]), {})
+        return node
+
+    @staticmethod
+    def scan_children(path, names, seen, existing):
+        # Build the child table for the entries `names` of the directory at
+        # `path`, reusing the nodes in `existing` for subdirectories already
+        # known, and scanning only the others.
+        children = {}
+        for name in names:
+            child = os.path.join(path, name)
+            try:
+                mode = os.stat(child).st_mode
+            except OSError:
+                # A dangling symlink, or an entry that vanished in the
+                # meantime.
+                continue
+
+            if not stat.S_ISDIR(mode):
+                children[name] = None
+            elif existing.get(name) is not None:
+                children[name] = existing[name]
+            else:
+                children[name] = RouteTable.scan(child, seen)
+
+        return children
+
+    def refresh(self):
+        changed = False
+        for root, node in self.roots.items():
+            if node is None:
+                node = self.roots[root] = RouteTable.scan(root, set())
+                changed = changed or node is not None
+            else:
+                changed = RouteTable.refresh_node(node) or changed
+
+        if changed:
+            self.generation += 1
+
+    @staticmethod
+    def refresh_node(node):
+        changed = False
+
+        mtime = tangelo.util.getmtime(node.path)
+        if mtime != node.mtime:
+            # The directory's entries have changed - list it again, keeping the
+            # nodes for subdirectories that are still present (which are
+            # refreshed below like any others), and scanning only new ones.
+            try:
+                names = os.listdir(node.path)
+            except OSError:
+                children = {}
+            else:
+                children = RouteTable.scan_children(node.path, names, set([os.path.realpath(node.path)]), node.children)
+
+            # Replace the child table in one step, so that concurrent readers
+            # always see a consistent dict.
+            node.children = children
+            node.mtime = mtime
+            changed = True
+
+        for child in node.children.values():
+            if child is not None:
+                changed = RouteTable.refresh_node(child) or changed
+
+        return changed
+
+    def locate(self, path):
+        """
+        Find the root containing `path`, and split the remainder of the path
+        into components.  Returns None if the path lies outside every root (or
+        uses relative components), meaning the table cannot answer for it.
+        """
+        for root in self.roots:
+            if path == root:
+                return root, []
+            elif path.startswith(root + os.path.sep):
+                comps = path[len(root) + 1:].split(os.path.sep)
+
+                # Leave anything but a plain path (with at most a trailing
+                # slash) to the filesystem.
+                if "." in comps or ".." in comps or "" in comps[:-1]:
+                    return None
+
+                return root, comps
+
+        return None
+
+    def lookup(self, path):
+        """
+        Returns a pair (known, entry).  If `known` is False, the table does not
+        cover the path; otherwise, `entry` is a Node for a directory, None for a
+        non-directory file, and False for a path that does not exist.
+        """
+        located = self.locate(path)
+        if located is None:
+            return False, None
+
+        root, comps = located
+        entry = self.roots[root]
+        if entry is None:
+            return True, False
+
+        # A trailing slash names the directory itself, and is only valid for
+        # directories.
+        trailing = len(comps) > 0 and comps[-1] == ""
+        if trailing:
+            comps = comps[:-1]
+
+        for comp in comps:
+            if not isinstance(entry, RouteTable.Node) or comp not in entry.children:
+                return True, False
+            entry = entry.children[comp]
+
+        if trailing and not isinstance(entry, RouteTable.Node):
+            return True, False
+
+        return True, entry
+
+    def isdir(self, path):
+        known, entry = self.lookup(path)
+        return isinstance(entry, RouteTable.Node) if known else None
+
+    def exists(self, path):
+        known, entry = self.lookup(path)
+        return entry is not False if known else None
+
+    def find_service(self, pathcomp):
+        """
+        Given a list of path components (the first of which is an absolute
+        path), return the index of the component naming a Python service
+        module, or None if no prefix of the path does.  Returns False if the
+        table does not cover the path.
+        """
+        known, node = self.lookup(os.path.dirname(pathcomp[0]))
+        if not known:
+            return False
+
+        names = [os.path.basename(pathcomp[0])] + pathcomp[1:]
+        for i, name in enumerate(names):
+            if not isinstance(node, RouteTable.Node):
+                break
+
+            if node.children.get(name + ".py", False) is None:
+                return i
+
+            node = node.children.get(name)
+
+        return None
+
+
 class UrlAnalyzer(object):
     instance = None
 
     def __init__(self):
         UrlAnalyzer.instance = self
 
+        # Cache of analysis results, keyed by request path.  Each entry also
+        # records the mtimes of the directories (and config files) that were
+        # consulted in producing it, so that a change on disk invalidates it.
+        self.cache = tangelo.util.LRUCache(1024)
+        self.revalidate = 0
+
+        # An optional RouteTable answering filesystem queries from memory.
+        self.routes = None
+
         def blocked(self):
             raise RuntimeError("You are not allowed to instantiate UrlAnalyzer")
 
         UrlAnalyzer.__init__ = blocked
 
+    def configure_cache(self, size, revalidate=0):
+        self.cache = tangelo.util.LRUCache(size) if size > 0 else None
+        self.revalidate = revalidate
+
+    def configure_routes(self, routes):
+        self.routes = routes
+        if self.cache is not None:
+            self.cache.clear()
+
+    def generation(self):
+        return self.routes.generation if self.routes is not None else None
+
+    @staticmethod
+    def depend(deps, path):
+        if deps is not None and path not in deps:
+            deps[path] = tangelo.util.getmtime(path)
+
+    # These wrap the corresponding os.path functions.  If there is a route
+    # table covering the path, it answers the query; otherwise, the directory
+    # containing the probed path is recorded as a dependency of the analysis in
+    # progress and the filesystem is consulted.
+    def isdir(self, path, deps=None):
+        result = self.routes.isdir(path) if self.routes is not None else None
+        if result is None:
+            UrlAnalyzer.depend(deps, os.path.dirname(path))
+            result = os.path.isdir(path)
+        return result
+
+    def exists(self, path, deps=None):
+        result = self.routes.exists(path) if self.routes is not None else None
+        if result is None:
+            UrlAnalyzer.depend(deps, os.path.dirname(path))
+            result = os.path.exists(path)
+        return result
+
     @staticmethod
     def is_python_file(path):
         pyfile_ext = [".py", ".pyw", ".pyc", ".pyo", ".pyd"]
         return len(path) > 0 and any(path.endswith(ext) for ext in pyfile_ext)
 
-    @staticmethod
-    def is_service_config_file(path):
-        return path.endswith(".yaml") and os.path.exists(".".join(os.path.join(path.split(".")[:-1])) + ".py")
+    def is_service_config_file(self, path, deps=None):
+        return path.endswith(".yaml") and self.exists(".".join(os.path.join(path.split(".")[:-1])) + ".py", deps)
 
-    def accessible(self, path):
+    def accessible(self, path, deps=None):
         listdir = cherrypy.config.get("listdir")
         showpy = cherrypy.config.get("showpy")
 
-        if os.path.isdir(path):
+        if self.isdir(path, deps):
             return listdir
         elif UrlAnalyzer.is_python_file(path):
             config_file = ".".join(path.split(".")[:-1]) + ".yaml"
-            if os.path.exists(config_file):
+            if self.exists(config_file, deps):
+                # The config file's contents matter here, not just its
+                # existence.
+                UrlAnalyzer.depend(deps, config_file)
                 try:
                     config = tangelo.util.yaml_safe_load(config_file, dict)
                 except (ValueError, TypeError):
@@ -98,12 +350,32 @@ class UrlAnalyzer(object):
                     return config_showpy
 
             return showpy
-        elif UrlAnalyzer.is_service_config_file(path):
+        elif self.is_service_config_file(path, deps):
             return False
         else:
             return True
 
     def analyze(self, raw_reqpath):
+        if self.cache is None:
+            return self.compute(raw_reqpath)
+
+        # Note the route table generation *before* computing the analysis, so
+        # that a refresh racing with the computation invalidates the result.
+        generation = self.generation()
+
+        entry = self.cache.get(raw_reqpath)
+        if entry is not None:
+            analysis, entry_generation, stamps = entry
+            if entry_generation == generation and not stamps.changed(self.revalidate):
+                return analysis
+
+        deps = {}
+        analysis = self.compute(raw_reqpath, deps)
+        self.cache.set(raw_reqpath, (analysis, generation, tangelo.util.FileStamps(deps)))
+
+        return analysis
+
+    def compute(self, raw_reqpath, deps=None):
         webroot = cherrypy.config.get("webroot")
         plugins = cherrypy.config.get("plugins")
 
@@ -195,27 +467,35 @@ class UrlAnalyzer(object):
         # If it is not a regular file, then check to see if it is a python service.
         #
         # Finally, if it is none of the above, then indicate a 404 error.
-        if os.path.isdir(path):
+        if self.isdir(path, deps):
             if raw_reqpath[-1] != "/":
                 analysis.directive = Directive(Directive.HTTPRedirect, argument=raw_reqpath + "/")
                 return analysis
-            elif os.path.exists(path + os.path.sep + "index.html"):
+            elif self.exists(path + os.path.sep + "index.html", deps):
                 analysis.directive = Directive(Directive.InternalRedirect, argument=raw_reqpath + "index.html")
                 return analysis
             else:
                 # Only serve a directory listing if the security policy allows it.
-                analysis.content = Content(Content.Directory, path=path if self.accessible(path) else None)
-        elif os.path.exists(path):
+                analysis.content = Content(Content.Directory, path=path if self.accessible(path, deps) else None)
+        elif self.exists(path, deps):
             # Only serve a file if the security policy allows it.
-            analysis.content = Content(Content.File, path=path if self.accessible(path) else None)
+            analysis.content = Content(Content.File, path=path if self.accessible(path, deps) else None)
         else:
             service_path = None
             pargs = None
-            for i in range(len(pathcomp)):
-                service_path = os.path.sep.join(pathcomp[:(i + 1)]) + ".py"
-                if os.path.exists(service_path):
-                    pargs = pathcomp[(i + 1):]
-                    break
+
+            # The route table can find the service module in a single walk
+            # down the path; otherwise, probe each prefix of the path in turn.
+            index = self.routes.find_service(pathcomp) if self.routes is not None else False
+            if index is False:
+                for i in range(len(pathcomp)):
+                    service_path = os.path.sep.join(pathcomp[:(i + 1)]) + ".py"
+                    if self.exists(service_path, deps):
+                        pargs = pathcomp[(i + 1):]
+                        break
+            elif index is not None:
+                service_path = os.path.sep.join(pathcomp[:(index + 1)]) + ".py"
+                pargs = pathcomp[(index + 1):]
 
             if pargs is None:
                 analysis.content = Content(Content.NotFound, path=raw_reqpath)
@@ -237,15 +517,27 @@ class AuthUpdate(object):
 
     def __init__(self, app=None):
         self.app = app
-        self.security = {}
+
+        # A secret used to generate the nonces for digest authentication.
+        self.key = tangelo.util.generate_key({})
+
+        # The security index.  The first table maps directories to the
+        # effective auth spec governing them (i.e., the one from the nearest
+        # .htaccess file at or above the directory), and the second maps
+        # password files to their parsed contents (shared among all
+        # directories referring to them).  Both are invalidated by file
+        # modification times.
+        self.directories = {}
+        self.password_files = {}
+
+        self.revalidate = 0
 
     @staticmethod
     def parse_htaccess(filename):
         result = {"msg": None,
                   "auth_type": None,
                   "user_file": None,
-                  "realm": None,
-                  "userpass": None}
+                  "realm": None}
 
         # Try to open and parse the file.
         try:
@@ -279,80 +571,103 @@ class AuthUpdate(object):
             result["msg"] = "Could not open file '%s'" % (filename)
             return result
 
-        # Open the user file and parse out the username/passwords of those
-        # users in the correct realm.
-        recs = None
-        if result["user_file"] is not None:
-            try:
-                with open(result["user_file"]) as f:
-                    recs = filter(lambda x: x[1] == result["realm"],
-                                  map(lambda x: x.strip().split(":"),
-                                      f.readlines()))
-            except IOError:
-                result["msg"] = ("Could not open user " +
-                                 "password file '%s'") % (result["user_file"])
-                return result
-            except IndexError:
-                result["msg"] = ("Malformed content in user password file " +
-                                 "'%s' (some line has too " +
-                                 "few fields)") % (result["user_file"])
-                return result
+        return result
 
+    @staticmethod
+    def parse_password_file(filename):
+        # Parse the user file into a table mapping realms to tables of
+        # username/password hash pairs.
         try:
-            result["userpass"] = {x[0]: x[2] for x in recs}
-        except IndexError:
-            result["msg"] = ("Malformed content in user password file " +
-                             "'%s' (some line has too " +
-                             "few fields)") % (result["user_file"])
-            return result
+            with open(filename) as f:
+                recs = map(lambda x: x.strip().split(":"), f.readlines())
+        except IOError:
+            return None, "Could not open user password file '%s'" % (filename)
+
+        table = {}
+        for rec in recs:
+            if len(rec) < 3:
+                return None, ("Malformed content in user password file " +
+                              "'%s' (some line has too " +
+                              "few fields)") % (filename)
+
+            table.setdefault(rec[1], {})[rec[0]] = rec[2]
+
+        return table, None
+
+    def password_table(self, filename):
+        entry = self.password_files.get(filename)
+        if entry is None or entry[0].changed(self.revalidate):
+            stamps = tangelo.util.FileStamps({filename: tangelo.util.getmtime(filename)})
+            table, msg = AuthUpdate.parse_password_file(filename)
+            entry = self.password_files[filename] = (stamps, table, msg)
+
+        return entry[1], entry[2]
+
+    def get_ha1(self, user_file, realm, username):
+        if user_file is None:
+            return None
+
+        table, msg = self.password_table(user_file)
+        if table is None:
+            return None
+
+        return table.get(realm, {}).get(username)
+
+    def directory_spec(self, dpath, root):
+        """
+        Compute the effective auth spec for directory `dpath` by searching for
+        the nearest .htaccess file, moving up the directory tree no further
+        than `root`.  Returns a pair of the spec (None if no .htaccess file
+        applies) and an error message (None if nothing went wrong).
+        """
+        entry = self.directories.get(dpath)
+        if entry is not None and not entry[0].changed(self.revalidate):
+            return entry[1], entry[2]
+
+        # The result depends on the mtime of every directory searched (which
+        # reflects the presence or absence of a .htaccess file), on the
+        # .htaccess file finally found (which reflects its content), and on the
+        # password file it names (whose errors it reports).
+        stamps = {}
+        spec = None
+        msg = None
+        search = dpath
+        while True:
+            stamps[search] = tangelo.util.getmtime(search)
+
+            htfile = search + os.path.sep + ".htaccess"
+            if os.path.exists(htfile):
+                stamps[htfile] = tangelo.util.getmtime(htfile)
+                spec = AuthUpdate.parse_htaccess(htfile)
+                msg = spec["msg"]
+
+                if msg is None and spec["user_file"] is not None:
+                    stamps[spec["user_file"]] = tangelo.util.getmtime(spec["user_file"])
+
+                    # Validate the password file now, so errors in it are
+                    # reported; its contents are looked up on demand later.
+                    msg = self.password_table(spec["user_file"])[1]
 
-        return result
+                if msg is not None:
+                    spec = None
+                break
 
-    def htaccess(self, htfile, reqpath):
-        changed = False
-        if htfile is None:
-            if reqpath in self.security:
-                del self.security[reqpath]
-
-                cfg = self.app.config[reqpath]
-                for a in AuthUpdate.allowed_auth_types:
-                    key = "tools.auth_%s.on" % (a)
-                    if key in cfg:
-                        cfg[key] = False
-                    self.app.merge({reqpath: cfg})
-                    changed = True
-        else:
-            # Get the mtime of the htfile.
-            ht_mtime = os.stat(htfile).st_mtime
-
-            if (reqpath not in self.security or
-                    ht_mtime > self.security[reqpath]):
-                # We have either a new .htaccess file, or one that has
-                # been modified list the last request to this path.
-                htspec = AuthUpdate.parse_htaccess(htfile)
-                if htspec["msg"] is not None:
-                    tangelo.log_error("TANGELO", "[AuthUpdate] Could not register %s: %s" % (reqpath, htspec["msg"]))
-                    return changed, htspec["msg"]
-
-                # Create an auth config tool using the values in the htspec.
-                toolname = "tools.auth_%s." % (htspec["auth_type"])
-                passdict = (
-                    lambda realm, username: htspec["userpass"].get(username))
-                # TODO(choudhury): replace "deadbeef" with a nonce created
-                # randomly in the __init__() method.
-                auth_conf = {toolname + "on": True,
-                             toolname + "realm": htspec["realm"],
-                             toolname + "get_ha1": passdict,
-                             toolname + "key": "deadbeef"}
-
-                self.app.merge({reqpath: auth_conf})
-
-                # Store the mtime in the security table.
-                self.security[reqpath] = ht_mtime
-
-                changed = True
-
-        return changed, None
+            parent = os.path.dirname(search)
+            if search == root or parent == search or not search.startswith(root):
+                break
+            search = parent
+
+        self.directories[dpath] = (tangelo.util.FileStamps(stamps), spec, msg)
+        return spec, msg
+
+    def authenticate(self, spec):
+        # Perform the authentication check directly, within the current
+        # request.  On failure, this raises a 401 error carrying the digest
+        # challenge; on success, it records the username in the request.
+        user_file = spec["user_file"]
+        cherrypy.lib.auth_digest.digest_auth(spec["realm"],
+                                             lambda realm, username: self.get_ha1(user_file, realm, username),
+                                             self.key)
 
     def update(self, reqpathcomp, pathcomp):
         # The lengths of the lists should be equal.
@@ -364,54 +679,142 @@ class AuthUpdate(object):
                                         os.path.sep.join(pathcomp[:(i + 1)])),
                              range(len(reqpathcomp))))
 
-        # Check each path that represents a directory for a .htaccess file,
-        # then decide what to do based on the current auth state for that path.
+        # Find the nearest path that represents a directory, look up the auth
+        # spec governing it, and if there is one, authenticate the request
+        # against it.
         for rpath, dpath in paths:
-            if os.path.isdir(dpath):
-                htfile = dpath + os.path.sep + ".htaccess"
-                if not os.path.exists(htfile):
-                    htfile = None
-
-                changed, msg = self.htaccess(htfile, rpath)
+            if UrlAnalyzer.instance.isdir(dpath):
+                spec, msg = self.directory_spec(dpath, pathcomp[0])
                 if msg is not None:
+                    tangelo.log_error("TANGELO", "[AuthUpdate] Could not register %s: %s" % (rpath, msg))
                     raise cherrypy.HTTPError(401,
                                              "There was an error in the " +
                                              "HTTP authentication " +
                                              "process: %s" % (msg))
 
-                # TODO(choudhury): I really don't understand why this hack is
-                # necessary.  Basically, when the auth_* tool is installed on
-                # the path in the htaccess() method, it doesn't seem to take
-                # hold until the next time the page is loaded.  So this hack
-                # forces a page reload, but it would be better to simply make
-                # the new config "take hold" instead.
-                if changed:
-                    raise cherrypy.HTTPRedirect(cherrypy.request.path_info)
-
-                # Don't bother updating the security table for higher paths -
-                # we'll process those later, when they are requested.
+                if spec is not None:
+                    self.authenticate(spec)
+
                 break
 
 
+class CachedResponse(object):
+    def __init__(self, body, content_type, ttl):
+        self.body = body
+        self.content_type = content_type
+        self.etag = '"%s"' % (hashlib.md5(body).hexdigest())
+        self.expires = None if ttl is None else time.time() + ttl
+
+
+class ResponseCache(object):
+    """
+    Memoize the serialized responses of services whose configuration file
+    contains a ``cache`` section, e.g.:
+
+    .. code-block:: yaml
+
+        cache:
+          ttl: 60
+          max-entries: 100
+          vary-on: [author, title]
+
+    Responses are keyed on the positional arguments, the query arguments named
+    in ``vary-on`` (all of them by default), and the negotiated serializer.  A
+    module's responses are forgotten whenever the module or its configuration
+    is reloaded.
+    """
+    default_max_entries = 128
+
+    def __init__(self):
+        self.tables = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def spec(config):
+        spec = config.get("cache")
+        if spec is True:
+            spec = {}
+        return spec if isinstance(spec, dict) else None
+
+    def table(self, module, service, config):
+        spec = ResponseCache.spec(config)
+        if spec is None:
+            self.tables.pop(module, None)
+            return None
+
+        # The table is tied to the identity of the module and config objects,
+        # so that reloading either one (e.g. by the watch plugin) starts over
+        # with an empty table.
+        with self.lock:
+            table = self.tables.get(module)
+            if table is None or table[0] is not service or table[1] is not config:
+                table = (service, config, tangelo.util.LRUCache(spec.get("max-entries", ResponseCache.default_max_entries)))
+                self.tables[module] = table
+
+        return table[2]
+
+    @staticmethod
+    def key(config, serializer, pargs, kwargs):
+        vary_on = ResponseCache.spec(config).get("vary-on")
+        args = sorted((k, v) for k, v in kwargs.iteritems() if vary_on is None or k in vary_on)
+        return repr((pargs, args, serializer.name))
+
+    def get(self, module, service, config, key):
+        table = self.table(module, service, config)
+        if table is None:
+            return None
+
+        entry = table.get(key)
+        if entry is not None and entry.expires is not None and entry.expires <= time.time():
+            table.pop(key)
+            entry = None
+
+        return entry
+
+    def set(self, module, service, config, key, body, content_type):
+        table = self.table(module, service, config)
+        if table is None:
+            return None
+
+        entry = CachedResponse(body, content_type, ResponseCache.spec(config).get("ttl"))
+        table.set(key, entry)
+        return entry
+
+
 class Tangelo(object):
     def __init__(self, module_cache=None, plugins=None):
         self.modules = tangelo.util.ModuleCache() if module_cache is None else module_cache
+        self.responses = ResponseCache()
+        self.pools = tangelo.pool.ServicePools()
         self.auth_update = None
         self.plugins = plugins
 
     def invoke_service(self, module, *pargs, **kwargs):
         tangelo.content_type("text/plain")
 
+        # In thread-safe mode, services run without touching any process-wide
+        # state: they find their own directory via tangelo.module_path() rather
+        # than the CWD, and tangelo.paths() records paths per module rather
+        # than modifying sys.path.
+        thread_safe = cherrypy.config.get("thread-safe")
+
         # Save the system path (be sure to *make a copy* using the list()
         # function).  This will be restored to undo any modification of the path
         # done by the service.
-        origpath = list(sys.path)
+        if not thread_safe:
+            origpath = list(sys.path)
 
         # By default, the result should be an object with error message in if
         # something goes wrong; if nothing goes wrong this will be replaced
         # with some other object.
         result = {}
 
+        # A memoized response for this request, if the service has a cache
+        # configured.
+        service = None
+        cached = None
+        cache_key = None
+
         # Store the modpath in the thread-local storage (tangelo.paths() makes
         # use of this per-thread data, so this is the way to get the data
         # across the "module boundary" properly).
@@ -423,8 +826,9 @@ class Tangelo(object):
         # saving the old one.  This is so that the service function executes as
         # though it were a Python program invoked normally, and Tangelo can
         # continue running later in whatever its original CWD was.
-        save_cwd = os.getcwd()
-        os.chdir(modpath)
+        if not thread_safe:
+            save_cwd = os.getcwd()
+            os.chdir(modpath)
 
         try:
             service = self.modules.get(module)
@@ -437,6 +841,18 @@ class Tangelo(object):
             tangelo.util.log_traceback("SERVICE", error_code, "Could not import service module %s" % (tangelo.request_path()))
             result = tangelo.util.error_report(error_code)
         else:
+            # If the service caches its responses, look for a previously
+            # computed one, skipping the service invocation entirely on a hit.
+            config = cherrypy.config["module-config"].get(module, {})
+            if cherrypy.request.method in ["GET", "HEAD"] and ResponseCache.spec(config) is not None:
+                serializer = tangelo.util.negotiate_serializer(config.get("serializer"))
+                cache_key = ResponseCache.key(config, serializer, pargs, kwargs)
+                cached = self.responses.get(module, service, config, cache_key)
+
+            # A service may ask to be run in a pool of worker processes rather
+            # than in this thread.
+            pool = self.pools.get(module, service, config)
+
             # Try to run the service - either it's in a function called
             # "run()", or else it's in a REST API consisting of at least one of
             # "get()", "put()", "post()", or "delete()".
@@ -446,22 +862,21 @@ class Tangelo(object):
             # also raise a cherrypy exception, log itself in a streaming table,
             # etc.).
             try:
-                if "run" in dir(service):
-                    # Call the module's run() method, passing it the positional
-                    # and keyword args that came into this method.
-                    result = service.run(*pargs, **kwargs)
+                if cached is not None:
+                    result = cached.body
+                elif pool is not None:
+                    # The service runs in a pool of worker processes.
+                    result = pool.call(pargs, kwargs)
                 else:
-                    # Reaching here means it's a REST API.  Check for the
-                    # requested method, ensure that it was marked as being part
-                    # of the API, and call it; or give a 405 error.
-                    method = cherrypy.request.method
-                    restfunc = service.__dict__.get(method.lower())
-                    if (restfunc is not None and hasattr(restfunc, "restful") and restfunc.restful):
-                        result = restfunc(*pargs, **kwargs)
-                    else:
-                        tangelo.http_status(405, "Method Not Allowed")
-                        tangelo.content_type("application/json")
-                        result = {"error": "Method '%s' is not allowed in this service" % (method)}
+                    result = tangelo.util.call_service(service, pargs, kwargs, defer=cherrypy.request.method != "HEAD")
+            except tangelo.pool.Timeout:
+                tangelo.http_status(504, "Service Timeout")
+                tangelo.content_type("application/json")
+
+                error_code = tangelo.util.generate_error_code()
+
+                tangelo.util.log_traceback("SERVICE", error_code, "Service %s timed out" % (tangelo.request_path()))
+                result = tangelo.util.error_report(error_code)
             except:
                 tangelo.http_status(500, "Service Error")
                 tangelo.content_type("application/json")
@@ -471,41 +886,178 @@ class Tangelo(object):
                 tangelo.util.log_traceback("SERVICE", error_code, "Could not execute service %s" % (tangelo.request_path()))
                 result = tangelo.util.error_report(error_code)
 
-        # Restore the path to what it was originally.
-        sys.path = origpath
+        if not thread_safe:
+            # Restore the path to what it was originally.
+            sys.path = origpath
+
+            # Restore the CWD to what it was before the service invocation.
+            os.chdir(save_cwd)
+
+        # A coroutine service runs on the event loop, and this thread goes back
+        # to serving other requests in the meantime; the response is sent once
+        # the coroutine completes.
+        if isinstance(result, tangelo.eventloop.DeferredCall):
+            cherrypy.response.stream = True
+            return tangelo.eventloop.EventLoop.instance.defer(result, functools.partial(self.finish_deferred, module, service, cache_key))
+
+        return self.respond(module, result, service, cache_key, cached)
+
+    def finish_deferred(self, module, service, cache_key, ok, value):
+        """
+        Convert the outcome of a deferred coroutine service call to a response
+        body, as invoke_service() does for other services.
+        """
+        if ok:
+            result = value
+        else:
+            tangelo.http_status(500, "Service Error")
+            tangelo.content_type("application/json")
+
+            error_code = tangelo.util.generate_error_code()
+            try:
+                raise value
+            except:
+                tangelo.util.log_traceback("SERVICE", error_code, "Could not execute service %s" % (tangelo.request_path()))
+            result = tangelo.util.error_report(error_code)
 
-        # Restore the CWD to what it was before the service invocation.
-        os.chdir(save_cwd)
+        try:
+            return self.respond(module, result, service, cache_key)
+        except (cherrypy.HTTPRedirect, cherrypy.HTTPError) as e:
+            e.set_response()
+            return cherrypy.response.body
+        except:
+            # In particular, an internal redirect cannot be followed once the
+            # request has left CherryPy.
+            tangelo.http_status(500, "Service Error")
+            tangelo.content_type("application/json")
+
+            error_code = tangelo.util.generate_error_code()
+            tangelo.util.log_traceback("SERVICE", error_code, "Could not respond to service %s" % (tangelo.request_path()))
+            return json.dumps(tangelo.util.error_report(error_code))
 
+    def respond(self, module, result, service=None, cache_key=None, cached=None):
         # If the result is a redirect request, then convert it to the
         # appropriate CherryPy logic and continue.
         #
         # Otherwise, if it's a file service request, then serve the file using
         # CherryPy facilities.
         #
+        # If it's a generator or other iterator (or was explicitly marked with
+        # tangelo.chunked()), stream it to the client item by item as a JSON
+        # array or as newline-delimited JSON.
+        #
         # Finally, if the result is not a string, attempt to convert it to one
-        # via JSON serialization.  This allows services to return a Python
-        # object if they wish, or to perform custom serialization (such as for
-        # MongoDB results, etc.).
+        # via the serializer named in the service's config file, or else the
+        # one negotiated through the request's Accept header (JSON by
+        # default).  This allows services to return a Python object if they
+        # wish, or to perform custom serialization (such as for MongoDB
+        # results, etc.).
+        if isinstance(result, collections.Iterator):
+            accept = [e.value for e in cherrypy.request.headers.elements("Accept") if e.qvalue > 0]
+            result = tangelo.chunked(result, "ndjson" if "application/x-ndjson" in accept else "json")
+
         if isinstance(result, tangelo._Redirect):
             raise cherrypy.HTTPRedirect(result.path, result.status)
         elif isinstance(result, tangelo._InternalRedirect):
             raise cherrypy.InternalRedirect(result.path)
         elif isinstance(result, tangelo._File):
             result = cherrypy.lib.static.serve_file(result.path, result.content_type)
+        elif isinstance(result, tangelo._Chunked):
+            tangelo.content_type(tangelo._Chunked.formats[result.format])
+            cherrypy.response.stream = True
+            result = Tangelo.stream_chunks(result)
         elif not isinstance(result, types.StringTypes):
-            try:
-                result = json.dumps(result)
-            except TypeError as e:
-                tangelo.http_status(400, "JSON Error")
-                tangelo.content_type("application/json")
-                result = {"error": "JSON type error executing service",
-                          "message": e.message}
+            config = cherrypy.config["module-config"].get(module, {})
+            serializer = tangelo.util.negotiate_serializer(config.get("serializer"))
+
+            # Error reports are always sent as JSON, and so is a result the
+            # negotiated serializer cannot handle; either way the response
+            # keeps its status.
+            fallback = tangelo.util.serializers["json"]
+            if cherrypy.lib.httputil.valid_status(cherrypy.response.status)[0] >= 400:
+                candidates = [fallback]
             else:
+                candidates = [serializer] if serializer is fallback else [serializer, fallback]
+
+            error = None
+            for candidate in candidates:
+                try:
+                    body = candidate.dumps(result)
+                except TypeError as e:
+                    error = error or e
+                else:
+                    tangelo.content_type(candidate.content_type)
+                    result = body
+                    break
+            else:
+                tangelo.http_status(400, "JSON Error" if serializer.name == "json" else "Serialization Error")
                 tangelo.content_type("application/json")
+                result = json.dumps({"error": "%s type error executing service" % ("JSON" if serializer.name == "json" else "Serialization"),
+                                     "message": error.message})
+
+        # Memoize a successful response if the service asked for it, and mark
+        # the response with an ETag so that clients can revalidate it
+        # cheaply.
+        if cache_key is not None:
+            config = cherrypy.config["module-config"].get(module, {})
+            if cached is None and isinstance(result, str) and cherrypy.lib.httputil.valid_status(cherrypy.response.status)[0] == 200:
+                cached = self.responses.set(module, service, config, cache_key, result, tangelo.content_type())
+
+            if cached is not None:
+                tangelo.content_type(cached.content_type)
+                tangelo.header("ETag", cached.etag)
+                cherrypy.lib.cptools.validate_etags()
 
         return result
 
+    @staticmethod
+    def stream_chunks(chunked, chunk_size=16384):
+        dumps = tangelo.util.serializers["json"].dumps
+        items = iter(chunked.iterable)
+
+        # Encode the items one at a time, sending the first one as soon as it
+        # is ready and then batching the rest into chunks of roughly
+        # chunk_size bytes.
+        buf = []
+        size = 0
+        first = True
+        try:
+            for item in items:
+                if chunked.format == "json":
+                    text = ("[" if first else ",") + dumps(item)
+                else:
+                    text = dumps(item) + "\n"
+
+                buf.append(text)
+                size += len(text)
+
+                if first or size >= chunk_size:
+                    yield "".join(buf)
+                    buf = []
+                    size = 0
+
+                first = False
+        except GeneratorExit:
+            raise
+        except:
+            # The status line and headers are already on their way to the
+            # client, so the best that can be done is to log the error and cut
+            # the response short (leaving a JSON array unterminated).
+            error_code = tangelo.util.generate_error_code()
+            tangelo.util.log_traceback("SERVICE", error_code, "Could not stream result of service %s" % (tangelo.request_path()))
+
+            yield "".join(buf)
+            return
+        finally:
+            close = getattr(items, "close", None)
+            if close is not None:
+                close()
+
+        if chunked.format == "json":
+            buf.append("[]" if first else "]")
+
+        yield "".join(buf)
+
     @staticmethod
     def dirlisting(dirpath, reqpath):
         if reqpath[-1] == "/":
@@ -723,7 +1275,7 @@ class Plugins(object):
 
         # Install the config and an empty dict as the plugin-level
         # config and store.
-        cherrypy.config["plugin-config"][path] = config
+        cherrypy.config["plugin-config"][path] = tangelo.util.freeze(config)
         cherrypy.config["plugin-store"][path] = {}
 
         # Check for a "python" directory, and place all modules found
@@ -1,6 +1,11 @@
 import cherrypy
+import collections
+import copy
+import datetime
 import errno
+import functools
 import imp
+import json
 import os
 import os.path
 import platform
@@ -8,12 +13,27 @@ import md5
 import random
 import socket
 import string
+import sys
 import threading
+import time
 import traceback
 import Queue
+import StringIO
 import yaml
 
 import tangelo
+import tangelo.eventloop
+
+# Optional packages that extend the set of values services may return.
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
 
 
 def windows():
@@ -87,6 +107,13 @@ def expandpath(spec):
     return (os.path.expanduser if spec[0] == "~" else os.path.abspath)(spec)
 
 
+def getmtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
 def live_pid(pid):
     try:
         os.kill(pid, 0)
@@ -117,6 +144,277 @@ def generate_key(taken, randbytes=128):
     return key
 
 
+def plain_value(obj):
+    """
+    Convert a value that serializers do not handle natively (NumPy arrays and
+    scalars, and date/time objects) to an equivalent built-in value.  Raises
+    TypeError for anything else.
+    """
+    if numpy is not None:
+        if isinstance(obj, numpy.ndarray):
+            return obj.tolist()
+        elif isinstance(obj, numpy.generic):
+            return obj.item()
+
+    if isinstance(obj, (datetime.datetime, datetime.date, datetime.time)):
+        return obj.isoformat()
+
+    raise TypeError("%s is not serializable" % (repr(obj)))
+
+
+def type_converter(spec):
+    """
+    Build the conversion function for a single argument of a service decorated
+    with ``tangelo.types()``.
+
+    :param spec: a conversion function; a NumPy dtype, converting to a scalar
+                 of that type; or a single-element list holding either of these,
+                 converting a list of values (or a single value, taken as a
+                 list of one) elementwise, into a NumPy array in the case of a
+                 dtype.
+    :returns: the conversion function.
+    """
+    if isinstance(spec, list):
+        if len(spec) != 1:
+            raise TypeError("a list type conversion must hold exactly one element")
+
+        element = spec[0]
+        if numpy is not None and isinstance(element, numpy.dtype):
+            def convert(value):
+                return numpy.array(value if isinstance(value, list) else [value], dtype=element)
+        else:
+            element = type_converter(element)
+
+            def convert(value):
+                return map(element, value if isinstance(value, list) else [value])
+
+        return convert
+    elif numpy is not None and isinstance(spec, numpy.dtype):
+        return spec.type
+    else:
+        return spec
+
+
+class Serializer(object):
+    def __init__(self, name, content_type, dumps):
+        self.name = name
+        self.content_type = content_type
+        self.dumps = dumps
+
+
+# The registry of serializers for converting service results to response
+# bodies, in order of registration.  The first one ("json") is the default.
+serializers = collections.OrderedDict()
+
+
+def register_serializer(name, content_type, dumps):
+    """
+    Register a function for converting service results to strings.
+
+    :param name: the name by which service config files can select the
+                 serializer.
+    :param content_type: the MIME type of the serialized data; clients can
+                         also select the serializer by listing it in their
+                         Accept header.
+    :param dumps: a function taking a service result and returning a string.
+                  It should raise TypeError for values it cannot handle.
+    """
+    serializers[name] = Serializer(name, content_type, dumps)
+
+
+def negotiate_serializer(name=None):
+    """
+    Choose a serializer for the current request: the named one if `name` is
+    given, otherwise the first one acceptable to the client according to its
+    Accept header, falling back to JSON.
+    """
+    if name is not None:
+        if name in serializers:
+            return serializers[name]
+
+        tangelo.log_warning("TANGELO", "Unknown serializer '%s' requested, using JSON instead" % (name))
+        return serializers["json"]
+
+    by_type = {s.content_type: s for s in serializers.values()}
+    for element in cherrypy.request.headers.elements("Accept"):
+        if element.qvalue == 0:
+            continue
+        elif element.value in by_type:
+            return by_type[element.value]
+        elif element.value in ["*/*", "application/*"]:
+            break
+
+    return serializers["json"]
+
+
+def numpy_dumps(obj):
+    array = numpy.asarray(obj)
+    if array.dtype.hasobject:
+        raise TypeError("only arrays of plain numeric or string data can be serialized to the NumPy format")
+
+    buf = StringIO.StringIO()
+    numpy.save(buf, array, allow_pickle=False)
+    return buf.getvalue()
+
+
+register_serializer("json", "application/json", functools.partial(json.dumps, default=plain_value))
+
+if msgpack is not None:
+    register_serializer("msgpack", "application/x-msgpack", functools.partial(msgpack.packb, default=plain_value, use_bin_type=True))
+
+if numpy is not None:
+    register_serializer("npy", "application/x-npy", numpy_dumps)
+
+
+class FileStamps(object):
+    """
+    Remember the modification times of a set of filesystem paths, so that it
+    can later be determined cheaply whether any of them has changed.
+
+    Directories are the interesting case: creating, deleting, or renaming an
+    entry inside a directory updates the directory's own mtime, so a single
+    stat of the directory stands in for any number of existence checks on its
+    contents.  A path that did not exist is recorded with a time of None, so
+    its later appearance counts as a change as well.
+
+    Modification times are only as fine as the filesystem records them (as
+    coarse as two seconds), so a path modified within that granularity of the
+    stamps being taken could be modified again without its mtime changing.
+    Such stamps are never trusted: they always count as changed, so that the
+    caller looks again (and takes new stamps) on its next use.
+    """
+    granularity = 2
+
+    def __init__(self, stamps):
+        self.stamps = stamps
+        self.checked = time.time()
+        self.racy = any(mtime is not None and mtime > self.checked - FileStamps.granularity for mtime in stamps.itervalues())
+
+    def changed(self, interval=0):
+        if self.racy:
+            return True
+
+        # Within `interval` seconds of the last successful check, trust the
+        # recorded stamps without touching the filesystem at all.
+        now = time.time()
+        if interval and now - self.checked < interval:
+            return False
+
+        if any(getmtime(path) != mtime for path, mtime in self.stamps.iteritems()):
+            return True
+
+        self.checked = now
+        return False
+
+
+def read_only(*pargs, **kwargs):
+    raise TypeError("configuration is read-only")
+
+
+class FrozenDict(dict):
+    """
+    A dict that cannot be modified, used for configuration shared by all
+    invocations of a service or plugin.  Deep-copying one yields an ordinary,
+    modifiable dict.
+    """
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = read_only
+
+    def __reduce__(self):
+        return (FrozenDict, (dict(self),))
+
+    def __deepcopy__(self, memo):
+        return thaw(self)
+
+
+class FrozenList(list):
+    """
+    A list that cannot be modified; the counterpart of FrozenDict.
+    """
+    __setitem__ = __delitem__ = __setslice__ = __delslice__ = __iadd__ = __imul__ = read_only
+    append = extend = insert = pop = remove = reverse = sort = read_only
+
+    def __reduce__(self):
+        return (FrozenList, (list(self),))
+
+    def __deepcopy__(self, memo):
+        return thaw(self)
+
+
+def freeze(value):
+    """
+    Convert a structure of dicts, lists, and sets (such as a parsed YAML file)
+    to a read-only equivalent.
+    """
+    if isinstance(value, dict):
+        return FrozenDict((k, freeze(v)) for k, v in value.iteritems())
+    elif isinstance(value, list):
+        return FrozenList(freeze(v) for v in value)
+    elif isinstance(value, set):
+        return frozenset(value)
+    else:
+        return value
+
+
+def thaw(value):
+    """
+    Make an ordinary, modifiable deep copy of a structure created by freeze().
+    """
+    if isinstance(value, dict):
+        return {k: thaw(v) for k, v in value.iteritems()}
+    elif isinstance(value, list):
+        return [thaw(v) for v in value]
+    elif isinstance(value, frozenset):
+        return set(value)
+    else:
+        return copy.deepcopy(value)
+
+
+class LRUCache(object):
+    """
+    A thread-safe mapping holding at most `maxsize` entries, evicting the least
+    recently used entry when full (and counting the evictions).
+    """
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.evictions = 0
+        self.data = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            try:
+                value = self.data.pop(key)
+            except KeyError:
+                return default
+
+            # Reinsert the entry to mark it as the most recently used.
+            self.data[key] = value
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.data.pop(key, None)
+            self.data[key] = value
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key, default=None):
+        with self.lock:
+            return self.data.pop(key, default)
+
+    def keys(self):
+        with self.lock:
+            return self.data.keys()
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+    def __len__(self):
+        return len(self.data)
+
+
 class NonBlockingReader(threading.Thread):
     def __init__(self, stream):
         threading.Thread.__init__(self)
@@ -167,7 +465,99 @@ class NonBlockingReader(threading.Thread):
             self.pushline(line)
 
 
-def module_cache_get(cache, module):
+def service_import_paths():
+    """
+    Compute the extra directories in which an import performed by the running
+    web service should be attempted: the service's own directory (if it lies
+    within the web root), followed by any paths the service registered with
+    ``tangelo.paths()`` in thread-safe mode.
+
+    :returns: the list of such directories not already in ``sys.path``.
+    """
+    if not hasattr(cherrypy.thread_data, "modulepath"):
+        return []
+
+    paths = []
+
+    modpath = os.path.abspath(cherrypy.thread_data.modulepath)
+    root = os.path.abspath(cherrypy.config.get("webroot"))
+    if modpath == root or modpath.startswith(root + os.path.sep):
+        paths.append(modpath)
+
+    paths += cherrypy.config.get("module-paths", {}).get(cherrypy.thread_data.modulename, [])
+
+    return [path for path in paths if path not in sys.path]
+
+
+def call_service(service, pargs, kwargs, defer=False):
+    """
+    Invoke a web service module - either its ``run()`` function, or else the
+    function of its REST API matching the request method.
+
+    :param service: the service module.
+    :param pargs: the positional arguments for the service.
+    :param kwargs: the keyword arguments for the service.
+    :param defer: True to return a coroutine service's call as a
+                  ``tangelo.eventloop.DeferredCall``, to be completed after the
+                  request's server thread has been released, rather than
+                  waiting for its result.
+    :returns: the service's result.
+    """
+    if "run" in dir(service):
+        # Call the module's run() method, passing it the positional and
+        # keyword args that came into this method.
+        func = service.run
+    else:
+        # Reaching here means it's a REST API.  Check for the requested
+        # method, ensure that it was marked as being part of the API, and call
+        # it; or give a 405 error.
+        method = cherrypy.request.method
+        func = service.__dict__.get(method.lower())
+        if not (func is not None and hasattr(func, "restful") and func.restful):
+            tangelo.http_status(405, "Method Not Allowed")
+            tangelo.content_type("application/json")
+            return {"error": "Method '%s' is not allowed in this service" % (method)}
+
+    # Coroutine functions run on the shared event loop, with this thread
+    # waiting for the result unless the call can be deferred.
+    if tangelo.eventloop.iscoroutinefunction(func):
+        if defer:
+            call = tangelo.eventloop.DeferredCall(func, pargs, kwargs)
+            if call.gateway is not None:
+                return call
+
+        return tangelo.eventloop.EventLoop.instance.call(func, *pargs, **kwargs)
+
+    return func(*pargs, **kwargs)
+
+
+def load_module(name, path, previous=None):
+    """
+    Load a Python source file as a new module object, which replaces any module
+    of the same name in ``sys.modules`` only once it has loaded successfully.
+    Code still running in a previous version of the module keeps running
+    against that version.
+
+    :param name: the module name.
+    :param path: the path of the source file.
+    :param previous: a previous version of the module, whose global variables
+                     the new version starts out with (as with ``reload()``).
+    :returns: the new module.
+    """
+    module = imp.new_module(name)
+    if previous is not None:
+        module.__dict__.update(previous.__dict__)
+    module.__file__ = path
+
+    with open(path, "U") as f:
+        code = compile(f.read(), path, "exec")
+    exec code in module.__dict__
+
+    sys.modules[name] = module
+    return module
+
+
+def module_cache_get(cache, module, force_reload=False):
     """
     Import a module with an optional yaml config file, but only if we haven't
     imported it already.
@@ -176,41 +566,57 @@ def module_cache_get(cache, module):
                   files have been loaded and whether config files should be
                   loaded.
     :param module: the path of the module to load.
+    :param force_reload: True to load the module and its config file again
+                         even if they have been loaded already.  The new
+                         version of the module is loaded alongside the old
+                         one, which continues to be returned to other threads
+                         until the new one replaces it.
     :returns: the loaded module.
     """
-    if getattr(cache, "config", False):
-        config_file = module[:-2] + "yaml"
-        if config_file not in cache.config_files and os.path.exists(config_file):
-            try:
-                config = yaml_safe_load(config_file, type=dict)
-            except TypeError as e:
-                tangelo.log_warning("TANGELO", "Bad configuration in file %s: %s" % (config_file, e))
-                raise
-            except IOError:
-                tangelo.log_warning("TANGELO", "Could not open config file %s" % (config_file))
-                raise
-            except ValueError as e:
-                tangelo.log_warning("TANGELO", "Error reading config file %s: %s" % (config_file, e))
-                raise
+    config_file = module[:-2] + "yaml"
+    use_config = getattr(cache, "config", False)
+
+    # Fast path: once a module and its config file have been loaded, simply
+    # return the module, without taking any lock.
+    service = cache.modules.get(module)
+    if service is not None and (not use_config or config_file in cache.config_files) and not force_reload:
+        return service
+
+    # Otherwise, load whatever is missing while holding a lock for this module
+    # alone, so that two threads don't load the same module at once, but
+    # requests for other modules are not held up.
+    with cache.locks.setdefault(module, threading.RLock()):
+        if use_config and (force_reload or config_file not in cache.config_files):
+            if os.path.exists(config_file):
+                try:
+                    config = yaml_safe_load(config_file, type=dict)
+                except TypeError as e:
+                    tangelo.log_warning("TANGELO", "Bad configuration in file %s: %s" % (config_file, e))
+                    raise
+                except IOError:
+                    tangelo.log_warning("TANGELO", "Could not open config file %s" % (config_file))
+                    raise
+                except ValueError as e:
+                    tangelo.log_warning("TANGELO", "Error reading config file %s: %s" % (config_file, e))
+                    raise
+            else:
+                config = {}
+
+            cherrypy.config["module-config"][module] = freeze(config)
+            cherrypy.config["module-store"].setdefault(module, {})
             cache.config_files[config_file] = True
-        else:
-            config = {}
-        cherrypy.config["module-config"][module] = config
-        cherrypy.config["module-store"].setdefault(module, {})
-    # If two threads are importing the same module nearly concurrently, we
-    # could load it twice unless we use the import lock.
-    imp.acquire_lock()
-    try:
-        if module not in cache.modules:
+
+        service = cache.modules.get(module)
+        if service is None:
             name = module[:-3]
 
             # load the module.
             service = imp.load_source(name, module)
             cache.modules[module] = service
-        else:
-            service = cache.modules[module]
-    finally:
-        imp.release_lock()
+        elif force_reload:
+            service = load_module(module[:-3], module, service)
+            cache.modules[module] = service
+
     return service
 
 
@@ -219,6 +625,7 @@ class ModuleCache(object):
         self.config = config
         self.modules = {}
         self.config_files = {}
+        self.locks = {}
 
     def get(self, module):
         return module_cache_get(self, module)
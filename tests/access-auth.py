@@ -0,0 +1,82 @@
+import nose
+import os
+import requests
+from requests.auth import HTTPDigestAuth
+
+import fixture
+
+
+@nose.with_setup(fixture.start_tangelo, fixture.stop_tangelo)
+def test_protected_subdirectory():
+    # The .htaccess file in the parent directory governs its subdirectories,
+    # even before the parent directory itself has been requested.
+    response = requests.get(fixture.url("secure", "inner", "log.txt"))
+    assert response.status_code == 401
+
+    response = requests.get(fixture.url("secure", "inner", "log.txt"), auth=HTTPDigestAuth("picard", "wrong"))
+    assert response.status_code == 401
+
+    # The credentials are checked within the same request, without a
+    # redirection round trip.
+    response = requests.get(fixture.url("secure", "inner", "log.txt"), auth=HTTPDigestAuth("picard", "engage"), allow_redirects=False)
+    assert response.status_code == 200
+    assert response.text == "Captain's log\n"
+
+
+@nose.with_setup(fixture.start_tangelo, fixture.stop_tangelo)
+def test_new_htaccess():
+    htaccess = "tests/web/secure/inner/.htaccess"
+
+    response = requests.get(fixture.url("secure", "inner", "log.txt"), auth=HTTPDigestAuth("picard", "engage"), allow_redirects=False)
+    assert response.status_code == 200
+
+    # A new .htaccess file in the subdirectory, naming a different realm,
+    # takes effect on the very next request.
+    try:
+        with open(htaccess, "w") as f:
+            f.write("AuthType digest\nAuthRealm borg\nAuthUserFile tests/htpasswd\n")
+
+        response = requests.get(fixture.url("secure", "inner", "log.txt"), auth=HTTPDigestAuth("picard", "engage"), allow_redirects=False)
+        assert response.status_code == 401
+    finally:
+        os.remove(htaccess)
+
+    response = requests.get(fixture.url("secure", "inner", "log.txt"), auth=HTTPDigestAuth("picard", "engage"), allow_redirects=False)
+    assert response.status_code == 200
+
+
+@nose.with_setup(fixture.start_tangelo, fixture.stop_tangelo)
+def test_fixed_password_file():
+    htaccess = "tests/web/secure/inner/.htaccess"
+    htpasswd = "tests/web/secure/inner/htpasswd"
+
+    try:
+        with open(htaccess, "w") as f:
+            f.write("AuthType digest\nAuthRealm enterprise\nAuthUserFile %s\n" % (htpasswd))
+
+        # A malformed password file is reported as an error.
+        with open(htpasswd, "w") as f:
+            f.write("picard\n")
+
+        response = requests.get(fixture.url("secure", "inner", "log.txt"), auth=HTTPDigestAuth("picard", "engage"), allow_redirects=False)
+        assert response.status_code == 401
+        assert "Malformed content" in response.text
+
+        # Fixing the password file clears the error, even though the
+        # .htaccess file naming it is unchanged.
+        with open("tests/htpasswd") as src, open(htpasswd, "w") as f:
+            f.write(src.read())
+        mtime = os.path.getmtime(htpasswd) + 2
+        os.utime(htpasswd, (mtime, mtime))
+
+        response = requests.get(fixture.url("secure", "inner", "log.txt"), auth=HTTPDigestAuth("picard", "engage"), allow_redirects=False)
+        assert response.status_code == 200
+    finally:
+        os.remove(htaccess)
+        os.remove(htpasswd)
+
+
+@nose.with_setup(fixture.start_tangelo, fixture.stop_tangelo)
+def test_unprotected():
+    response = requests.get(fixture.url("echo"))
+    assert response.status_code == 200
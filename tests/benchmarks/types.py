@@ -0,0 +1,43 @@
+"""
+Measure the per-call overhead that the tangelo.types() decorator adds to a
+service function.
+
+Run with the Python interpreter in Tangelo's virtual environment, e.g.:
+
+    venv/bin/python tests/benchmarks/types.py
+"""
+import timeit
+
+import tangelo
+
+
+def plain(a, b, c=None):
+    return a
+
+
+def convert(a, b, c=None):
+    return int(a), float(b), c
+
+
+typed = tangelo.types(a=int, b=float)(plain)
+typed_list = tangelo.types(a=[int])(plain)
+
+cases = [("untyped, converting by hand", lambda: convert("1", "2.5")),
+         ("typed, positional", lambda: typed("1", "2.5")),
+         ("typed, keyword", lambda: typed(a="1", b="2.5")),
+         ("typed, all arguments", lambda: typed("1", "2.5", "x")),
+         ("typed list, 3 elements", lambda: typed_list(["1", "2", "3"], "x"))]
+
+
+def main(number=100000):
+    baseline = min(timeit.repeat(lambda: plain("1", "2.5"), number=number, repeat=3)) / number
+
+    print "%-30s %12s %12s" % ("case", "usec/call", "overhead")
+    print "%-30s %12.3f %12s" % ("undecorated", baseline * 1e6, "-")
+    for name, case in cases:
+        t = min(timeit.repeat(case, number=number, repeat=3)) / number
+        print "%-30s %12.3f %12.3f" % (name, t * 1e6, (t - baseline) * 1e6)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+import json
+import nose
+import requests
+
+import fixture
+
+
+@nose.with_setup(fixture.start_tangelo, fixture.stop_tangelo)
+def test_generator():
+    response = requests.get(fixture.url("chunked"))
+    assert response.status_code == 200
+    assert response.headers["Transfer-Encoding"] == "chunked"
+    assert "application/json" in response.headers["Content-Type"]
+    assert response.json() == [{"index": 0, "square": 0},
+                               {"index": 1, "square": 1},
+                               {"index": 2, "square": 4}]
+
+
+@nose.with_setup(fixture.start_tangelo, fixture.stop_tangelo)
+def test_large_generator():
+    response = requests.get(fixture.url("chunked", count=10000))
+    assert response.status_code == 200
+    assert [d["index"] for d in response.json()] == range(10000)
+
+
+@nose.with_setup(fixture.start_tangelo, fixture.stop_tangelo)
+def test_empty_generator():
+    response = requests.get(fixture.url("chunked", count=0))
+    assert response.status_code == 200
+    assert response.json() == []
+
+
+@nose.with_setup(fixture.start_tangelo, fixture.stop_tangelo)
+def test_ndjson():
+    expected = [{"index": 0, "square": 0},
+                {"index": 1, "square": 1}]
+
+    response = requests.get(fixture.url("chunked", count=2), headers={"Accept": "application/x-ndjson"})
+    assert response.status_code == 200
+    assert response.headers["Content-Type"] == "application/x-ndjson"
+    assert map(json.loads, response.text.splitlines()) == expected
+
+    response = requests.get(fixture.url("chunked", count=2, format="ndjson"))
+    assert response.status_code == 200
+    assert response.headers["Content-Type"] == "application/x-ndjson"
+    assert map(json.loads, response.text.splitlines()) == expected
+
+
+@nose.with_setup(fixture.start_tangelo, fixture.stop_tangelo)
+def test_error_truncates():
+    response = requests.get(fixture.url("chunked", count=2, fail="yes"))
+    assert response.status_code == 200
+    assert response.text == '[{"index": 0, "square": 0},{"index": 1, "square": 1}'
@@ -0,0 +1,108 @@
+import nose
+import threading
+import time
+import requests
+
+import fixture
+
+
+def requires_trollius():
+    try:
+        import trollius  # noqa: F401
+    except ImportError:
+        raise nose.SkipTest("Trollius is not installed")
+
+
+@nose.with_setup(fixture.start_tangelo, fixture.stop_tangelo)
+def test_coroutine():
+    requires_trollius()
+
+    response = requests.get(fixture.url("coroutine", count=3, delay=0.5))
+    assert response.status_code == 200
+
+    result = response.json()
+    assert result["threads"] == ["EventLoop"] * 3
+    assert result["elapsed"] < 1.0
+    assert result["path"] == "/coroutine"
+
+
+@nose.with_setup(fixture.start_tangelo, fixture.stop_tangelo)
+def test_coroutine_context():
+    requires_trollius()
+
+    response = requests.get(fixture.url("coroutine", count=1, delay=0, status=202))
+    assert response.status_code == 202
+
+    response = requests.get(fixture.url("coroutine", count="many", delay=0))
+    assert response.status_code == 400
+
+
+@nose.with_setup(fixture.start_tangelo, fixture.stop_tangelo)
+def test_coroutine_error():
+    requires_trollius()
+
+    response = requests.post(fixture.url("coroutine"))
+    assert response.status_code == 500
+    assert "Error code" in response.json()["message"]
+
+
+@nose.with_setup(fixture.start_tangelo, fixture.stop_tangelo)
+def test_coroutine_releases_thread():
+    requires_trollius()
+
+    # More simultaneous requests than the server has threads; each coroutine
+    # gives its thread back while it sleeps, so they all overlap.
+    def fetch(tag, results):
+        results[tag] = requests.get(fixture.url("coroutine", tag, count=2, delay=1))
+
+    results = {}
+    threads = [threading.Thread(target=fetch, args=(str(i), results)) for i in xrange(25)]
+
+    start = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.time() - start
+
+    assert elapsed < 2.5
+    for tag, response in results.iteritems():
+        assert response.status_code == 200
+
+        # Tasks started by the service coroutine see its request.
+        assert response.json()["paths"] == ["/coroutine/%s" % (tag)] * 2
+
+
+@nose.with_setup(fixture.start_tangelo, fixture.stop_tangelo)
+def test_coroutine_cancelled():
+    requires_trollius()
+
+    response = requests.delete(fixture.url("coroutine"))
+    assert response.status_code == 500
+    assert "Error code" in response.json()["message"]
+
+    # The server is still responsive.
+    response = requests.get(fixture.url("coroutine", count=1, delay=0))
+    assert response.status_code == 200
+
+
+def test_call_cancelled():
+    requires_trollius()
+
+    import trollius as asyncio
+    import tangelo.eventloop
+
+    @asyncio.coroutine
+    def cancelled():
+        asyncio.Task.current_task().cancel()
+        yield asyncio.From(asyncio.sleep(0))
+
+    # A waiting thread is woken with the cancellation, rather than hanging.
+    try:
+        tangelo.eventloop.EventLoop.instance.call(cancelled)
+    except asyncio.CancelledError:
+        pass
+    else:
+        assert False, "expected CancelledError"
+    finally:
+        tangelo.eventloop.EventLoop.instance.stop()
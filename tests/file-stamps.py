@@ -0,0 +1,47 @@
+import os
+import tempfile
+import time
+
+import tangelo.util
+
+
+def stamp(path):
+    return tangelo.util.FileStamps({path: tangelo.util.getmtime(path)})
+
+
+def test_file_stamps():
+    fd, path = tempfile.mkstemp()
+    os.close(fd)
+    try:
+        old = time.time() - 60
+        os.utime(path, (old, old))
+
+        stamps = stamp(path)
+        assert not stamps.changed()
+
+        os.utime(path, (old + 1, old + 1))
+        assert stamps.changed()
+
+        os.remove(path)
+        assert stamps.changed()
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def test_recent_file_stamps():
+    fd, path = tempfile.mkstemp()
+    os.close(fd)
+    try:
+        # A file modified just before its stamp was taken could be modified
+        # again within the same mtime tick, so the stamp is always rechecked,
+        # even within the revalidation interval.
+        stamps = stamp(path)
+        assert stamps.changed()
+        assert stamps.changed(interval=60)
+
+        old = time.time() - 60
+        os.utime(path, (old, old))
+        assert not stamp(path).changed(interval=60)
+    finally:
+        os.remove(path)
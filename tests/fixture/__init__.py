@@ -72,7 +72,9 @@ def start_tangelo(*args, **kwargs):
                        "config/web",
                        "girder",
                        "impala/web",
+                       "mongo",
                        "mongo/web",
+                       "stream",
                        "stream/web",
                        "tangelo/web",
                        "vtkweb",
@@ -0,0 +1,107 @@
+import cherrypy
+import fixture
+import imp
+import nose
+import requests
+import time
+
+plugin = "tangelo/tangelo/pkgdata/plugin/mongo"
+mongo = imp.load_source("mongo_plugin", plugin + "/python/__init__.py")
+
+movies = ("localhost", "db", "movies")
+books = ("localhost", "db", "books")
+
+
+def test_hits():
+    cache = mongo.QueryCache(max_entries=10)
+
+    generation = cache.generation(movies)
+    assert cache.get(movies, "q") is None
+    cache.set(movies, "q", "result", generation)
+    assert cache.get(movies, "q") == "result"
+    assert cache.get(books, "q") is None
+
+    stats = cache.stats()
+    assert stats["entries"] == 1
+    assert stats["hits"] == 1
+    assert stats["misses"] == 2
+    assert abs(stats["hit-rate"] - 1.0 / 3) < 1e-9
+
+
+def test_eviction():
+    cache = mongo.QueryCache(max_entries=2)
+    generation = cache.generation(movies)
+
+    cache.set(movies, "a", 1, generation)
+    cache.set(movies, "b", 2, generation)
+    cache.get(movies, "a")
+    cache.set(movies, "c", 3, generation)
+
+    # "b" was the least recently used.
+    assert cache.get(movies, "b") is None
+    assert cache.get(movies, "a") == 1
+    assert cache.get(movies, "c") == 3
+    assert cache.stats()["evictions"] == 1
+
+
+def test_ttl():
+    cache = mongo.QueryCache(max_entries=10, ttl=0.2)
+    cache.set(movies, "q", "result", cache.generation(movies))
+    assert cache.get(movies, "q") == "result"
+
+    time.sleep(0.3)
+    assert cache.get(movies, "q") is None
+    assert len(cache) == 0
+
+
+def test_invalidate():
+    cache = mongo.QueryCache(max_entries=10)
+    for collection in [movies, books, ("otherhost", "db", "movies")]:
+        cache.set(collection, "q", collection, cache.generation(collection))
+
+    assert cache.invalidate(movies) == 1
+    assert cache.get(movies, "q") is None
+    assert cache.get(books, "q") == books
+
+    # A prefix invalidates every collection it covers.
+    assert cache.invalidate(("localhost",)) == 1
+    assert cache.get(books, "q") is None
+    assert cache.invalidate() == 1
+    assert len(cache) == 0
+    assert cache.stats()["invalidations"] == 3
+
+
+def test_invalidate_during_query():
+    cache = mongo.QueryCache(max_entries=10)
+
+    # A result computed across an invalidation is not cached.
+    generation = cache.generation(movies)
+    cache.invalidate(movies)
+    cache.set(movies, "q", "stale", generation)
+    assert cache.get(movies, "q") is None
+
+
+@nose.with_setup(fixture.start_tangelo, fixture.stop_tangelo)
+def test_cache_disabled():
+    response = requests.get(fixture.plugin_url("mongo", "cache"))
+    assert response.ok
+    assert response.json() == {"enabled": False}
+
+    response = requests.delete(fixture.plugin_url("mongo", "cache", server="localhost", db="db", coll="movies"))
+    assert response.status_code == 404
+
+
+def test_uri_server():
+    # A server given as a URI can be named when invalidating.
+    cache = mongo.QueryCache(max_entries=10)
+    server = "mongodb://db.example.com:27017/?replicaSet=rs0"
+    collection = (server, "db", "movies")
+    cache.set(collection, "q", "result", cache.generation(collection))
+
+    cherrypy.config.update({"plugin-store": {plugin: {"cache": cache}}})
+    cherrypy.thread_data.pluginpath = plugin
+    service = imp.load_source("mongo_cache_service", plugin + "/web/cache.py")
+
+    assert service.delete(server=server, coll="movies") == {"error": "A database requires a server, and a collection requires a database"}
+    assert service.delete(server=server, db="db") == {"invalidated": 1}
+    assert cache.get(collection, "q") is None
@@ -0,0 +1,118 @@
+import imp
+import types
+
+mongo = imp.load_source("mongo_plugin", "tangelo/tangelo/pkgdata/plugin/mongo/python/__init__.py")
+
+
+class PyMongoError(Exception):
+    pass
+
+
+class FakeClient(object):
+    """
+    Stands in for pymongo.MongoClient, recording the clients created and
+    answering pings according to `healthy`.
+    """
+    created = []
+
+    def __init__(self, server, **options):
+        self.server = server
+        self.options = options
+        self.healthy = True
+        self.closed = False
+        self.admin = self
+
+        FakeClient.created.append(self)
+
+    def command(self, name):
+        assert name == "ping"
+        if not self.healthy:
+            raise PyMongoError("no answer")
+        return {"ok": 1}
+
+    def close(self):
+        self.closed = True
+
+
+def setup():
+    # Let the plugin use the fake client in place of pymongo.
+    fake = types.ModuleType("pymongo")
+    fake.MongoClient = FakeClient
+    fake.errors = types.ModuleType("pymongo.errors")
+    fake.errors.PyMongoError = PyMongoError
+
+    mongo.pymongo = fake
+
+
+def test_reuse():
+    pool = mongo.ClientPool(options={"connect": False})
+    created = len(FakeClient.created)
+
+    client = pool.get("mongodb://localhost")
+    assert pool.get("mongodb://localhost") is client
+    assert client.options == {"connect": False}
+    assert len(FakeClient.created) == created + 1
+
+
+def test_lru_eviction():
+    pool = mongo.ClientPool(max_size=2)
+
+    a = pool.get("a")
+    b = pool.get("b")
+    pool.get("a")
+    c = pool.get("c")
+
+    # "b" was the least recently used.
+    assert "b" not in pool
+    assert b.closed
+    assert not a.closed and not c.closed
+    assert len(pool) == 2
+
+    assert pool.get("b") is not b
+
+
+def test_failed_health_check():
+    pool = mongo.ClientPool(health_check=0)
+
+    client = pool.get("a")
+    assert pool.get("a") is client
+
+    # A client that fails its ping is closed and replaced.
+    client.healthy = False
+    replacement = pool.get("a")
+    assert replacement is not client
+    assert client.closed
+    assert not replacement.closed
+    assert pool.get("a") is replacement
+
+
+def test_health_check_interval():
+    pool = mongo.ClientPool(health_check=60)
+
+    # A recently checked client is not pinged again.
+    client = pool.get("a")
+    client.healthy = False
+    assert pool.get("a") is client
+
+
+def test_reap():
+    pool = mongo.ClientPool(idle_timeout=60)
+
+    idle = pool.get("idle")
+    busy = pool.get("busy")
+    pool.clients["idle"].used -= 120
+
+    pool.reap()
+    assert "idle" not in pool
+    assert idle.closed
+    assert "busy" in pool
+    assert not busy.closed
+
+
+def test_clear():
+    pool = mongo.ClientPool()
+    clients = [pool.get(server) for server in ["a", "b"]]
+
+    pool.clear()
+    assert len(pool) == 0
+    assert all(client.closed for client in clients)
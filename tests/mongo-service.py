@@ -0,0 +1,254 @@
+import cherrypy
+import imp
+import json
+import nose
+
+import tangelo.server
+
+try:
+    import bson
+    import pymongo
+    import pymongo.errors
+except ImportError:
+    raise nose.SkipTest("PyMongo is not installed")
+
+plugin = "tangelo/tangelo/pkgdata/plugin/mongo"
+
+
+class FakeCursor(object):
+    def __init__(self, docs):
+        self.docs = docs
+        self.closed = False
+
+    def __iter__(self):
+        for doc in self.docs:
+            yield doc
+
+    def close(self):
+        self.closed = True
+
+    def explain(self):
+        return {"queryPlanner": {"winningPlan": {"stage": "COLLSCAN"}}}
+
+
+class FakeInsertResult(object):
+    def __init__(self, ids):
+        self.inserted_ids = ids
+
+
+class FakeDatabase(object):
+    def __init__(self):
+        self.commands = []
+
+    def command(self, *pargs, **kwargs):
+        self.commands.append((pargs, kwargs))
+        return {"stages": kwargs["pipeline"]}
+
+
+class FakeCollection(object):
+    """
+    Stands in for a pymongo Collection, recording the calls made to it.
+    """
+    def __init__(self, docs=None, duplicates=()):
+        self.docs = docs or []
+        self.calls = []
+        self.cursors = []
+
+        # The documents (by title) that insert_many() rejects.
+        self.duplicates = set(duplicates)
+
+        self.name = "coll"
+        self.database = FakeDatabase()
+
+    def cursor(self, docs):
+        cursor = FakeCursor(docs)
+        self.cursors.append(cursor)
+        return cursor
+
+    def find(self, **kwargs):
+        self.calls.append(("find", kwargs))
+        return self.cursor(self.docs)
+
+    def aggregate(self, stages, **options):
+        self.calls.append(("aggregate", stages, options))
+        return self.cursor(self.docs)
+
+    def insert_many(self, docs, ordered=True):
+        # Like pymongo, give each document an _id, and report write errors by
+        # index within this call's documents.
+        self.calls.append(("insert_many", len(docs), ordered))
+        errors = []
+        for i, doc in enumerate(docs):
+            doc.setdefault("_id", bson.ObjectId())
+            if doc["title"] in self.duplicates:
+                errors.append({"index": i, "code": 11000, "errmsg": "duplicate key"})
+                if ordered:
+                    break
+
+        if errors:
+            raise pymongo.errors.BulkWriteError({"writeErrors": errors})
+
+        self.docs.extend(docs)
+        return FakeInsertResult([doc["_id"] for doc in docs])
+
+    def count_documents(self, query):
+        return len(self.docs)
+
+
+class FakeClients(object):
+    def __init__(self, collection):
+        self.collection = collection
+
+    def get(self, server):
+        return {"db": {"coll": self.collection}}
+
+
+def load(collection):
+    # Load the service as the server would for the mongo plugin, with a fake
+    # collection in place of the real database.
+    cherrypy.config.update({"plugin-config": {plugin: {"batch-size": 1000}},
+                            "plugin-store": {plugin: {"clients": FakeClients(collection),
+                                                      "cache": None}}})
+    cherrypy.thread_data.pluginpath = plugin
+    return imp.load_source("mongo_service", plugin + "/web/mongo.py")
+
+
+def movies(n):
+    return [{"_id": bson.ObjectId(), "title": "Movie %d" % (i)} for i in xrange(n)]
+
+
+def test_stream_chunks():
+    docs = movies(5)
+    collection = FakeCollection(docs)
+    service = load(collection)
+
+    # Each document is sent as soon as it arrives from the server.
+    result = service.run("localhost", "db", "coll", stream="true", format="ndjson")
+    chunks = list(tangelo.server.Tangelo.stream_chunks(result, chunk_size=1))
+    assert len(filter(None, chunks)) == 5
+
+    lines = [json.loads(line) for line in "".join(chunks).splitlines()]
+    assert [line["title"] for line in lines] == [doc["title"] for doc in docs]
+    assert lines[0]["_id"] == {"$oid": str(docs[0]["_id"])}
+
+    result = service.run("localhost", "db", "coll", stream="true")
+    assert len(json.loads("".join(tangelo.server.Tangelo.stream_chunks(result)))) == 5
+
+    assert all(cursor.closed for cursor in collection.cursors)
+
+
+def test_batch_size():
+    collection = FakeCollection(movies(1))
+    service = load(collection)
+
+    # The batch size comes from the plugin configuration unless the request
+    # gives one.
+    service.run("localhost", "db", "coll", stream="true")
+    assert collection.calls[-1][1]["batch_size"] == 1000
+
+    service.run("localhost", "db", "coll", stream="true", batch_size="25")
+    assert collection.calls[-1][1]["batch_size"] == 25
+
+
+def test_stream_disconnect():
+    collection = FakeCollection(movies(10))
+    service = load(collection)
+
+    result = service.run("localhost", "db", "coll", stream="true")
+    chunks = tangelo.server.Tangelo.stream_chunks(result, chunk_size=1)
+    next(chunks)
+    assert not collection.cursors[0].closed
+
+    # The server closes the response body when the client goes away, which
+    # closes the cursor.
+    chunks.close()
+    assert collection.cursors[0].closed
+
+
+def test_aggregate_stages():
+    collection = FakeCollection(movies(3))
+    service = load(collection)
+
+    # The query and fields filter the pipeline's input, while the sort, skip,
+    # and limit apply to its output.
+    result = json.loads(service.run("localhost", "db", "coll", method="aggregate",
+                                    pipeline='[{"$group": {"_id": "$year"}}]',
+                                    query='{"rating": "PG"}', fields='["year"]',
+                                    sort='[["_id", -1]]', skip="5", limit="10"))
+    assert len(result["result"]["data"]) == 3
+
+    stages = collection.calls[-1][1]
+    assert stages == [{"$match": {"rating": "PG"}},
+                      {"$project": {"year": 1}},
+                      {"$group": {"_id": "$year"}},
+                      {"$sort": {"_id": -1}},
+                      {"$skip": 5},
+                      {"$limit": 10}]
+
+    # The default limit applies as it does to find; a limit of 0 removes it.
+    service.run("localhost", "db", "coll", method="aggregate", pipeline="[]")
+    assert collection.calls[-1][1] == [{"$limit": 1000}]
+
+    service.run("localhost", "db", "coll", method="aggregate", pipeline="[]", limit="0")
+    assert collection.calls[-1][1] == []
+
+
+def insert(service, docs, **kwargs):
+    return json.loads(service.run("localhost", "db", "coll", method="insert",
+                                  documents=bson.json_util.dumps(docs), **kwargs))
+
+
+def test_insert_batches():
+    collection = FakeCollection()
+    service = load(collection)
+
+    result = insert(service, [{"title": "Movie %d" % (i)} for i in xrange(5)], batch_size="2")["result"]
+    assert result["inserted"] == 5
+    assert len(result["ids"]) == 5
+    assert "errors" not in result
+    assert [call[1] for call in collection.calls] == [2, 2, 1]
+
+
+def test_insert_errors():
+    docs = [{"title": "Movie %d" % (i)} for i in xrange(5)]
+
+    # Errors are reported by index within the whole list, not the batch.
+    collection = FakeCollection(duplicates=["Movie 1", "Movie 3"])
+    result = insert(load(collection), docs, batch_size="2", ordered="false")["result"]
+    assert result["inserted"] == 3
+    assert [error["index"] for error in result["errors"]] == [1, 3]
+    assert [call[1] for call in collection.calls] == [2, 2, 1]
+
+    # An ordered insert stops at the first error.
+    collection = FakeCollection(duplicates=["Movie 3"])
+    result = insert(load(collection), docs, batch_size="2")["result"]
+    assert result["inserted"] == 3
+    assert [error["index"] for error in result["errors"]] == [3]
+    assert [call[1] for call in collection.calls] == [2, 2]
+
+
+def test_insert_empty():
+    collection = FakeCollection()
+    service = load(collection)
+
+    cherrypy.response.status = None
+    result = insert(service, [])
+    assert "error" in result
+    assert cherrypy.response.status.startswith("400")
+    assert collection.calls == []
+
+
+def test_explain():
+    collection = FakeCollection(movies(3))
+    service = load(collection)
+
+    result = json.loads(service.run("localhost", "db", "coll", explain="true"))
+    assert result["result"]["queryPlanner"]["winningPlan"]["stage"] == "COLLSCAN"
+
+    # An aggregation is explained by the database, with the whole pipeline.
+    result = json.loads(service.run("localhost", "db", "coll", method="aggregate",
+                                    pipeline='[{"$match": {"year": 1987}}]', explain="true"))
+    pargs, kwargs = collection.database.commands[-1]
+    assert pargs == ("aggregate", "coll")
+    assert kwargs["explain"] is True
+    assert result["result"]["stages"] == [{"$match": {"year": 1987}}, {"$limit": 1000}]
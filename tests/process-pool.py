@@ -0,0 +1,101 @@
+import glob
+import nose
+import os
+import requests
+
+import fixture
+
+
+def children(pid):
+    # The processes whose parent is `pid`, per the fourth field of
+    # /proc/<pid>/stat (after the parenthesized command name).
+    result = []
+    for path in glob.glob("/proc/[0-9]*/stat"):
+        try:
+            with open(path) as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+        except (IOError, IndexError):
+            continue
+
+        if int(fields[1]) == pid:
+            result.append(int(path.split("/")[2]))
+    return result
+
+
+@nose.with_setup(fixture.start_tangelo, fixture.stop_tangelo)
+def test_worker_process():
+    response = requests.get(fixture.url("pooled"))
+    assert response.status_code == 200
+
+    # The workers are forked by a separate process, started along with the
+    # first pool.
+    result = response.json()
+    assert result["pid"] != fixture.process.pid
+    assert result["parent"] != fixture.process.pid
+
+
+@nose.with_setup(fixture.start_tangelo, fixture.stop_tangelo)
+def test_lazy_spawner():
+    if not os.path.exists("/proc/self/stat"):
+        raise nose.SkipTest("No /proc filesystem to find child processes")
+
+    # No helper process is started until a service needs worker processes.
+    assert children(fixture.process.pid) == []
+
+    response = requests.get(fixture.url("pooled"))
+    assert response.status_code == 200
+    assert children(fixture.process.pid) == [response.json()["parent"]]
+
+
+@nose.with_setup(fixture.start_tangelo, fixture.stop_tangelo)
+def test_worker_config():
+    response = requests.get(fixture.url("pooled", action="config"))
+    assert response.status_code == 200
+    assert response.json() == {"processes": 2, "process-timeout": 1, "officer": "picard"}
+
+
+@nose.with_setup(fixture.start_tangelo, fixture.stop_tangelo)
+def test_worker_response():
+    response = requests.get(fixture.url("pooled", action="text"))
+    assert response.status_code == 200
+    assert "text/plain" in response.headers["Content-Type"]
+    assert response.text == "Engage"
+
+    response = requests.get(fixture.url("pooled", action="status"))
+    assert response.status_code == 409
+    assert response.json() == {"alert": "red"}
+
+    response = requests.get(fixture.url("pooled", action="generator"))
+    assert response.status_code == 200
+    assert response.json() == [0, 1, 4, 9]
+
+
+@nose.with_setup(fixture.start_tangelo, fixture.stop_tangelo)
+def test_worker_error():
+    response = requests.get(fixture.url("pooled", action="fail"))
+    assert response.status_code == 500
+    assert "Error code" in response.json()["message"]
+
+    # The pool survives the error.
+    response = requests.get(fixture.url("pooled", action="text"))
+    assert response.status_code == 200
+
+
+@nose.with_setup(fixture.start_tangelo, fixture.stop_tangelo)
+def test_worker_timeout():
+    response = requests.get(fixture.url("pooled", action="sleep"))
+    assert response.status_code == 504
+    assert "Error code" in response.json()["message"]
+
+    # The stuck worker is replaced.
+    for i in xrange(4):
+        response = requests.get(fixture.url("pooled", action="text"))
+        assert response.status_code == 200
+
+
+@nose.with_setup(fixture.start_tangelo, fixture.stop_tangelo)
+def test_worker_store():
+    # The persistent store is not shared between worker processes, and so is
+    # unavailable.
+    response = requests.get(fixture.url("pooled", action="store"))
+    assert response.status_code == 500
@@ -0,0 +1,55 @@
+import nose
+import requests
+import time
+
+import fixture
+
+
+@nose.with_setup(fixture.start_tangelo, fixture.stop_tangelo)
+def test_cache_hit():
+    response = requests.get(fixture.url("cached"))
+    assert response.status_code == 200
+    assert response.json() == {"officer": "picard", "calls": 1}
+
+    # Arguments not named in vary-on do not affect the cache key.
+    response = requests.get(fixture.url("cached", mood="stern"))
+    assert response.status_code == 200
+    assert response.json() == {"officer": "picard", "calls": 1}
+
+    response = requests.get(fixture.url("cached", officer="riker"))
+    assert response.status_code == 200
+    assert response.json() == {"officer": "riker", "calls": 2}
+
+
+@nose.with_setup(fixture.start_tangelo, fixture.stop_tangelo)
+def test_cache_expiry():
+    response = requests.get(fixture.url("cached"))
+    assert response.json() == {"officer": "picard", "calls": 1}
+
+    time.sleep(1.5)
+
+    response = requests.get(fixture.url("cached"))
+    assert response.json() == {"officer": "picard", "calls": 2}
+
+
+@nose.with_setup(fixture.start_tangelo, fixture.stop_tangelo)
+def test_etag():
+    response = requests.get(fixture.url("cached"))
+    assert response.status_code == 200
+    etag = response.headers["ETag"]
+
+    response = requests.get(fixture.url("cached"), headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.text == ""
+
+    response = requests.get(fixture.url("cached"), headers={"If-None-Match": '"stale"'})
+    assert response.status_code == 200
+    assert response.headers["ETag"] == etag
+    assert response.json() == {"officer": "picard", "calls": 1}
+
+
+@nose.with_setup(fixture.start_tangelo, fixture.stop_tangelo)
+def test_uncached_service():
+    response = requests.get(fixture.url("echo"))
+    assert response.status_code == 200
+    assert "ETag" not in response.headers
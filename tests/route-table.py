@@ -0,0 +1,101 @@
+import nose
+import os
+import requests
+import shutil
+import tempfile
+import time
+
+import fixture
+import tangelo.server
+
+
+def start_tangelo():
+    return fixture.start_tangelo("--route-table")
+
+
+@nose.with_setup(start_tangelo, fixture.stop_tangelo)
+def test_route_table_resolution():
+    # A service with path arguments.
+    response = requests.get(fixture.url("echo", "one", "two", foo="bar"))
+    assert response.status_code == 200
+    assert response.text == "[one, two]\nfoo -> bar"
+
+    # A service in a subdirectory.
+    response = requests.get(fixture.url("sub", "importpath"))
+    assert response.status_code == 200
+
+    # A static file, a directory redirect, and a missing file.
+    response = requests.get(fixture.url("analyze-url", "standalone.yaml"))
+    assert response.status_code == 200
+
+    response = requests.get(fixture.url("sub"), allow_redirects=False)
+    assert response.status_code == 303
+    assert response.headers["Location"].endswith("/sub/")
+
+    response = requests.get(fixture.url("does-not-exist.html"))
+    assert response.status_code == 404
+
+
+@nose.with_setup(start_tangelo, fixture.stop_tangelo)
+def test_route_table_refresh():
+    path = "tests/web/sub/late_service.py"
+
+    response = requests.get(fixture.url("sub", "late_service"))
+    assert response.status_code == 404
+
+    try:
+        with open(path, "w") as f:
+            f.write("def run():\n    return 'arrived'\n")
+
+        # Give the background refresh a chance to notice the new file.
+        time.sleep(2)
+
+        response = requests.get(fixture.url("sub", "late_service"))
+        assert response.status_code == 200
+        assert response.text == "arrived"
+    finally:
+        os.remove(path)
+        if os.path.exists(path + "c"):
+            os.remove(path + "c")
+
+    time.sleep(2)
+
+    response = requests.get(fixture.url("sub", "late_service"))
+    assert response.status_code == 404
+
+
+def test_refresh_scans_new_directories_only():
+    root = tempfile.mkdtemp()
+    try:
+        os.makedirs(os.path.join(root, "old", "deep"))
+        table = tangelo.server.RouteTable([root])
+        old = table.roots[root].children["old"]
+
+        scanned = []
+        scan = tangelo.server.RouteTable.scan
+
+        def counting_scan(path, seen):
+            scanned.append(path)
+            return scan(path, seen)
+
+        tangelo.server.RouteTable.scan = staticmethod(counting_scan)
+        try:
+            # A new file in the root does not rescan the existing subtree.
+            open(os.path.join(root, "index.html"), "w").close()
+            os.utime(root, (time.time() + 10, time.time() + 10))
+            table.refresh()
+            assert scanned == []
+            assert table.roots[root].children["old"] is old
+            assert table.exists(os.path.join(root, "index.html"))
+
+            # A new subdirectory is scanned, and nothing else.
+            os.makedirs(os.path.join(root, "new", "deeper"))
+            os.utime(root, (time.time() + 20, time.time() + 20))
+            table.refresh()
+            assert scanned == [os.path.join(root, "new"), os.path.join(root, "new", "deeper")]
+            assert table.roots[root].children["old"] is old
+            assert table.isdir(os.path.join(root, "new", "deeper"))
+        finally:
+            tangelo.server.RouteTable.scan = staticmethod(scan)
+    finally:
+        shutil.rmtree(root)
@@ -0,0 +1,79 @@
+import nose
+import requests
+import StringIO
+
+import fixture
+
+
+@nose.with_setup(fixture.start_tangelo, fixture.stop_tangelo)
+def test_json_datetime():
+    response = requests.get(fixture.url("serialize"))
+    assert response.status_code == 200
+    assert "application/json" in response.headers["Content-Type"]
+    assert response.json() == {"stardate": "2364-09-28T12:00:00",
+                               "crew": ["picard", "riker", "data"]}
+
+
+@nose.with_setup(fixture.start_tangelo, fixture.stop_tangelo)
+def test_json_numpy():
+    try:
+        import numpy  # noqa: F401
+    except ImportError:
+        raise nose.SkipTest("NumPy is not installed")
+
+    response = requests.get(fixture.url("serialize", kind="numpy"))
+    assert response.status_code == 200
+    assert response.json() == {"readings": [0, 1, 2, 3], "mean": 1.5}
+
+
+@nose.with_setup(fixture.start_tangelo, fixture.stop_tangelo)
+def test_accept_msgpack():
+    try:
+        import msgpack
+    except ImportError:
+        raise nose.SkipTest("msgpack is not installed")
+
+    response = requests.get(fixture.url("serialize"), headers={"Accept": "application/x-msgpack"})
+    assert response.status_code == 200
+    assert response.headers["Content-Type"] == "application/x-msgpack"
+    assert msgpack.unpackb(response.content, raw=False) == {
+        "stardate": "2364-09-28T12:00:00",
+        "crew": ["picard", "riker", "data"]
+    }
+
+
+@nose.with_setup(fixture.start_tangelo, fixture.stop_tangelo)
+def test_configured_serializer():
+    try:
+        import numpy
+    except ImportError:
+        raise nose.SkipTest("NumPy is not installed")
+
+    # The config must stick across repeated requests.
+    for i in range(2):
+        response = requests.get(fixture.url("serialize_npy"))
+        assert response.status_code == 200
+        assert response.headers["Content-Type"] == "application/x-npy"
+
+        array = numpy.load(StringIO.StringIO(response.content))
+        assert array.tolist() == [[1, 2, 3], [4, 5, 6]]
+
+
+@nose.with_setup(fixture.start_tangelo, fixture.stop_tangelo)
+def test_configured_serializer_fallback():
+    try:
+        import numpy  # noqa: F401
+    except ImportError:
+        raise nose.SkipTest("NumPy is not installed")
+
+    # A failing service's error report is sent as JSON, with its own status.
+    response = requests.get(fixture.url("serialize_npy", kind="fail"))
+    assert response.status_code == 500
+    assert response.headers["Content-Type"] == "application/json"
+    assert "Error code" in response.json()["message"]
+
+    # So is a result the configured serializer cannot handle.
+    response = requests.get(fixture.url("serialize_npy", kind="report"))
+    assert response.status_code == 200
+    assert response.headers["Content-Type"] == "application/json"
+    assert response.json() == {"crew": ["picard", "riker", "data"]}
@@ -1,5 +1,6 @@
 import nose
 import requests
+import threading
 
 import fixture
 
@@ -11,6 +12,40 @@ def test_service_config():
     assert result == "abracadabra"
 
 
+@nose.with_setup(fixture.start_tangelo, fixture.stop_tangelo)
+def test_service_config_concurrent():
+    # Many threads asking for a service at once (including its first load)
+    # should all see the module and its configuration.
+    results = []
+
+    def fetch():
+        for i in range(5):
+            results.append(requests.get(fixture.url("configured")).content)
+
+    threads = [threading.Thread(target=fetch) for i in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert results == ["abracadabra"] * 40
+
+
+@nose.with_setup(fixture.start_tangelo, fixture.stop_tangelo)
+def test_config_read_only():
+    response = requests.get(fixture.url("config_views"))
+    assert response.json() == {"same": True,
+                               "crew": ["picard", "riker"]}
+
+    response = requests.get(fixture.url("config_views", action="write"))
+    assert response.json() == {"error": "configuration is read-only"}
+
+    response = requests.get(fixture.url("config_views", action="mutable"))
+    assert response.json() == {"copy": {"ship": "stargazer", "crew": ["picard", "riker", "wesley"]},
+                               "deepcopy": {"ship": "enterprise-d", "crew": ["picard", "riker"]},
+                               "original": {"ship": "enterprise", "crew": ["picard", "riker"]}}
+
+
 @nose.with_setup(fixture.start_tangelo, fixture.stop_tangelo)
 def test_config_protected():
     result = requests.get(fixture.url("configured.yaml"))
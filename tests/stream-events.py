@@ -0,0 +1,64 @@
+import json
+import nose
+import requests
+from requests.auth import HTTPDigestAuth
+
+import fixture
+
+
+def events(response):
+    event = {}
+    for line in response.iter_lines():
+        if line == "":
+            yield event
+            event = {}
+        elif not line.startswith(":"):
+            field, value = line.split(": ", 1)
+            event[field] = json.loads(value) if field == "data" else value
+
+
+@nose.with_setup(fixture.start_tangelo, fixture.stop_tangelo)
+def test_events():
+    response = requests.get(fixture.plugin_url("stream", "events", "finite"), stream=True)
+
+    assert response.status_code == 200
+    assert response.headers["Content-Type"].startswith("text/event-stream")
+    assert list(events(response)) == [{"id": "0", "data": "hello"},
+                                      {"id": "1", "data": "world"},
+                                      {"event": "finished", "data": True}]
+
+
+@nose.with_setup(fixture.start_tangelo, fixture.stop_tangelo)
+def test_resume():
+    response = requests.get(fixture.plugin_url("stream", "events", "seekable", letters="wxyz"), headers={"Last-Event-ID": "1"}, stream=True)
+
+    assert list(events(response)) == [{"id": "2", "data": "y"},
+                                      {"id": "3", "data": "z"},
+                                      {"event": "finished", "data": True}]
+
+
+@nose.with_setup(fixture.start_tangelo, fixture.stop_tangelo)
+def test_malformed_last_event_id():
+    for last_id in ["banana", "-5"]:
+        response = requests.get(fixture.plugin_url("stream", "events", "seekable", letters="wxyz"), headers={"Last-Event-ID": last_id})
+        assert response.status_code == 400
+        assert "Last-Event-ID" in response.json()["error"]
+
+
+@nose.with_setup(fixture.start_tangelo, fixture.stop_tangelo)
+def test_no_stream():
+    assert requests.get(fixture.plugin_url("stream", "events", "echo")).status_code == 400
+    assert requests.get(fixture.plugin_url("stream", "events", "nonexistent")).status_code == 404
+
+
+@nose.with_setup(fixture.start_tangelo, fixture.stop_tangelo)
+def test_protected_stream():
+    # The .htaccess file governing the service applies to its event stream.
+    response = requests.get(fixture.plugin_url("stream", "events", "secure", "workdir"))
+    assert response.status_code == 401
+
+    # The service runs in its own directory, as it would if invoked directly.
+    response = requests.get(fixture.plugin_url("stream", "events", "secure", "workdir"), auth=HTTPDigestAuth("picard", "engage"), stream=True)
+    assert response.status_code == 200
+    assert list(events(response)) == [{"id": "0", "data": "secure"},
+                                      {"event": "finished", "data": True}]
@@ -0,0 +1,163 @@
+import imp
+import nose.tools
+import time
+
+stream = imp.load_source("stream_plugin", "tangelo/tangelo/pkgdata/plugin/stream/python/__init__.py")
+
+
+class Counter(object):
+    def __init__(self):
+        self.closed = []
+
+    def generator(self, name):
+        try:
+            i = 0
+            while True:
+                yield i
+                i += 1
+        finally:
+            self.closed.append(name)
+
+
+def test_info():
+    table = stream.StreamTable()
+    key = table.add(Counter().generator("a"), "/counter")
+
+    s = table.get(key)
+    assert [s.next() for _ in range(3)] == [0, 1, 2]
+
+    info = s.info()
+    assert info["key"] == key
+    assert info["service"] == "/counter"
+    assert info["items"] == 3
+    assert info["age"] >= info["idle"] >= 0
+
+
+def test_global_limit():
+    counter = Counter()
+    table = stream.StreamTable(max_streams=2)
+
+    a = table.add(counter.generator("a"), "/counter")
+    b = table.add(counter.generator("b"), "/counter")
+
+    # Start the generators so that closing them runs their cleanup code.
+    table.get(a).next()
+    table.get(b).next()
+
+    # Touching "a" makes "b" the least recently used stream.
+    table.get(a)
+    c = table.add(counter.generator("c"), "/counter")
+
+    assert sorted(table.keys()) == sorted([a, c])
+    assert counter.closed == ["b"]
+
+
+def test_session_limit():
+    counter = Counter()
+    table = stream.StreamTable(max_per_session=1)
+
+    a = table.add(counter.generator("a"), "/counter", session="alice")
+    b = table.add(counter.generator("b"), "/counter", session="bob")
+    table.get(a).next()
+
+    c = table.add(counter.generator("c"), "/counter", session="alice")
+
+    assert sorted(table.keys()) == sorted([b, c])
+    assert counter.closed == ["a"]
+
+
+def test_reap():
+    counter = Counter()
+    table = stream.StreamTable(idle_timeout=0.2)
+
+    a = table.add(counter.generator("a"), "/counter")
+    table.get(a).next()
+    time.sleep(0.3)
+
+    b = table.add(counter.generator("b"), "/counter")
+    table.reap()
+
+    assert table.keys() == [b]
+    assert counter.closed == ["a"]
+
+
+def test_clear():
+    counter = Counter()
+    table = stream.StreamTable()
+
+    for name in "abc":
+        table.get(table.add(counter.generator(name), "/counter")).next()
+
+    table.clear()
+
+    assert len(table) == 0
+    assert sorted(counter.closed) == ["a", "b", "c"]
+
+
+def test_take():
+    table = stream.StreamTable()
+    s = table.get(table.add(iter(range(5)), "/range"))
+
+    assert s.take(count=2) == [0, 1]
+    assert s.take(count=10) == [2, 3, 4]
+    assert s.items == 5
+    nose.tools.assert_raises(StopIteration, s.take, count=1)
+
+
+def test_heartbeat():
+    def slow():
+        yield 1
+        time.sleep(0.35)
+        yield 2
+
+    source = stream.EventSource(heartbeat=0.1)
+    messages = list(source.events(slow()))
+
+    assert messages[0] == "id: 0\ndata: 1\n\n"
+    assert ": heartbeat\n\n" in messages
+    assert messages[-2] == "id: 1\ndata: 2\n\n"
+    assert messages[-1] == "event: finished\ndata: true\n\n"
+
+
+def test_prefetcher():
+    assert list(stream.Prefetcher(iter(range(10)), 3)) == range(10)
+
+    def failing():
+        yield 1
+        raise ValueError("oops")
+
+    prefetcher = stream.Prefetcher(failing(), 3)
+    assert prefetcher.next() == 1
+    nose.tools.assert_raises(ValueError, prefetcher.next)
+    nose.tools.assert_raises(ValueError, prefetcher.next)
+
+
+def test_prefetcher_close():
+    counter = Counter()
+    prefetcher = stream.Prefetcher(counter.generator("a"), 2)
+    assert prefetcher.next() == 0
+
+    prefetcher.close()
+    for i in range(30):
+        if counter.closed:
+            break
+        time.sleep(0.1)
+
+    assert counter.closed == ["a"]
+
+
+def test_prefetched_take():
+    def slow():
+        yield 1
+        time.sleep(1)
+        yield 2
+
+    table = stream.StreamTable()
+    s = table.get(table.add(stream.Prefetcher(slow(), 2), "/slow"))
+
+    # The time limit cuts the batch short rather than waiting on the
+    # generator.
+    start = time.time()
+    assert s.take(count=2, max_ms=100) == [1]
+    assert time.time() - start < 0.5
+    assert s.take(count=2) == [2]
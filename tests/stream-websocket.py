@@ -0,0 +1,97 @@
+import json
+import nose
+import Queue
+import requests
+import time
+from ws4py.client.threadedclient import WebSocketClient
+
+import fixture
+
+
+class Client(WebSocketClient):
+    def __init__(self):
+        WebSocketClient.__init__(self, "ws://%s:%s/ws/stream/ws" % (fixture.host, fixture.port))
+        self.messages = Queue.Queue()
+
+    def received_message(self, message):
+        self.messages.put(json.loads(message.data))
+
+    def closed(self, code, reason=None):
+        self.messages.put(None)
+
+    def receive(self):
+        return self.messages.get(timeout=5)
+
+
+def start(service):
+    return requests.post(fixture.plugin_url("stream", "stream", "start", service)).json()["key"]
+
+
+@nose.with_setup(fixture.start_tangelo, fixture.stop_tangelo)
+def test_push():
+    key = start("finite")
+
+    client = Client()
+    client.connect()
+    client.send(json.dumps({"key": key, "request": 10}))
+
+    assert client.receive() == {"data": "hello"}
+    assert client.receive() == {"data": "world"}
+    assert client.receive() == {"finished": True}
+    assert client.receive() is None
+
+    # The finished stream is no longer in the table.
+    assert key not in requests.get(fixture.plugin_url("stream", "stream")).json()
+
+
+@nose.with_setup(fixture.start_tangelo, fixture.stop_tangelo)
+def test_backpressure():
+    key = start("primes")
+
+    client = Client()
+    client.connect()
+    client.send(json.dumps({"key": key, "request": 3}))
+
+    assert [client.receive()["data"] for i in range(3)] == [2, 3, 5]
+
+    # No more items are sent until the client asks for them.
+    nose.tools.assert_raises(Queue.Empty, client.messages.get, timeout=1)
+
+    client.send(json.dumps({"request": 2}))
+    assert [client.receive()["data"] for i in range(2)] == [7, 11]
+
+    info = requests.get(fixture.plugin_url("stream", "stream", key)).json()
+    assert info["items"] == 5
+
+    client.close()
+    assert client.receive() is None
+
+
+@nose.with_setup(fixture.start_tangelo, fixture.stop_tangelo)
+def test_cancel_on_close():
+    key = start("primes")
+
+    client = Client()
+    client.connect()
+    client.send(json.dumps({"key": key, "request": 1}))
+    assert client.receive() == {"data": 2}
+
+    client.close()
+    assert client.receive() is None
+
+    # Closing the socket closes the stream.
+    for i in range(10):
+        if key not in requests.get(fixture.plugin_url("stream", "stream")).json():
+            break
+        time.sleep(0.2)
+    assert key not in requests.get(fixture.plugin_url("stream", "stream")).json()
+
+
+@nose.with_setup(fixture.start_tangelo, fixture.stop_tangelo)
+def test_bad_key():
+    client = Client()
+    client.connect()
+    client.send(json.dumps({"key": "nosuchkey", "request": 1}))
+
+    assert "error" in client.receive()
+    assert client.receive() is None
@@ -1,6 +1,7 @@
 import nose
 import requests
 import string
+import time
 
 import fixture
 
@@ -97,3 +98,76 @@ def test_delete_stream():
     print my_keys
 
     assert server_keys == my_keys
+
+
+@nose.with_setup(fixture.start_tangelo, fixture.stop_tangelo)
+def test_stream_info():
+    key = requests.post(fixture.plugin_url("stream", "stream", "start", "primes")).json()["key"]
+
+    for i in range(3):
+        requests.post(fixture.plugin_url("stream", "stream", "next", key))
+
+    info = requests.get(fixture.plugin_url("stream", "stream", key))
+    assert info.status_code == 200
+
+    info = info.json()
+    assert info["key"] == key
+    assert info["service"] == "/primes"
+    assert info["items"] == 3
+    assert info["age"] >= info["idle"] >= 0
+    assert "last-access" in info
+
+    missing = requests.get(fixture.plugin_url("stream", "stream", "nosuchkey"))
+    assert missing.status_code == 404
+
+
+@nose.with_setup(fixture.start_tangelo, fixture.stop_tangelo)
+def test_batched_stream():
+    key = requests.post(fixture.plugin_url("stream", "stream", "start", "primes")).json()["key"]
+
+    first = requests.post(fixture.plugin_url("stream", "stream", "next", key), data={"count": 5})
+    assert first.status_code == 200
+    assert first.json() == [2, 3, 5, 7, 11]
+
+    second = requests.post(fixture.plugin_url("stream", "stream", "next", key), data={"count": 3})
+    assert second.json() == [13, 17, 19]
+
+    # A time limit alone returns at least one item.
+    timed = requests.post(fixture.plugin_url("stream", "stream", "next", key), data={"max_ms": 0})
+    assert timed.json() == [23]
+
+    bad = requests.post(fixture.plugin_url("stream", "stream", "next", key), data={"count": "many"})
+    assert bad.status_code == 400
+
+
+@nose.with_setup(fixture.start_tangelo, fixture.stop_tangelo)
+def test_batched_finite_stream():
+    key = requests.post(fixture.plugin_url("stream", "stream", "start", "finite")).json()["key"]
+
+    # The batch is cut short by the end of the stream; the following request
+    # reports that the stream has finished.
+    batch = requests.post(fixture.plugin_url("stream", "stream", "next", key), data={"count": 10})
+    finished = requests.post(fixture.plugin_url("stream", "stream", "next", key), data={"count": 10})
+
+    assert batch.json() == ["hello", "world"]
+    assert finished.status_code == 204
+
+
+@nose.with_setup(fixture.start_tangelo, fixture.stop_tangelo)
+def test_prefetched_stream():
+    key = requests.post(fixture.plugin_url("stream", "stream", "start", "prefetched")).json()["key"]
+
+    # Give the stream time to fill its buffer.
+    time.sleep(1.5)
+    assert requests.get(fixture.plugin_url("stream", "stream", key)).json()["prefetched"] == 4
+
+    # The buffered values are returned without waiting on the generator.
+    start = time.time()
+    batch = requests.post(fixture.plugin_url("stream", "stream", "next", key), data={"count": 4}).json()
+    assert batch == [0, 1, 2, 3]
+    assert time.time() - start < 0.5
+
+    rest = [requests.post(fixture.plugin_url("stream", "stream", "next", key)).json() for i in range(6)]
+    assert rest == [4, 5, 6, 7, 8, 9]
+
+    assert requests.post(fixture.plugin_url("stream", "stream", "next", key)).status_code == 204
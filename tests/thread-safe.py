@@ -0,0 +1,42 @@
+import nose
+import os
+import requests
+
+import fixture
+
+
+def start_tangelo():
+    return fixture.start_tangelo("--thread-safe")
+
+
+@nose.with_setup(start_tangelo, fixture.stop_tangelo)
+def test_cwd_unchanged():
+    response = requests.get(fixture.url("cwd"))
+    assert response.content == os.getcwd()
+
+
+@nose.with_setup(start_tangelo, fixture.stop_tangelo)
+def test_module_path():
+    response = requests.get(fixture.url("modpath"))
+    assert response.content == fixture.relative_path("tests/web")
+
+    response = requests.get(fixture.url("modpath", path="data.csv"))
+    assert response.content == fixture.relative_path("tests/web/data.csv")
+
+
+@nose.with_setup(start_tangelo, fixture.stop_tangelo)
+def test_imports():
+    expected = "\n".join(["[oct, 30]", "color -> green", "answer -> 42"])
+
+    response = requests.get(fixture.url("import", "oct", "30", color="green", answer="42"))
+    assert response.content == expected
+
+    response = requests.get(fixture.url("sub/importpath", "oct", "30", color="green", answer="42"))
+    assert response.content == expected
+
+
+@nose.with_setup(start_tangelo, fixture.stop_tangelo)
+def test_relative_file():
+    response = requests.get(fixture.url("static_file"))
+    assert response.status_code == 200
+    assert response.text == "Infinite Diversity in Infinite Combinations\n"
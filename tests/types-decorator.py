@@ -0,0 +1,72 @@
+import nose
+
+import tangelo
+
+
+@tangelo.types(a=int, b=float)
+def add(a, b, c="unconverted"):
+    return (a, b, c)
+
+
+@tangelo.types(officer=str, rank=int)
+def promote(officer, rank=1):
+    return (officer, rank)
+
+
+@tangelo.types(ids=[int])
+def lookup(ids):
+    return ids
+
+
+@tangelo.types(first=int)
+def collect(first, *rest):
+    return (first, rest)
+
+
+def test_positional_and_keyword():
+    assert add("1", "2.5") == (1, 2.5, "unconverted")
+    assert add("1", b="2.5") == (1, 2.5, "unconverted")
+    assert add(a="1", b="2.5", c="3") == (1, 2.5, "3")
+
+
+def test_extra_positional():
+    assert add("1", "2.5", "3", "4") == (1, 2.5, "3")
+    assert collect("1", "2", "3") == (1, ("2", "3"))
+
+
+def test_default():
+    assert promote("riker") == ("riker", 1)
+    assert promote("riker", "2") == ("riker", 2)
+
+
+def test_missing():
+    result = add("1")
+    assert "error" in result
+
+
+def test_conversion_error():
+    result = add("one", "2.5")
+    assert result == {"error": "invalid literal for int() with base 10: 'one'"}
+
+
+def test_list():
+    assert lookup("1") == [1]
+    assert lookup(["1", "2", "3"]) == [1, 2, 3]
+    assert "error" in lookup(["1", "two"])
+
+
+def test_numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise nose.SkipTest("NumPy is not installed")
+
+    @tangelo.types(x=numpy.dtype("float32"), xs=[numpy.dtype("int16")])
+    def scale(x, xs):
+        return x, xs
+
+    x, xs = scale("1.5", ["1", "2", "3"])
+    assert x == 1.5 and x.dtype == numpy.float32
+    assert xs.tolist() == [1, 2, 3] and xs.dtype == numpy.int16
+
+    assert "error" in scale("fast", "1")
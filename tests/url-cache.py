@@ -0,0 +1,29 @@
+import nose
+import os
+import requests
+
+import fixture
+
+
+@nose.with_setup(fixture.start_tangelo, fixture.stop_tangelo)
+def test_url_cache_invalidation():
+    path = "tests/web/sub/late_arrival.txt"
+
+    # Prime the cache with a negative result.
+    response = requests.get(fixture.url("sub", "late_arrival.txt"))
+    assert response.status_code == 404
+
+    # Creating the file changes the containing directory's mtime, which must
+    # invalidate the cached analysis.
+    try:
+        with open(path, "w") as f:
+            f.write("made it\n")
+
+        response = requests.get(fixture.url("sub", "late_arrival.txt"))
+        assert response.status_code == 200
+        assert response.text == "made it\n"
+    finally:
+        os.remove(path)
+
+    response = requests.get(fixture.url("sub", "late_arrival.txt"))
+    assert response.status_code == 404
@@ -0,0 +1,94 @@
+import imp
+import nose
+import os
+import shutil
+import tempfile
+import time
+
+watcher = imp.load_source("watch_plugin_watcher", "tangelo/tangelo/pkgdata/plugin/watch/python/watcher.py")
+
+directory = None
+
+
+def setup():
+    global directory
+    directory = tempfile.mkdtemp()
+
+
+def teardown():
+    shutil.rmtree(directory)
+
+
+def path(name):
+    return os.path.join(directory, name)
+
+
+def write(name, content="pass\n"):
+    with open(path(name), "w") as f:
+        f.write(content)
+
+
+def wait_for_change(w, version, timeout=3):
+    start = time.time()
+    while time.time() - start < timeout:
+        if w.current() != version:
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def check_watcher(w):
+    write("a.py")
+    write("unrelated.txt")
+    w.watch(path("a.py"))
+    w.watch(path("b.yaml"))
+
+    version = w.current()
+    assert not wait_for_change(w, version, timeout=0.5)
+
+    # Changes to unwatched files are ignored.
+    write("unrelated.txt", "changed")
+    assert not wait_for_change(w, version, timeout=0.5)
+
+    # Modifying a watched file is noticed.
+    time.sleep(0.01)
+    write("a.py", "x = 1\n")
+    assert wait_for_change(w, version)
+    version = w.current()
+
+    # So is creating a watched file that did not exist.
+    write("b.yaml", "key: value\n")
+    assert wait_for_change(w, version)
+
+    w.stop()
+
+
+def test_inotify():
+    try:
+        w = watcher.InotifyWatcher()
+    except (AttributeError, OSError, TypeError):
+        raise nose.SkipTest("inotify is not available")
+
+    check_watcher(w)
+
+
+def test_inotify_replace():
+    try:
+        w = watcher.InotifyWatcher()
+    except (AttributeError, OSError, TypeError):
+        raise nose.SkipTest("inotify is not available")
+
+    write("c.py")
+    w.watch(path("c.pyc"))
+    version = w.current()
+
+    # Editors often save by writing a new file and renaming it into place.
+    write("c.py.tmp", "y = 2\n")
+    os.rename(path("c.py.tmp"), path("c.py"))
+    assert wait_for_change(w, version)
+
+    w.stop()
+
+
+def test_polling():
+    check_watcher(watcher.PollingWatcher(interval=0.1))
@@ -0,0 +1,90 @@
+import __builtin__
+import imp
+import nose
+import os
+import shutil
+import tempfile
+
+import tangelo
+import tangelo.util
+
+# Load the watch plugin's module on its own, undoing the import hooks it
+# installs.
+builtin_import = __builtin__.__import__
+module_cache_get = tangelo.util.module_cache_get
+try:
+    watch = imp.load_module("watch_plugin", None, "tangelo/tangelo/pkgdata/plugin/watch/python", ("", "", imp.PKG_DIRECTORY))
+finally:
+    __builtin__.__import__ = builtin_import
+    tangelo.util.module_cache_get = module_cache_get
+
+directory = None
+
+
+def setup():
+    global directory
+    directory = tempfile.mkdtemp()
+
+
+def teardown():
+    shutil.rmtree(directory)
+
+
+def add(parent, name, mtime):
+    # Record that module `parent` imported module `name` from a file with the
+    # given modification time.
+    filename = os.path.join(directory, "%s.py" % (name))
+    open(filename, "w").close()
+    os.utime(filename, (mtime, mtime))
+
+    key = "%s.%s" % (parent, name)
+    watch.WatchList[key] = {"time": mtime, "parent": parent, "name": name, "file": filename}
+    watch.Children.setdefault(parent, set()).add(key)
+    watch.Files.setdefault(filename, set()).add(key)
+    watch.GraphVersion[0] += 1
+    return key
+
+
+def clear():
+    watch.WatchList.clear()
+    watch.Children.clear()
+    watch.Files.clear()
+
+
+@nose.with_setup(clear, clear)
+def test_chain():
+    # /srv/a.py imports b, which imports c, which imports d.
+    ab = add("/srv/a", "b", 100)
+    bc = add("b", "c", 300)
+    cd = add("c", "d", 200)
+
+    assert watch.reachable("/srv/a.py") == [cd, bc, ab]
+    assert watch.reachable(bc) == [cd]
+
+    assert watch.latest_submodule_time("/srv/a.py") == 300
+    assert watch.latest_submodule_time("/srv/a.py", 400) == 400
+    assert watch.latest_submodule_time(cd) == 0
+
+
+@nose.with_setup(clear, clear)
+def test_cycle():
+    # e imports f, which imports e.
+    ef = add("/srv/e", "f", 100)
+    fe = add("f", "e", 150)
+    eg = add("e", "g", 50)
+
+    assert sorted(watch.reachable("/srv/e.py")) == sorted([ef, fe, eg])
+    assert watch.latest_submodule_time("/srv/e.py") == 150
+
+
+@nose.with_setup(clear, clear)
+def test_wide():
+    # A service importing many modules, each importing a shared module.
+    for i in range(500):
+        add("/srv/wide", "m%d" % (i), i)
+        add("m%d" % (i), "shared", 1000)
+
+    order = watch.reachable("/srv/wide.py")
+    assert len(order) == 1000
+    assert order.index("m7.shared") < order.index("/srv/wide.m7")
+    assert watch.latest_submodule_time("/srv/wide.py") == 1000
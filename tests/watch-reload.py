@@ -0,0 +1,139 @@
+import __builtin__
+import imp
+import nose
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import tangelo
+import tangelo.util
+
+# Load the watch plugin's module on its own, undoing the import hooks it
+# installs.
+builtin_import = __builtin__.__import__
+module_cache_get = tangelo.util.module_cache_get
+try:
+    watch = imp.load_module("watch_plugin_reload", None, "tangelo/tangelo/pkgdata/plugin/watch/python", ("", "", imp.PKG_DIRECTORY))
+finally:
+    __builtin__.__import__ = builtin_import
+    tangelo.util.module_cache_get = module_cache_get
+
+directory = None
+service = None
+
+# A service that counts its loads in a global variable kept across reloads.
+source = """import time
+try:
+    loads += 1
+except NameError:
+    loads = 1
+time.sleep(%s)
+version = %d
+"""
+
+
+def setup():
+    global directory, service
+    directory = tempfile.mkdtemp()
+    service = os.path.join(directory, "service.py")
+
+
+def teardown():
+    shutil.rmtree(directory)
+    sys.modules.pop(service[:-3], None)
+
+
+def write(content, mtime):
+    with open(service, "w") as f:
+        f.write(content)
+    os.utime(service, (mtime, mtime))
+
+
+def test_reload_swaps_module():
+    cache = tangelo.util.ModuleCache(config=False)
+
+    write(source % (0, 1), 1000)
+    old = watch.watch_module_cache_get(cache, service)
+    assert old.version == 1
+    assert old.loads == 1
+
+    # Reload a slow new version in the background; meanwhile, the old version
+    # is still served, without waiting.
+    write(source % (1, 2), 2000)
+    reloader = threading.Thread(target=watch.watch_module_cache_get, args=(cache, service))
+    reloader.start()
+    time.sleep(0.3)
+
+    start = time.time()
+    assert watch.watch_module_cache_get(cache, service) is old
+    assert time.time() - start < 0.5
+
+    reloader.join()
+    new = watch.watch_module_cache_get(cache, service)
+    assert new is not old
+    assert new.version == 2
+    assert new.loads == 2
+    assert sys.modules[service[:-3]] is new
+
+    # The old version is untouched.
+    assert old.version == 1
+    assert old.loads == 1
+
+    # A version that fails to load leaves the current one in place.
+    write("version = (\n", 3000)
+    nose.tools.assert_raises(SyntaxError, watch.watch_module_cache_get, cache, service)
+    assert cache.modules[service] is new
+    assert sys.modules[service[:-3]] is new
+
+
+class FakeWatcher(object):
+    """
+    Counts changes to the files it has been asked to watch, as the inotify
+    watcher does.
+    """
+    def __init__(self):
+        self.files = set()
+        self.count = 0
+
+    def watch(self, filename):
+        self.files.add(filename)
+
+    def current(self):
+        return self.count
+
+    def change(self, filename):
+        if filename in self.files:
+            self.count += 1
+
+
+def test_change_during_load():
+    cache = tangelo.util.ModuleCache(config=False)
+    raced = os.path.join(directory, "raced.py")
+
+    def change():
+        time.sleep(0.2)
+        with open(raced, "w") as f:
+            f.write(source % (0, 2))
+        os.utime(raced, (2000, 2000))
+        watch.FileWatcher.change(raced)
+
+    watch.FileWatcher = FakeWatcher()
+    try:
+        with open(raced, "w") as f:
+            f.write(source % (0.5, 1))
+        os.utime(raced, (1000, 1000))
+
+        # The module changes while it is being loaded; the change is noticed
+        # on the next request, since the module was already being watched.
+        changer = threading.Thread(target=change)
+        changer.start()
+        assert watch.watch_module_cache_get(cache, raced).version == 1
+        changer.join()
+
+        assert watch.watch_module_cache_get(cache, raced).version == 2
+    finally:
+        watch.FileWatcher = None
+        sys.modules.pop(raced[:-3], None)
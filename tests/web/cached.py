@@ -0,0 +1,9 @@
+import tangelo
+
+
+def run(officer="picard", mood=None):
+    store = tangelo.store()
+    store["calls"] = store.get("calls", 0) + 1
+
+    return {"officer": officer,
+            "calls": store["calls"]}
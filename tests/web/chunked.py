@@ -0,0 +1,15 @@
+import tangelo
+
+
+def run(count=3, format=None, fail=False):
+    def sequence():
+        for i in xrange(int(count)):
+            yield {"index": i, "square": i * i}
+
+        if fail:
+            raise RuntimeError("warp core breach")
+
+    if format is not None:
+        return tangelo.chunked(sequence(), format)
+
+    return sequence()
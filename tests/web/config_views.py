@@ -0,0 +1,25 @@
+import copy
+import tangelo
+
+
+def run(action="read"):
+    if action == "read":
+        config = tangelo.config()
+        return {"same": config is tangelo.config(),
+                "crew": config["crew"]}
+    elif action == "write":
+        try:
+            tangelo.config()["crew"].append("wesley")
+        except TypeError as e:
+            return {"error": str(e)}
+    elif action == "mutable":
+        config = tangelo.config(mutable=True)
+        config["crew"].append("wesley")
+        config["ship"] = "stargazer"
+
+        deep = copy.deepcopy(tangelo.config())
+        deep["ship"] = "enterprise-d"
+
+        return {"copy": config,
+                "deepcopy": deep,
+                "original": tangelo.config()}
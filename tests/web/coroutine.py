@@ -0,0 +1,43 @@
+import threading
+import time
+import trollius as asyncio
+from trollius import From, Return
+
+import tangelo
+
+
+@asyncio.coroutine
+def scan(delay):
+    yield From(asyncio.sleep(delay))
+    raise Return({"thread": threading.current_thread().name,
+                  "path": tangelo.request_path()})
+
+
+@tangelo.restful
+@tangelo.types(count=int, delay=float)
+@asyncio.coroutine
+def get(tag=None, count=3, delay=0.5, status=None):
+    start = time.time()
+    scans = yield From(asyncio.gather(*[scan(delay) for i in xrange(count)]))
+
+    if status is not None:
+        tangelo.http_status(int(status), "Custom Status")
+
+    raise Return({"threads": [s["thread"] for s in scans],
+                  "paths": [s["path"] for s in scans],
+                  "elapsed": time.time() - start,
+                  "path": tangelo.request_path()})
+
+
+@tangelo.restful
+@asyncio.coroutine
+def post():
+    yield From(asyncio.sleep(0))
+    raise ValueError("shields down")
+
+
+@tangelo.restful
+@asyncio.coroutine
+def delete():
+    asyncio.Task.current_task().cancel()
+    yield From(asyncio.sleep(0))
@@ -0,0 +1,5 @@
+import tangelo
+
+
+def run(path=None):
+    return tangelo.module_path(path)
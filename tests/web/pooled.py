@@ -0,0 +1,26 @@
+import os
+import time
+
+import tangelo
+
+
+def run(action="pid"):
+    if action == "pid":
+        return {"pid": os.getpid(),
+                "parent": os.getppid()}
+    elif action == "config":
+        return tangelo.config()
+    elif action == "text":
+        tangelo.content_type("text/plain")
+        return "Engage"
+    elif action == "status":
+        tangelo.http_status(409, "Red Alert")
+        return {"alert": "red"}
+    elif action == "generator":
+        return (i * i for i in xrange(4))
+    elif action == "fail":
+        raise RuntimeError("warp core breach")
+    elif action == "sleep":
+        time.sleep(3)
+    elif action == "store":
+        return tangelo.store()
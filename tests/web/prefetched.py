@@ -0,0 +1,7 @@
+import time
+
+
+def stream(delay="0.2"):
+    for i in range(10):
+        time.sleep(float(delay))
+        yield i
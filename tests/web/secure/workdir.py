@@ -0,0 +1,6 @@
+import os
+
+
+def stream():
+    # The directory the service was started in.
+    return iter([os.path.basename(os.getcwd())])
@@ -0,0 +1,21 @@
+class Letters(object):
+    def __init__(self, letters):
+        self.letters = letters
+        self.position = 0
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        if self.position >= len(self.letters):
+            raise StopIteration
+
+        self.position += 1
+        return self.letters[self.position - 1]
+
+    def seek(self, position):
+        self.position = position
+
+
+def stream(letters="abcde"):
+    return Letters(letters)
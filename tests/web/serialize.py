@@ -0,0 +1,15 @@
+import datetime
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def run(kind="plain"):
+    if kind == "plain":
+        return {"stardate": datetime.datetime(2364, 9, 28, 12, 0, 0),
+                "crew": ["picard", "riker", "data"]}
+    elif kind == "numpy":
+        return {"readings": numpy.arange(4),
+                "mean": numpy.float64(1.5)}
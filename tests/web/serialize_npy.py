@@ -0,0 +1,7 @@
+def run(kind=None):
+    if kind == "fail":
+        raise RuntimeError("no readings")
+    elif kind == "report":
+        return {"crew": ["picard", "riker", "data"]}
+
+    return [[1, 2, 3], [4, 5, 6]]